@@ -16,14 +16,27 @@ import time
 import argparse
 import secrets
 import base64
-from collections import deque
-from dataclasses import dataclass, field
-from typing import Set, List, Dict, Optional, Tuple
+import heapq
+import random
+import sys
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from functools import lru_cache, partial
+from typing import Callable, Set, List, Dict, Optional, Tuple
 from urllib.parse import urlparse
+import ipaddress
+import socket
+import ssl
 import websockets
 import websockets.exceptions
+from websockets.asyncio.client import ClientConnection
 from embit import ec
 
+from raw_websocket import RawWebSocket, RawWebSocketClosed, RawWebSocketError
+from relay_dns import CachingResolver, configure_default_resolver, default_resolver, is_nxdomain, socket_address
+
 
 # Configure logging
 logging.basicConfig(
@@ -35,6 +48,191 @@ logger = logging.getLogger(__name__)
 # Save progress every N relays processed
 SAVE_POINT = 10
 
+# Fold the crawl journal into the results file every N seconds
+COMPACT_INTERVAL = 60
+
+# Version of the crawl checkpoint format written by save_checkpoint
+CHECKPOINT_VERSION = 1
+
+# Version of the per-relay state file written by RelayStateStore
+STATE_VERSION = 1
+
+# Exponential backoff applied to relays that keep failing across runs
+BACKOFF_BASE = 6 * 3600
+BACKOFF_MAX = 30 * 86400
+
+# Relays still in backoff that are re-checked anyway each run
+RECHECK_BUDGET = 50
+
+# Adaptive timeouts: per-relay latency samples kept, and how they become timeouts
+LATENCY_SAMPLES = 10
+LATENCY_MIN_SAMPLES = 3
+LATENCY_PERCENTILE = 0.95
+TIMEOUT_MULTIPLIER = 2.0
+# phase -> (default, floor, ceiling) in seconds; connect defaults to --timeout
+TIMEOUT_BOUNDS = {
+    "connect": (None, 1.0, 15.0),
+    "first_frame": (5.0, 1.0, 15.0),
+    "eose": (30.0, 3.0, 60.0),
+}
+
+# Concurrency auto-tuning (AIMD): --batch-size is the starting level
+MAX_CONCURRENCY = 200
+AIMD_MIN_WINDOW = 10  # probe outcomes judged together, at least one per slot
+AIMD_INCREASE = 1
+AIMD_DECREASE = 0.5
+AIMD_ERROR_SPIKE = 0.15  # error rate above the stable baseline that counts as congestion
+AIMD_LATENCY_SPIKE = 2.0  # median latency over the stable baseline that counts as congestion
+AIMD_BASELINE_WEIGHT = 0.3
+# Failures that grow when the crawler itself is overloaded
+CONGESTION_ERRORS = frozenset({"timeout", "network", "dns"})
+
+# Failures worth another attempt within the run. A missing name, a refused
+# connection, a bad certificate or a protocol error will not change in a
+# few seconds; a timeout, a reset, a resolver hiccup or a rate limit may.
+TRANSIENT_FAILURES = frozenset({"timeout", "network", "closed", "dns", "rate_limited"})
+RETRY_ATTEMPTS = 2
+RETRY_DELAY = 5.0  # before the first retry, doubling for each one after
+RETRY_RATE_LIMIT_FACTOR = 6  # rate-limited relays wait this many times longer
+RETRY_JITTER = 0.2
+
+# Pre-screen: bare DNS/TCP(/TLS) reachability checks run ahead of full probes
+PRESCREEN_CONCURRENCY = 200
+PRESCREEN_TIMEOUT = 3.0
+
+# Probe tiers, cheapest first, and how often a stable relay is due for each
+# costlier tier when tiers are scheduled; runs drift by a few hours each day
+PROBE_TIERS = ("handshake", "nip11", "req", "harvest")
+TIER_INTERVALS = {"nip11": 7 * 86400, "req": 2 * 86400, "harvest": 4 * 86400}
+TIER_SLACK = 3 * 3600
+NIP11_MAX_BYTES = 64 * 1024
+
+# Daemon mode: known relays are re-probed on their own jittered schedules,
+# from the minimum interval up to the maximum while they stay stable
+DAEMON_MIN_INTERVAL = 300.0
+DAEMON_MAX_INTERVAL = 1800.0
+DAEMON_JITTER = 0.2
+
+# Probe history: daily outcome counts kept per relay, and the half-life of
+# their weight in the uptime and latency scores
+HISTORY_DAYS = 28
+HISTORY_HALF_LIFE_DAYS = 7.0
+
+# Follow-list harvesting: events per REQ page and per-relay budgets
+HARVEST_MAX_SECONDS = 30.0
+HARVEST_PAGE_SIZE = 300
+HARVEST_MAX_EVENTS = 1500
+HARVEST_MAX_BYTES = 8 * 2**20
+
+# Outbox model: kind 10002 lookups by author pubkeys taken from follow lists
+OUTBOX_CHUNK_SIZE = 100
+OUTBOX_MAX_SUBSCRIPTIONS = 3
+OUTBOX_PUBKEYS_PER_RELAY = 1000
+OUTBOX_MAX_PUBKEYS = 200_000
+OUTBOX_TIMEOUT = 20.0
+
+PUBKEY_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+# NOTICE and CLOSED texts of relays asking clients to slow down; NIP-01 uses
+# the "rate-limited:" prefix, older relays free text
+RATE_LIMIT_PATTERN = re.compile(r'rate.?limit|too many|slow down', re.IGNORECASE)
+
+# Event ids and replaceable (pubkey, kind) keys remembered for deduplication
+DEDUP_CACHE_SIZE = 100_000
+
+# Distinct raw relay URL spellings remembered by canonicalize_relay_url
+CANONICAL_URL_CACHE_SIZE = 65_536
+
+# Hosts whose latest TLS session is kept for resumption
+TLS_SESSION_CACHE_SIZE = 4096
+
+_URL_FORBIDDEN_CHARS = frozenset("/?#@\\[] \t\r\n")
+_HOST_CHARS = frozenset("abcdefghijklmnopqrstuvwxyz0123456789.-")
+
+
+def default_checkpoint_path(output_file: str) -> str:
+    """Derive the checkpoint path that sits next to a results file"""
+    base, _ = os.path.splitext(output_file)
+    return f"{base}.checkpoint.json"
+
+
+def default_journal_path(output_file: str) -> str:
+    """Derive the crawl journal path that sits next to a results file"""
+    base, _ = os.path.splitext(output_file)
+    return f"{base}.journal.jsonl"
+
+
+def write_text_atomic(path: str, text: str):
+    """Write text to a temporary file and rename it over ``path``
+
+    A crash mid-write leaves the previous file intact instead of a truncated one.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def write_json_atomic(path: str, data, indent: Optional[int] = None):
+    """Write JSON atomically, see write_text_atomic"""
+    write_text_atomic(path, json.dumps(data, indent=indent))
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    """Return the nearest-rank percentile of a non-empty list of samples"""
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def record_history(history: Dict, functioning: bool, latency: Optional[float], now: float):
+    """Add one probe outcome to a relay's daily history
+
+    ``history`` holds three parallel lists, one entry per day ending with
+    day number ``day``: probes made, probes answered, and the summed latency
+    of the answered ones in milliseconds. Only the last HISTORY_DAYS days
+    are kept. The lists are copied rather than mutated, a snapshot may be
+    serialising them.
+    """
+    day = int(now // 86400)
+    probes = list(history.get("probes", []))
+    ok = list(history.get("ok", []))
+    latency_ms = list(history.get("latency_ms", []))
+    gap = min(day - history["day"], HISTORY_DAYS) if probes else 1
+    if gap > 0:
+        probes, ok, latency_ms = probes + [0] * gap, ok + [0] * gap, latency_ms + [0] * gap
+
+    probes[-1] += 1
+    if functioning:
+        ok[-1] += 1
+        latency_ms[-1] += round((latency or 0.0) * 1000)
+    history["day"] = max(day, history.get("day", day))
+    history["probes"] = probes[-HISTORY_DAYS:]
+    history["ok"] = ok[-HISTORY_DAYS:]
+    history["latency_ms"] = latency_ms[-HISTORY_DAYS:]
+
+
+def health_scores(history: Dict, now: float) -> Dict:
+    """Decayed uptime (0-1) and mean latency of a relay from its daily history
+
+    A day's weight halves every HISTORY_HALF_LIFE_DAYS, so recent behaviour
+    dominates. ``latency_ms`` is None when the relay never answered.
+    """
+    day = int(now // 86400)
+    weighted_probes = weighted_ok = weighted_latency = 0.0
+    last = len(history["probes"]) - 1
+    for i, (probes, ok, latency_ms) in enumerate(zip(history["probes"], history["ok"], history["latency_ms"])):
+        weight = 0.5 ** ((day - history["day"] + last - i) / HISTORY_HALF_LIFE_DAYS)
+        weighted_probes += weight * probes
+        weighted_ok += weight * ok
+        weighted_latency += weight * latency_ms
+    return {
+        "uptime": round(weighted_ok / weighted_probes, 4) if weighted_probes else 0.0,
+        "latency_ms": round(weighted_latency / weighted_ok) if weighted_ok else None,
+        "probes": sum(history["probes"]),
+    }
+
+
 @dataclass
 class RelayDiscoveryStats:
     """Statistics for the relay discovery process"""
@@ -43,6 +241,13 @@ class RelayDiscoveryStats:
     events_processed: int = 0
     existing_relays_verified: int = 0
     existing_relays_failed: int = 0
+    relays_deferred: int = 0
+    outbox_pubkeys_queried: int = 0
+    duplicate_events_dropped: int = 0
+    eliminated: Dict[str, int] = field(default_factory=dict)  # stage (dns, tcp, tls, probe) -> relays
+    probes_by_tier: Dict[str, int] = field(default_factory=dict)
+    retries_scheduled: int = 0
+    retries_recovered: int = 0
     start_time: float = field(default_factory=time.time)
     
     def print_stats(self):
@@ -53,29 +258,716 @@ class RelayDiscoveryStats:
         print(f"Total relays found: {self.total_relays_found}")
         print(f"Functioning relays: {self.functioning_relays}")
         print(f"Events processed: {self.events_processed}")
+        if self.duplicate_events_dropped > 0:
+            print(f"Duplicate events dropped: {self.duplicate_events_dropped}")
+        if self.outbox_pubkeys_queried > 0:
+            print(f"Pubkeys queried for relay lists: {self.outbox_pubkeys_queried}")
         if self.existing_relays_verified > 0 or self.existing_relays_failed > 0:
             print(f"Existing relays verified: {self.existing_relays_verified}")
             print(f"Existing relays failed verification: {self.existing_relays_failed}")
+        if self.relays_deferred > 0:
+            print(f"Relays deferred by failure backoff: {self.relays_deferred}")
+        if self.eliminated:
+            stages = ", ".join(f"{stage}: {count}" for stage, count in self.eliminated.items())
+            print(f"Relays eliminated by stage: {stages}")
+        if self.probes_by_tier:
+            tiers = ", ".join(f"{tier}: {self.probes_by_tier[tier]}" for tier in PROBE_TIERS if tier in self.probes_by_tier)
+            print(f"Probes by tier: {tiers}")
+        if self.retries_scheduled > 0:
+            print(f"Retries after transient failures: {self.retries_scheduled} ({self.retries_recovered} recovered)")
         print(f"Success rate: {(self.functioning_relays/max(1, self.total_relays_found)*100):.1f}%")
 
 
+class RelayProbeError(Exception):
+    """A relay accepted the connection but did not answer like a Nostr relay"""
+
+    def __init__(self, kind: str, message: str):
+        super().__init__(message)
+        self.kind = kind
+
+
+def classify_failure(error: BaseException) -> str:
+    """Map a probe exception to a short, stable error class name"""
+    if isinstance(error, RelayProbeError):
+        return error.kind
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+        return "timeout"
+    if isinstance(error, socket.gaierror):
+        return "nxdomain" if is_nxdomain(error) else "dns"
+    if isinstance(error, ConnectionRefusedError):
+        return "refused"
+    if isinstance(error, (ssl.SSLError, ssl.CertificateError)):
+        return "tls"
+    if isinstance(error, PermissionError):
+        return "auth"
+    if isinstance(error, (websockets.exceptions.InvalidHandshake, RawWebSocketError)):
+        response = getattr(error, "response", None)
+        status = getattr(error, "status", None) or getattr(response, "status_code", None)
+        return "rate_limited" if status == 429 else "handshake"
+    if isinstance(error, (websockets.exceptions.ConnectionClosed, RawWebSocketClosed)):
+        return "closed"
+    if isinstance(error, OSError):
+        return "network"
+    return "error"
+
+
+@dataclass
+class ProbeTimings:
+    """Where the time of one relay probe went, in seconds, and what it returned"""
+    dns: Optional[float] = None
+    tcp: Optional[float] = None
+    tls: Optional[float] = None
+    ws_upgrade: Optional[float] = None
+    auth: Optional[float] = None  # NIP-42 AUTH sent until the relay's OK
+    first_frame: Optional[float] = None  # liveness REQ sent until the first reply
+    eose: Optional[float] = None  # first follow-list page until its EOSE
+    tls_resumed: Optional[bool] = None  # whether the TLS handshake resumed an earlier session
+    bytes_received: int = 0
+    events: int = 0
+
+    def as_dict(self) -> Dict:
+        """Return the measured fields, with times rounded to milliseconds"""
+        return {
+            name: round(value, 3) if isinstance(value, float) else value
+            for name, value in asdict(self).items()
+            if value is not None
+        }
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    """Client TLS context that offers each host the session of its last connection
+
+    asyncio gives no way to pass a session to a handshake, so the context
+    looks the session up by server name when asyncio wraps the socket.
+    Sessions are remembered per host after each connection and bounded in
+    an LRU; ``handshakes`` and ``resumed`` count how often that paid off.
+    """
+
+    def __new__(cls, protocol=ssl.PROTOCOL_TLS_CLIENT, *args, **kwargs):
+        return super().__new__(cls, protocol, *args, **kwargs)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.load_default_certs(ssl.Purpose.SERVER_AUTH)
+        self.sessions: OrderedDict = OrderedDict()  # server name -> ssl.SSLSession
+        self.handshakes = 0
+        self.resumed = 0
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        if session is None and not server_side:
+            session = self.sessions.get(server_hostname)
+        return super().wrap_bio(
+            incoming, outgoing, server_side=server_side, server_hostname=server_hostname, session=session
+        )
+
+    def remember(self, server_hostname: str, ssl_object) -> None:
+        """Keep a connection's session so the next handshake with the host can resume it"""
+        session = ssl_object.session if ssl_object is not None else None
+        if session is None or not server_hostname:
+            return
+        self.sessions[server_hostname] = session
+        self.sessions.move_to_end(server_hostname)
+        while len(self.sessions) > TLS_SESSION_CACHE_SIZE:
+            self.sessions.popitem(last=False)
+
+    def count_handshake(self, ssl_object) -> bool:
+        """Count a completed handshake and return whether it was resumed"""
+        self.handshakes += 1
+        if ssl_object.session_reused:
+            self.resumed += 1
+            return True
+        return False
+
+    def hit_rate(self) -> float:
+        """Share of handshakes that resumed an earlier session"""
+        return self.resumed / max(1, self.handshakes)
+
+    def summary(self) -> Dict:
+        return {"handshakes": self.handshakes, "resumed": self.resumed}
+
+
+class TimedClientConnection(ClientConnection):
+    """Client connection that notes when the transport is ready and counts bytes received"""
+
+    def __init__(self, protocol, *, timings: ProbeTimings, **kwargs):
+        super().__init__(protocol, **kwargs)
+        self.timings = timings
+        self.transport_ready: Optional[float] = None
+
+    def connection_made(self, transport):
+        # asyncio calls this once the TLS handshake, if any, has completed
+        self.transport_ready = time.monotonic()
+        super().connection_made(transport)
+
+    def data_received(self, data: bytes):
+        self.timings.bytes_received += len(data)
+        super().data_received(data)
+
+
+def peer_address(remote_address) -> Optional[Dict]:
+    """Describe a connection's remote address as ``{"ip": ..., "family": "ipv4"|"ipv6"}``"""
+    if not remote_address:
+        return None
+    try:
+        ip = ipaddress.ip_address(remote_address[0].split("%")[0])
+    except ValueError:
+        return None
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return {"ip": str(ip), "family": f"ipv{ip.version}"}
+
+
+@dataclass
+class RelayProbeResult:
+    """Outcome of probing a single relay"""
+    functioning: bool = False
+    relays: Set[str] = field(default_factory=set)  # relay URLs found in harvested events
+    events: int = 0  # harvested events that were processed
+    error: Optional[str] = None
+    latency: Optional[float] = None  # seconds from connecting to the first protocol frame
+    timings: ProbeTimings = field(default_factory=ProbeTimings)
+    address: Optional[Dict] = None  # peer the probe connected to, see peer_address
+
+
+class RelayStateStore:
+    """Per-relay state kept across runs in a JSON file
+
+    Each relay maps to a dict of named sections (for example ``failures``), so
+    independent features can keep their own history side by side.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.relays: Dict[str, Dict[str, Dict]] = {}
+
+    def load(self):
+        """Load the state file, starting empty if it is missing or unreadable"""
+        if not os.path.exists(self.path):
+            return
+
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if data.get("version") != STATE_VERSION:
+                logger.warning(f"Ignoring relay state with unsupported version {data.get('version')}")
+                return
+            self.relays = data.get("relays", {})
+            logger.info(f"Loaded state for {len(self.relays)} relays from {self.path}")
+        except Exception as e:
+            logger.error(f"Error loading relay state: {e}")
+
+    def get(self, relay_url: str, section: str) -> Optional[Dict]:
+        """Return a relay's section, or None if it has none"""
+        return self.relays.get(relay_url, {}).get(section)
+
+    def section(self, relay_url: str, section: str) -> Dict:
+        """Return a relay's section, creating it if needed"""
+        return self.relays.setdefault(relay_url, {}).setdefault(section, {})
+
+    def clear(self, relay_url: str, section: str):
+        """Remove a relay's section, and the relay once it has no sections left"""
+        sections = self.relays.get(relay_url)
+        if sections is None:
+            return
+        sections.pop(section, None)
+        if not sections:
+            del self.relays[relay_url]
+
+    def prune(self, now: float) -> int:
+        """Forget relays that are still failing and were not probed for HISTORY_DAYS
+
+        A relay's last probe is its last recorded failure or the last day of its
+        history, whichever is later. Relays that answered since keep their state,
+        since a success clears the ``failures`` section, and so do relays still
+        backing off: dropping those would reset their backoff to the shortest
+        step. Returns how many relays were dropped.
+        """
+        cutoff = now - HISTORY_DAYS * 86400
+        stale = []
+        for relay_url, sections in self.relays.items():
+            failures = sections.get("failures")
+            if failures is None or failures.get("next_eligible", 0.0) > now:
+                continue
+            last_probe = failures.get("last_failure", 0.0)
+            history = sections.get("history")
+            if history and history.get("probes"):
+                last_probe = max(last_probe, (history["day"] + 1) * 86400)
+            if last_probe < cutoff:
+                stale.append(relay_url)
+        for relay_url in stale:
+            del self.relays[relay_url]
+        return len(stale)
+
+    def snapshot(self) -> Dict:
+        """Copy the state so it can be written while the crawl keeps updating it"""
+        return {
+            "version": STATE_VERSION,
+            "relays": {
+                relay_url: {name: dict(values) for name, values in sections.items()}
+                for relay_url, sections in sorted(self.relays.items())
+            },
+        }
+
+    def save(self, snapshot: Optional[Dict] = None):
+        """Write the state file atomically, one relay per line to keep diffs small"""
+        snapshot = snapshot or self.snapshot()
+        lines = [
+            f"{json.dumps(relay_url)}: {json.dumps(sections, separators=(',', ':'), sort_keys=True)}"
+            for relay_url, sections in snapshot["relays"].items()
+        ]
+        write_text_atomic(
+            self.path,
+            f'{{"version": {snapshot["version"]}, "relays": {{\n' + ",\n".join(lines) + "\n}}\n",
+        )
+
+
+def canonicalize_relay_url(url) -> Optional[str]:
+    """Return the canonical ``wss://host[:port]`` form of a relay URL, or None
+
+    Case, a trailing slash, trailing dots on the host, the default ``:443``
+    port and IDNA spellings are folded, so every spelling of a relay maps to
+    one interned string. URLs with a path, query, credentials or a non-wss
+    scheme are rejected. Results are memoized, since the same few thousand
+    URLs recur across hundreds of thousands of tags.
+    """
+    if not isinstance(url, str):
+        return None
+    return _canonicalize_relay_url(url)
+
+
+@lru_cache(maxsize=CANONICAL_URL_CACHE_SIZE)
+def _canonicalize_relay_url(url: str) -> Optional[str]:
+    url = url.strip()
+    if url[:6].lower() != "wss://":
+        return None
+
+    authority = url[6:]
+    if authority.endswith("/"):
+        authority = authority[:-1]
+    if not authority or not _URL_FORBIDDEN_CHARS.isdisjoint(authority):
+        return None
+
+    host, _, port = authority.partition(":")
+    if port:
+        if not port.isdigit() or not 0 < int(port) < 65536:
+            return None
+        port = "" if int(port) == 443 else str(int(port))
+
+    host = host.rstrip(".").lower()
+    if not host.isascii():
+        try:
+            host = host.encode("idna").decode("ascii")
+        except UnicodeError:
+            return None
+
+    if not host or len(host) > 253 or not _HOST_CHARS.issuperset(host):
+        return None
+    if any(not label or len(label) > 63 for label in host.split(".")):
+        return None
+
+    return sys.intern(f"wss://{host}:{port}" if port else f"wss://{host}")
+
+
+def is_replaceable_kind(kind) -> bool:
+    """Return whether relays keep only the latest event per (pubkey, kind) for ``kind`` (NIP-01)"""
+    return isinstance(kind, int) and (kind in (0, 3) or 10000 <= kind < 20000)
+
+
+class EventDeduplicator:
+    """Bounded filter that drops events already seen on another relay
+
+    Events are keyed by id, and replaceable events additionally by
+    ``(pubkey, kind)`` so that only a newer version than the one already
+    processed gets through. Both tables evict their oldest entries once they
+    hold ``max_size`` keys.
+    """
+
+    def __init__(self, max_size: int = DEDUP_CACHE_SIZE):
+        self.max_size = max_size
+        self.ids: OrderedDict = OrderedDict()
+        self.latest: OrderedDict = OrderedDict()  # (pubkey, kind) -> (created_at, id)
+
+    @staticmethod
+    def _remember(table: OrderedDict, key, value, max_size: int):
+        table[key] = value
+        table.move_to_end(key)
+        if len(table) > max_size:
+            table.popitem(last=False)
+
+    def accept(self, event: Dict) -> bool:
+        """Return True the first time an event (or a newer replaceable version) is seen"""
+        event_id = event.get("id")
+        if event_id is not None:
+            if event_id in self.ids:
+                self.ids.move_to_end(event_id)
+                return False
+            self._remember(self.ids, event_id, None, self.max_size)
+
+        kind = event.get("kind")
+        pubkey = event.get("pubkey")
+        created_at = event.get("created_at")
+        if is_replaceable_kind(kind) and isinstance(pubkey, str) and isinstance(created_at, int):
+            key = (pubkey, kind)
+            version = (created_at, event_id or "")
+            known = self.latest.get(key)
+            # Newest created_at wins; ties go to the lowest id
+            if known is not None and (known[0] > created_at or (known[0] == created_at and known[1] <= version[1])):
+                return False
+            self._remember(self.latest, key, version, self.max_size)
+
+        return True
+
+
+class ConcurrencyController:
+    """Additive-increase/multiplicative-decrease tuning of relays probed at once
+
+    Probe outcomes are judged in windows of at least one per slot. A window
+    whose congestion error rate and median latency stay close to the stable
+    baseline raises the level by ``AIMD_INCREASE``; an error or latency spike
+    multiplies it by ``AIMD_DECREASE``. The baseline only learns from stable
+    windows, so relays that are simply dead do not read as congestion.
+    """
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = MAX_CONCURRENCY):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.level = min(max(initial, self.minimum), self.maximum)
+        self.peak = self.level
+        self.adjustments = 0
+        self.baseline_error: Optional[float] = None
+        self.baseline_latency: Optional[float] = None
+        self.failures = 0
+        self.latencies: List[float] = []
+        self.outcomes = 0
+
+    @property
+    def fixed(self) -> bool:
+        return self.minimum == self.maximum
+
+    def record(self, latency: Optional[float], congested: bool) -> bool:
+        """Count one probe outcome; return True if the level changed"""
+        self.outcomes += 1
+        self.failures += congested
+        if latency is not None:
+            self.latencies.append(latency)
+        if self.fixed or self.outcomes < max(AIMD_MIN_WINDOW, self.level):
+            return False
+
+        error_rate = self.failures / self.outcomes
+        median_latency = percentile(self.latencies, 0.5) if self.latencies else None
+        self.outcomes = self.failures = 0
+        self.latencies = []
+
+        spike = self.baseline_error is not None and error_rate > self.baseline_error + AIMD_ERROR_SPIKE
+        if median_latency is not None and self.baseline_latency is not None:
+            spike = spike or median_latency > self.baseline_latency * AIMD_LATENCY_SPIKE
+
+        previous = self.level
+        if spike:
+            self.level = max(self.minimum, int(self.level * AIMD_DECREASE))
+        else:
+            self.level = min(self.maximum, self.level + AIMD_INCREASE)
+            self.baseline_error = self._blend(self.baseline_error, error_rate)
+            if median_latency is not None:
+                self.baseline_latency = self._blend(self.baseline_latency, median_latency)
+        self.peak = max(self.peak, self.level)
+
+        if self.level == previous:
+            return False
+        self.adjustments += 1
+        latency_text = f"{median_latency:.2f}s" if median_latency is not None else "n/a"
+        logger.info(
+            f"Concurrency {'cut' if spike else 'raised'} from {previous} to {self.level} "
+            f"(error rate {error_rate:.0%}, median latency {latency_text})"
+        )
+        return True
+
+    @staticmethod
+    def _blend(baseline: Optional[float], value: float) -> float:
+        if baseline is None:
+            return value
+        return baseline + AIMD_BASELINE_WEIGHT * (value - baseline)
+
+    def summary(self) -> Dict:
+        return {"final": self.level, "peak": self.peak, "adjustments": self.adjustments}
+
+
+class RelayFrontier:
+    """Priority queue of relays waiting to be probed
+
+    Relays are ordered by BFS depth first and, within a depth, by how many
+    distinct pubkeys (or events, when no pubkey is known) referenced them, so
+    under a time or connection budget the widely used relays are probed first.
+    Ties keep insertion order. Priorities only ever improve, which lets the
+    heap use lazy decrease-key: a changed relay gets a fresh entry and
+    outdated entries are skipped when they surface.
+    """
+
+    def __init__(self):
+        self.heap: List[Tuple[int, int, int, str]] = []  # (depth, -score, seq, relay_url)
+        self.depths: Dict[str, int] = {}  # relays currently queued
+        self.scores: Dict[str, int] = {}
+        self.referrers: Dict[str, Set[int]] = {}
+        self.counter = 0
+
+    def __len__(self) -> int:
+        return len(self.depths)
+
+    def __contains__(self, relay_url: str) -> bool:
+        return relay_url in self.depths
+
+    def _push_entry(self, relay_url: str):
+        self.counter += 1
+        heapq.heappush(
+            self.heap,
+            (self.depths[relay_url], -self.scores.get(relay_url, 0), self.counter, relay_url),
+        )
+        # Drop outdated entries once they dominate the heap
+        if len(self.heap) > 4 * len(self.depths) + 64:
+            self.heap = [entry for entry in self.heap if self._is_current(entry)]
+            heapq.heapify(self.heap)
+
+    def _is_current(self, entry: Tuple[int, int, int, str]) -> bool:
+        depth, negative_score, _, relay_url = entry
+        return self.depths.get(relay_url) == depth and self.scores.get(relay_url, 0) == -negative_score
+
+    def push(self, relay_url: str, depth: int, score: int = 0) -> bool:
+        """Queue a relay, or move it to a shallower depth or higher score; return True if it was new"""
+        raised = score > self.scores.get(relay_url, 0)
+        if raised:
+            self.scores[relay_url] = score
+        current = self.depths.get(relay_url)
+        if current is not None and current <= depth:
+            if raised:
+                # The old entry is outdated now that the score changed
+                self._push_entry(relay_url)
+            return False
+        self.depths[relay_url] = depth
+        self._push_entry(relay_url)
+        return current is None
+
+    def add_reference(self, relay_url: str, referrer: str):
+        """Count a distinct pubkey or event referencing a relay"""
+        referrers = self.referrers.setdefault(relay_url, set())
+        key = hash(referrer)
+        if key in referrers:
+            return
+        referrers.add(key)
+        self.scores[relay_url] = self.scores.get(relay_url, 0) + 1
+        if relay_url in self.depths:
+            self._push_entry(relay_url)
+
+    def pop(self) -> Tuple[str, int]:
+        """Remove and return the highest priority ``(relay_url, depth)``"""
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            if self._is_current(entry):
+                relay_url = entry[3]
+                self.scores.pop(relay_url, None)
+                self.referrers.pop(relay_url, None)
+                return relay_url, self.depths.pop(relay_url)
+        raise IndexError("pop from an empty frontier")
+
+    def discard(self, relay_url: str):
+        """Remove a relay if it is queued"""
+        if self.depths.pop(relay_url, None) is not None:
+            self.scores.pop(relay_url, None)
+            self.referrers.pop(relay_url, None)
+
+    def forget(self, relay_url: str):
+        """Drop reference counts kept for a relay that will never be queued"""
+        if relay_url not in self.depths:
+            self.scores.pop(relay_url, None)
+            self.referrers.pop(relay_url, None)
+
+    def items(self) -> List[Tuple[str, int, int]]:
+        """Return queued ``(relay_url, depth, score)`` in priority order"""
+        return [
+            (entry[3], entry[0], -entry[1])
+            for entry in sorted(self.heap)
+            if self._is_current(entry)
+        ]
+
+    def clear(self):
+        self.heap.clear()
+        self.depths.clear()
+        self.scores.clear()
+        self.referrers.clear()
+
+
+class MeteredWebSocket:
+    """Wrap a WebSocket connection and count the size of received messages"""
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.bytes_received = 0
+
+    async def recv(self):
+        message = await self.websocket.recv()
+        self.bytes_received += len(message)
+        return message
+
+    async def send(self, message):
+        await self.websocket.send(message)
+
+
+class CrawlJournal:
+    """Append-only JSONL log of per-relay crawl outcomes
+
+    Outcomes are buffered as they happen and appended to disk by ``flush`` in a
+    worker thread, so saving progress costs only the new entries. Compaction
+    folds everything into the checkpoint and then truncates the journal.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.pending: List[str] = []
+        self.lock = asyncio.Lock()
+
+    def record(self, entry: Dict):
+        """Buffer one outcome for the next flush"""
+        self.pending.append(json.dumps(entry, separators=(",", ":")))
+
+    def discard_pending(self):
+        """Drop buffered outcomes that a checkpoint already covers"""
+        self.pending = []
+
+    def _append(self, lines: List[str]):
+        with open(self.path, 'a') as f:
+            f.write("".join(f"{line}\n" for line in lines))
+
+    async def flush(self):
+        """Append buffered outcomes to the journal file without blocking the loop"""
+        async with self.lock:
+            lines, self.pending = self.pending, []
+            if lines:
+                await asyncio.to_thread(self._append, lines)
+
+    def truncate(self):
+        """Empty the journal file"""
+        open(self.path, 'w').close()
+
+    def read(self) -> List[Dict]:
+        """Read all journal entries, skipping a partially written final line"""
+        if not os.path.exists(self.path):
+            return []
+
+        entries = []
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping malformed journal line in {self.path}")
+        return entries
+
+
 class NostrRelayDiscovery:
     """Nostr relay discovery tool using breadth-first search through follow lists"""
     
-    def __init__(self, initial_relay: str, max_depth: int = 3, connection_timeout: int = 5, output_file: str = "relay_discovery_results.json", save_point: int = SAVE_POINT, batch_size: int = 10, private_key: Optional[str] = None):
-        self.initial_relay = initial_relay
+    def __init__(
+        self,
+        initial_relay: str,
+        max_depth: int = 3,
+        connection_timeout: int = 5,
+        output_file: str = "relay_discovery_results.json",
+        save_point: int = SAVE_POINT,
+        batch_size: int = 10,
+        private_key: Optional[str] = None,
+        *,
+        checkpoint_file: Optional[str] = None,
+        resume: bool = False,
+        compact_interval: float = COMPACT_INTERVAL,
+        state_file: str = "relay_state.json",
+        recheck_budget: int = RECHECK_BUDGET,
+        harvest_page_size: int = HARVEST_PAGE_SIZE,
+        harvest_max_events: int = HARVEST_MAX_EVENTS,
+        harvest_max_bytes: int = HARVEST_MAX_BYTES,
+        incremental_harvest: bool = True,
+        deadline: Optional[float] = None,
+        outbox_chunk_size: int = OUTBOX_CHUNK_SIZE,
+        outbox_max_subscriptions: int = OUTBOX_MAX_SUBSCRIPTIONS,
+        outbox_pubkeys_per_relay: int = OUTBOX_PUBKEYS_PER_RELAY,
+        max_concurrency: int = MAX_CONCURRENCY,
+        resolver: Optional[CachingResolver] = None,
+        raw_probe: bool = False,
+        prescreen: bool = False,
+        prescreen_concurrency: int = PRESCREEN_CONCURRENCY,
+        prescreen_timeout: float = PRESCREEN_TIMEOUT,
+        prescreen_tls: bool = False,
+        max_tier: str = "harvest",
+        scheduled_tiers: bool = False,
+        daemon_min_interval: float = DAEMON_MIN_INTERVAL,
+        daemon_max_interval: float = DAEMON_MAX_INTERVAL,
+        retry_attempts: int = RETRY_ATTEMPTS,
+        retry_delay: float = RETRY_DELAY,
+    ):
+        self.initial_relay = canonicalize_relay_url(initial_relay) or initial_relay
         self.max_depth = max_depth
         self.connection_timeout = connection_timeout
         self.output_file = output_file
         self.save_point = save_point
         self.batch_size = batch_size
+        if max_concurrency <= batch_size:
+            # No headroom above the starting level: keep concurrency fixed
+            self.concurrency = ConcurrencyController(batch_size, minimum=batch_size, maximum=batch_size)
+        else:
+            self.concurrency = ConcurrencyController(batch_size, maximum=max_concurrency)
         self.private_key = self._load_private_key(private_key)
+        self.resolver = resolver or default_resolver()
+        self._tls_context: Optional[ResumingSSLContext] = None
+        self.raw_probe = raw_probe
+        self.prescreen = prescreen
+        self.prescreen_concurrency = prescreen_concurrency
+        self.prescreen_timeout = prescreen_timeout
+        self.prescreen_tls = prescreen_tls
+        self.max_tier = max_tier
+        self.scheduled_tiers = scheduled_tiers
+        self.daemon_min_interval = daemon_min_interval
+        self.daemon_max_interval = daemon_max_interval
+        self.monitoring = False
+        self.retry_attempts = retry_attempts
+        self.retry_delay = retry_delay
+        self.checkpoint_file = checkpoint_file or default_checkpoint_path(output_file)
+        self.resume = resume
+        self.compact_interval = compact_interval
+        self.journal = CrawlJournal(default_journal_path(output_file))
+        self.state = RelayStateStore(state_file)
+        self.recheck_budget = recheck_budget
+        self.harvest_page_size = harvest_page_size
+        self.harvest_max_events = harvest_max_events
+        self.harvest_max_bytes = harvest_max_bytes
+        self.incremental_harvest = incremental_harvest
+        self.outbox_chunk_size = outbox_chunk_size
+        self.outbox_max_subscriptions = outbox_max_subscriptions
+        self.outbox_pubkeys_per_relay = outbox_pubkeys_per_relay
+        self.deadline = deadline
+        # Enough time for one connection attempt and the liveness response
+        self.drain_window = connection_timeout + 5.0
+        self.draining = False
+        self.stopped_at_deadline = False
         
         # Discovery state
-        self.to_visit: deque = deque()  # (relay_url, depth) - will be populated by load_existing_results
-        self.to_visit_set: Set[str] = set()
+        self.to_visit = RelayFrontier()  # will be populated by load_existing_results
         self.visited_relays: Set[str] = set()
         self.functioning_relays: Set[str] = set()
+        self.failed_relays: Set[str] = set()
+        self.relay_timings: Dict[str, Dict] = {}  # relay_url -> ProbeTimings.as_dict() of this crawl
+        self.relay_addresses: Dict[str, Dict] = {}  # relay_url -> peer_address() of its last connection
+        self.in_progress: Dict[str, int] = {}  # relay_url -> depth, probed but not yet settled
+        self.deferred: Dict[str, int] = {}  # relay_url -> depth, skipped while in failure backoff
+        self.rechecks: Set[str] = set()  # deferred relays chosen to be probed anyway
+        self.screened: deque = deque()  # (relay_url, depth) that passed the pre-screen, waiting for a probe slot
+        self.checks: List[Tuple[float, str, int]] = []  # daemon heap of (due time, relay_url, depth)
+        self.next_check: Dict[str, float] = {}  # relay_url -> due time of its current heap entry
+        self.check_streaks: Dict[str, int] = {}  # relay_url -> consecutive successful daemon checks
+        self.retries: List[Tuple[float, str, int]] = []  # retry heap of (due time, relay_url, depth)
+        self.retrying: Dict[str, int] = {}  # relay_url -> depth, waiting in the retry heap
+        self.attempts: Dict[str, int] = {}  # relay_url -> retries made for its current outcome
+        self.outbox_pubkeys: deque = deque()  # follow-list pubkeys waiting for a kind 10002 lookup
+        self.seen_pubkeys: Set[str] = set()
+        self.deduplicator = EventDeduplicator()
+        self.background_writes: Set[asyncio.Task] = set()
         
         # Statistics
         self.stats = RelayDiscoveryStats()
@@ -109,16 +1001,8 @@ class NostrRelayDiscovery:
             return False
     
     def normalize_relay_url(self, url: str) -> str:
-        """Normalize relay URL (remove trailing slashes, etc.)"""
-        url = url.strip().lower()
-        match = re.match(r'^(wss://[^/]+)/?$', url)
-
-        if match:
-            matched_url = match.group(1)
-            logger.debug(f"matched url: {matched_url}")
-            return matched_url
-        else:
-            return ''
+        """Normalize relay URL (remove trailing slashes, etc.), or return '' if it is not usable"""
+        return canonicalize_relay_url(url) or ''
     
     def generate_subscription_id(self) -> str:
         """Generate a random subscription ID using 16 random bytes encoded as base64"""
@@ -185,13 +1069,15 @@ class NostrRelayDiscovery:
         return event
 
     async def receive_with_auth(
-        self, websocket, relay_url: str, timeout: float, request_message=None
+        self, websocket, relay_url: str, timeout: float, request_message=None,
+        timings: Optional[ProbeTimings] = None,
     ):
         """Receive one application message, completing NIP-42 if challenged.
 
         Some relays reject the request that triggered authentication before
         processing the AUTH response. When ``request_message`` is supplied, it
-        is sent again after authentication succeeds.
+        is sent again after authentication succeeds. The AUTH round trip is
+        stored in ``timings`` when given.
         """
         deadline = asyncio.get_running_loop().time() + timeout
 
@@ -214,6 +1100,7 @@ class NostrRelayDiscovery:
 
             auth_event = self.build_auth_event(relay_url, data[1])
             await websocket.send(json.dumps(["AUTH", auth_event]))
+            auth_sent = time.monotonic()
             logger.debug(f"Sent NIP-42 AUTH response to {relay_url}")
 
             remaining = deadline - asyncio.get_running_loop().time()
@@ -243,238 +1130,757 @@ class NostrRelayDiscovery:
                         )
                     break
 
+            if timings is not None:
+                timings.auth = time.monotonic() - auth_sent
             logger.debug(f"NIP-42 authentication succeeded with {relay_url}")
             if request_message is not None:
                 await websocket.send(json.dumps(request_message))
                 logger.debug(f"Resent request after NIP-42 authentication: {relay_url}")
     
-    async def test_relay_connection(self, relay_url: str) -> bool:
-        """Test if a relay is functioning by attempting to connect and validate Nostr protocol responses"""
+    def relay_health(self, relay_url: str) -> Optional[Dict]:
+        """Return a relay's decayed uptime and latency scores, or None without history"""
+        history = self.state.get(relay_url, "history")
+        return health_scores(history, time.time()) if history else None
+
+    def record_latency(self, relay_url: str, phase: str, seconds: float, timed_out: bool = False):
+        """Keep the most recent latency samples of a relay for one phase
+
+        A timed-out probe is stored negated: it is a lower bound on the
+        relay's latency, not a measurement.
+        """
+        latency = self.state.section(relay_url, "latency")
+        sample = round(seconds, 3)
+        # Replace rather than mutate the list, a snapshot may be serialising it
+        latency[phase] = (latency.get(phase, []) + [-sample if timed_out else sample])[-LATENCY_SAMPLES:]
+
+    def record_timeout(self, relay_url: str, phase: str, seconds: float):
+        """Count a timed-out phase towards a relay's window if it has answered in time before
+
+        This lets a slow but healthy relay earn a longer timeout, while a relay
+        that never answers keeps the default and stays cheap to give up on.
+        """
+        latency = self.state.get(relay_url, "latency")
+        samples = latency.get(phase, []) if latency else []
+        if sum(1 for sample in samples if sample >= 0) >= LATENCY_MIN_SAMPLES:
+            self.record_latency(relay_url, phase, seconds, timed_out=True)
+
+    def relay_timeout(self, relay_url: str, phase: str) -> float:
+        """Derive a relay's timeout for a phase from its own latency percentile
+
+        ``phase`` is ``connect``, ``first_frame`` or ``eose``. Relays with too
+        few answered samples get the global default; others get a multiple of
+        the 95th percentile of all their samples, timeouts included, clamped
+        to the phase's floor and ceiling. A ceiling never drops below the
+        default, so a raised --timeout is respected.
+        """
+        default, floor, ceiling = TIMEOUT_BOUNDS[phase]
+        if default is None:
+            default = self.connection_timeout
+        latency = self.state.get(relay_url, "latency")
+        samples = latency.get(phase, []) if latency else []
+        if sum(1 for sample in samples if sample >= 0) < LATENCY_MIN_SAMPLES:
+            timeout = default
+        else:
+            bounds = [abs(sample) for sample in samples]
+            timeout = min(max(percentile(bounds, LATENCY_PERCENTILE) * TIMEOUT_MULTIPLIER, floor), max(ceiling, default))
+        return self.bounded_timeout(timeout)
+
+    @property
+    def tls_context(self) -> ResumingSSLContext:
+        """The TLS context shared by all connections, created on first use"""
+        if self._tls_context is None:
+            self._tls_context = ResumingSSLContext()
+        return self._tls_context
+
+    @asynccontextmanager
+    async def connect(self, relay_url: str, timings: Optional[ProbeTimings] = None, raw: bool = False):
+        """Open a WebSocket connection to a relay using the crawler's connection settings
+
+        DNS, TCP, TLS and the WebSocket upgrade are done as separate steps so
+        each can be timed into ``timings``; together they share the relay's
+        connect timeout. With ``raw`` the connection is a RawWebSocket, which
+        is enough for liveness checks and much lighter than the websockets
+        client.
+        """
+        if timings is None:
+            timings = ProbeTimings()
+        websocket = await asyncio.wait_for(
+            self.open_websocket(relay_url, timings, raw), self.relay_timeout(relay_url, "connect")
+        )
+        async with websocket:
+            try:
+                yield websocket
+            finally:
+                # TLS 1.3 tickets arrive after the handshake, so take the session last
+                ssl_object = websocket.transport.get_extra_info("ssl_object")
+                if ssl_object is not None:
+                    self.tls_context.remember(urlparse(relay_url).hostname, ssl_object)
+                if raw:
+                    timings.bytes_received = websocket.bytes_received
+
+    async def open_websocket(self, relay_url: str, timings: ProbeTimings, raw: bool = False):
+        """Resolve, connect and upgrade to a WebSocket, recording how long each step took"""
+        parsed = urlparse(relay_url)
+        secure = parsed.scheme == "wss"
+        port = parsed.port or (443 if secure else 80)
+
+        started = time.monotonic()
+        addresses = await self.resolver.resolve(parsed.hostname)
+        timings.dns = time.monotonic() - started
+
+        started = time.monotonic()
+        sock = await self.open_socket(addresses, port)
+        timings.tcp = time.monotonic() - started
+
+        if raw:
+            return await self.open_raw_websocket(sock, parsed, timings)
+
+        started = time.monotonic()
         try:
-            logger.debug(f"Testing connection to {relay_url}")
-            
-            async with websockets.connect(
+            websocket = await websockets.connect(
                 relay_url,
-                open_timeout=self.connection_timeout,
+                sock=sock,
+                open_timeout=None,  # covered by the timeout in connect()
                 close_timeout=5,
                 max_size=2**20,  # 1MB max message size
-                ping_interval=None  # Disable ping
-            ) as websocket:
-                # Send a simple REQ to test functionality
-                subscription_id = self.generate_subscription_id()
-                test_filter = {
-                    "kinds": [1],
-                    "limit": 1
-                }
-                req_msg = ["REQ", subscription_id, test_filter]
-                await websocket.send(json.dumps(req_msg))
-                logger.debug(f"Sent REQ with subscription ID: {subscription_id}")
-                
-                # Wait for a response and validate it's a proper Nostr protocol message
-                try:
-                    data = await self.receive_with_auth(
-                        websocket, relay_url, 5.0, req_msg
-                    )
-                    logger.debug(f"Received response: {str(data)[:200]}...")
-                    
-                    try:
-                        # Check if it's a valid Nostr protocol message
-                        if not isinstance(data, list) or len(data) < 2:
-                            logger.debug(f"Invalid Nostr message format from {relay_url}: not a list or too short")
-                            return False
-                        
-                        message_type = data[0]
-                        message_subscription_id = data[1]
-                        
-                        # Validate subscription ID matches
-                        if message_subscription_id != subscription_id:
-                            logger.debug(f"Subscription ID mismatch from {relay_url}: expected {subscription_id}, got {message_subscription_id}")
-                            return False
-                        
-                        # Check for valid Nostr protocol message types
-                        if message_type == "EVENT":
-                            logger.debug(f"✓ Received EVENT from {relay_url}")
-                            # Send CLOSE to clean up
-                            close_msg = ["CLOSE", subscription_id]
-                            await websocket.send(json.dumps(close_msg))
-                            return True
-                        elif message_type == "EOSE":
-                            logger.warning(f"Received EOSE immediately from {relay_url} - relay has no events (unusual)")
-                            # Send CLOSE to clean up
-                            close_msg = ["CLOSE", subscription_id]
-                            await websocket.send(json.dumps(close_msg))
-                            return True
-                        elif message_type == "NOTICE":
-                            notice_message = data[2] if len(data) > 2 else "unknown"
-                            logger.debug(f"Received NOTICE from {relay_url}: {notice_message}")
-                            return False
-                        else:
-                            logger.debug(f"Unexpected message type from {relay_url}: {message_type}")
-                            return False
-                            
-                    except (json.JSONDecodeError, ValueError) as e:
-                        logger.debug(f"Invalid JSON response from {relay_url}: {e}")
-                        return False
-                        
-                except asyncio.TimeoutError:
-                    logger.debug(f"Timeout waiting for response from {relay_url}")
-                    return False
-                    
-        except Exception as e:
-            logger.debug(f"Failed to connect to {relay_url}: {e}")
-            return False
-    
-    async def test_relays_connections(self, relay_urls: List[str]) -> Dict[str, bool]:
-        """Test multiple relays concurrently and return a dict of relay_url -> functioning status"""
-        if not relay_urls:
-            return {}
-        
-        logger.info(f"Testing {len(relay_urls)} relays concurrently")
+                ping_interval=None,  # Disable ping
+                create_connection=partial(TimedClientConnection, timings=timings),
+                **({"ssl": self.tls_context} if secure else {}),
+            )
+        except BaseException:
+            sock.close()
+            raise
+        if secure:
+            timings.tls = websocket.transport_ready - started
+            timings.tls_resumed = self.tls_context.count_handshake(websocket.transport.get_extra_info("ssl_object"))
+        timings.ws_upgrade = time.monotonic() - websocket.transport_ready
+        return websocket
+
+    async def open_raw_websocket(self, sock: socket.socket, parsed, timings: ProbeTimings) -> RawWebSocket:
+        """Upgrade a connected socket to a RawWebSocket, doing TLS first for wss://"""
+        secure = parsed.scheme == "wss"
+        started = time.monotonic()
+        try:
+            reader, writer = await asyncio.open_connection(
+                sock=sock,
+                ssl=self.tls_context if secure else None,
+                server_hostname=parsed.hostname if secure else None,
+            )
+        except BaseException:
+            sock.close()
+            raise
+        transport_ready = time.monotonic()
+        if secure:
+            timings.tls = transport_ready - started
+            timings.tls_resumed = self.tls_context.count_handshake(writer.get_extra_info("ssl_object"))
+
+        path = parsed.path or "/"
+        if parsed.query:
+            path += f"?{parsed.query}"
+        try:
+            websocket = await RawWebSocket.open(reader, writer, parsed.netloc, path, max_size=2**20)
+        except BaseException:
+            writer.close()
+            raise
+        timings.ws_upgrade = time.monotonic() - transport_ready
+        return websocket
+
+    @staticmethod
+    async def open_socket(addresses: List[Tuple[int, str]], port: int) -> socket.socket:
+        """Connect a non-blocking TCP socket to the first reachable resolved address"""
+        loop = asyncio.get_running_loop()
+        last_error: Optional[OSError] = None
+        for family, ip in addresses:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            try:
+                await loop.sock_connect(sock, socket_address(family, ip, port))
+                return sock
+            except OSError as e:
+                sock.close()
+                last_error = e
+            except BaseException:
+                sock.close()
+                raise
+        raise last_error or OSError("no addresses to connect to")
+
+    async def check_liveness(self, websocket, relay_url: str, timings: Optional[ProbeTimings] = None) -> bool:
+        """Validate Nostr protocol responses on an open connection with a kind 1 REQ
+
+        Returns True for a usable relay and raises ``RelayProbeError`` (or the
+        underlying timeout/connection error) describing why it is not.
+        """
+        # Send a simple REQ to test functionality
+        subscription_id = self.generate_subscription_id()
+        test_filter = {
+            "kinds": [1],
+            "limit": 1
+        }
+        req_msg = ["REQ", subscription_id, test_filter]
+        await websocket.send(json.dumps(req_msg))
+        logger.debug(f"Sent REQ with subscription ID: {subscription_id}")
         
-        # Create tasks for concurrent testing
-        tasks = []
-        for relay_url in relay_urls:
-            task = asyncio.create_task(self.test_relay_connection(relay_url))
-            tasks.append((relay_url, task))
+        # Wait for a response and validate it's a proper Nostr protocol message
+        sent_at = time.monotonic()
+        try:
+            data = await self.receive_with_auth(
+                websocket, relay_url, self.relay_timeout(relay_url, "first_frame"), req_msg, timings
+            )
+        except json.JSONDecodeError as e:
+            raise RelayProbeError("invalid_json", f"invalid JSON response: {e}") from e
+        first_frame = time.monotonic() - sent_at
+        self.record_latency(relay_url, "first_frame", first_frame)
+        if timings is not None:
+            timings.first_frame = first_frame
+        logger.debug(f"Received response: {str(data)[:200]}...")
         
-        # Wait for all tasks to complete
-        results = {}
-        for relay_url, task in tasks:
-            try:
-                is_functioning = await task
-                results[relay_url] = is_functioning
-                if is_functioning:
-                    logger.info(f"✓ Relay {relay_url} is functioning")
-                else:
-                    logger.warning(f"✗ Relay {relay_url} is not functioning")
-            except Exception as e:
-                logger.error(f"Error testing relay {relay_url}: {e}")
-                results[relay_url] = False
+        # Check if it's a valid Nostr protocol message
+        if not isinstance(data, list) or len(data) < 2:
+            raise RelayProbeError("invalid_message", "invalid Nostr message format: not a list or too short")
         
-        functioning_count = sum(1 for status in results.values() if status)
-        logger.info(f"Batch test completed: {functioning_count}/{len(relay_urls)} relays functioning")
+        message_type = data[0]
+        message_subscription_id = data[1]
+
+        # NOTICE carries no subscription ID, only a human-readable message
+        if message_type == "NOTICE":
+            kind = "rate_limited" if RATE_LIMIT_PATTERN.search(str(message_subscription_id)) else "notice"
+            raise RelayProbeError(kind, f"received NOTICE: {message_subscription_id}")
+        if message_type == "CLOSED" and len(data) > 2 and RATE_LIMIT_PATTERN.search(str(data[2])):
+            raise RelayProbeError("rate_limited", f"subscription closed: {data[2]}")
         
-        return results
-    
-    async def fetch_events(self, relay_url: str) -> List[Dict]:
-        """Fetch kind 3 events (follow lists) or kind 10002 (NIP-66) from a relay"""
-        follow_events = []
+        # Validate subscription ID matches
+        if message_subscription_id != subscription_id:
+            raise RelayProbeError(
+                "subscription_mismatch",
+                f"subscription ID mismatch: expected {subscription_id}, got {message_subscription_id}"
+            )
         
-        try:
-            logger.info(f"Fetching follow lists from {relay_url}")
-            
-            async with websockets.connect(
-                relay_url,
-                open_timeout=self.connection_timeout,
-                close_timeout=5,
-                max_size=2**20
-            ) as websocket:
-                
+        # Check for valid Nostr protocol message types
+        if message_type == "EVENT":
+            logger.debug(f"✓ Received EVENT from {relay_url}")
+        elif message_type == "EOSE":
+            logger.warning(f"Received EOSE immediately from {relay_url} - relay has no events (unusual)")
+        else:
+            raise RelayProbeError("unexpected_message", f"unexpected message type: {message_type}")
+
+        # Send CLOSE to clean up
+        close_msg = ["CLOSE", subscription_id]
+        await websocket.send(json.dumps(close_msg))
+        return True
+
+    def harvest_cursor(self, relay_url: str) -> Optional[int]:
+        """Return the newest follow-list ``created_at`` seen on a relay in an earlier run"""
+        if not self.incremental_harvest:
+            return None
+        harvest = self.state.get(relay_url, "harvest")
+        return harvest.get("newest_created_at") if harvest else None
+
+    def harvest_backfill(self, relay_url: str) -> Optional[int]:
+        """Return where an earlier harvest of a relay stopped short of its cursor, if one did"""
+        if not self.incremental_harvest:
+            return None
+        harvest = self.state.get(relay_url, "harvest")
+        return harvest.get("backfill_until") if harvest else None
+
+    def harvest_top(self, relay_url: str) -> Optional[int]:
+        """Return the newest ``created_at`` harvested from a relay, gap or not"""
+        if self.harvest_backfill(relay_url) is not None:
+            return self.state.get(relay_url, "harvest").get("backfill_newest")
+        return self.harvest_cursor(relay_url)
+
+    async def collect_follow_events(
+        self, websocket, relay_url: str, on_event: Callable[[Dict], None], timings: Optional[ProbeTimings] = None
+    ):
+        """Collect kind 3 and kind 10002 events on an open connection
+
+        Pages of ``harvest_page_size`` events are requested with ``until`` set to
+        the oldest event seen so far, until the relay runs dry or the event or
+        byte budget is spent. When the relay was harvested before, only events
+        newer than its stored cursor are requested (``since``). The cursor only
+        advances once paging has reached it; a harvest cut short by a budget
+        leaves a gap between the cursor and how far back it got
+        (``backfill_until``). Later runs first fetch whatever is newer than
+        anything harvested so far, then spend the rest of the budget paging
+        through the gap. Each event is handed to ``on_event`` as soon as it
+        arrives and is not kept, so memory stays bounded by the frames in
+        flight and whatever was processed survives a connection that drops
+        mid-stream.
+        """
+        websocket = MeteredWebSocket(websocket)
+        seen_ids: Set[str] = set()
+        collected = 0
+        budget_spent = False
+
+        # Collect events until EOSE, page after page
+        start_time = time.time()
+        timeout_duration = HARVEST_MAX_SECONDS
+        page_timeout = self.relay_timeout(relay_url, "eose")
+        first_page = True
+
+        async def page_back(since: Optional[int], until: Optional[int]) -> Tuple[bool, Optional[int], Optional[int]]:
+            """Page from ``until`` back to ``since``; returns (complete, newest, oldest reached)"""
+            nonlocal collected, budget_spent, first_page
+            newest = None
+            reached = None
+
+            while not budget_spent and not self.draining and time.time() - start_time < timeout_duration:
                 filter_req = {
                     "kinds": [3, 10002],
-                    "limit": 300,
+                    "limit": self.harvest_page_size,
                 }
-                
+                if since is not None:
+                    filter_req["since"] = since
+                if until is not None:
+                    filter_req["until"] = until
+
                 subscription_id = self.generate_subscription_id()
                 req_msg = ["REQ", subscription_id, filter_req]
-                
+
                 await websocket.send(json.dumps(req_msg))
                 logger.debug(f"Sent request: {req_msg}")
-                
-                # Collect events until EOSE
-                start_time = time.time()
-                timeout_duration = 30.0
-                
-                while time.time() - start_time < timeout_duration:
+
+                page_events = 0
+                new_events = 0
+                oldest = None
+                reached_eose = False
+                page_start = time.time()
+                page_end = min(start_time + timeout_duration, page_start + page_timeout)
+
+                while not self.draining and time.time() < page_end:
                     try:
                         data = await self.receive_with_auth(
-                            websocket, relay_url, 5.0, req_msg
+                            websocket, relay_url, self.bounded_timeout(5.0), req_msg
                         )
-                        
+
                         if data[0] == "EVENT" and data[1] == subscription_id:
                             event = data[2]
+                            page_events += 1
+                            created_at = event.get("created_at")
+                            if isinstance(created_at, int):
+                                oldest = created_at if oldest is None else min(oldest, created_at)
+                                newest = created_at if newest is None else max(newest, created_at)
+                                reached = oldest if reached is None else min(reached, oldest)
+                            # Pages overlap at the ``until`` boundary
+                            if event.get("id") in seen_ids:
+                                continue
+                            seen_ids.add(event.get("id"))
+                            new_events += 1
                             if event.get("kind") == 3 or event.get("kind") == 10002:
-                                follow_events.append(event)
+                                if not self.deduplicator.accept(event):
+                                    self.stats.duplicate_events_dropped += 1
+                                    continue
+                                on_event(event)
+                                collected += 1
                                 logger.debug(f"Collected follow event from {event.get('pubkey', 'unknown')[:8]}...")
-                        
+                            if (
+                                collected >= self.harvest_max_events
+                                or websocket.bytes_received >= self.harvest_max_bytes
+                            ):
+                                logger.debug(f"Harvest budget spent on {relay_url}")
+                                budget_spent = True
+                                break
+
                         elif data[0] == "EOSE" and data[1] == subscription_id:
                             logger.debug(f"Received EOSE for {subscription_id}")
+                            reached_eose = True
+                            if first_page:
+                                self.record_latency(relay_url, "eose", time.time() - page_start)
+                                if timings is not None:
+                                    timings.eose = time.time() - page_start
                             break
-                            
+
                     except asyncio.TimeoutError:
                         continue
                     except json.JSONDecodeError as e:
                         logger.warning(f"Failed to parse message from {relay_url}: {e}")
                         continue
-                
+
                 # Send CLOSE message
                 close_msg = ["CLOSE", subscription_id]
                 await websocket.send(json.dumps(close_msg))
-                
+
+                if first_page and not reached_eose and not budget_spent and not self.draining and time.time() >= page_end:
+                    # Count the cut-off as a sample so a slow relay's window grows next time
+                    self.record_timeout(relay_url, "eose", page_timeout)
+                first_page = False
+
+                if not reached_eose:
+                    break
+                # A short page means the relay has nothing older to give
+                if page_events < self.harvest_page_size or oldest is None:
+                    return True, newest, reached
+                # Step past the boundary second if it alone filled the page
+                until = oldest if new_events else oldest - 1
+                if since is not None and until < since:
+                    return True, newest, reached
+
+            return False, newest, reached
+
+        # Newest events first, down to the top of what earlier runs harvested
+        fresh = await page_back(self.harvest_top(relay_url), None)
+        backfill = None
+        backfill_until = self.harvest_backfill(relay_url)
+        if fresh[0] and backfill_until is not None:
+            backfill = await page_back(self.harvest_cursor(relay_url), backfill_until)
+
+        self.record_harvest(relay_url, fresh, backfill)
+
+    def record_harvest(
+        self,
+        relay_url: str,
+        fresh: Tuple[bool, Optional[int], Optional[int]],
+        backfill: Optional[Tuple[bool, Optional[int], Optional[int]]] = None,
+    ):
+        """Move a relay's harvest cursor, or remember the gap an unfinished harvest left
+
+        ``fresh`` and ``backfill`` are the (complete, newest, oldest reached)
+        results of the pass over new events and of the pass through the gap.
+        """
+        harvest = self.state.section(relay_url, "harvest")
+        complete, newest, reached = fresh
+        if newest is not None:
+            # Clamp so a relay serving future-dated events cannot stall the cursor
+            newest = min(newest, int(time.time()))
+        top_key = "backfill_newest" if "backfill_until" in harvest else "newest_created_at"
+
+        if complete:
+            # Contiguous with what was harvested before, so the top just moves up
+            if newest is not None:
+                harvest[top_key] = max(newest, harvest.get(top_key, newest))
+        elif reached is not None:
+            # A new gap below the fresh events; one older than it is paged through again later
+            harvest["backfill_newest"] = newest
+            harvest["backfill_until"] = reached
+
+        if backfill is not None:
+            complete, _, reached = backfill
+            if complete:
+                # The gap is closed: everything up to the top is in
+                harvest["newest_created_at"] = harvest.pop("backfill_newest")
+                harvest.pop("backfill_until")
+            elif reached is not None:
+                harvest["backfill_until"] = reached
+
+        if not harvest:
+            self.state.clear(relay_url, "harvest")
+
+    def collect_pubkeys_from_event(self, event: Dict) -> int:
+        """Queue followed pubkeys from a kind 3 event for outbox lookups, once each"""
+        added = 0
+        if event.get("kind") != 3:
+            return added
+        for tag in event.get("tags", []):
+            if len(self.seen_pubkeys) >= OUTBOX_MAX_PUBKEYS:
+                break
+            if not isinstance(tag, list) or len(tag) < 2 or tag[0] != 'p':
+                continue
+            pubkey = tag[1]
+            if isinstance(pubkey, str) and pubkey not in self.seen_pubkeys and PUBKEY_PATTERN.match(pubkey):
+                self.seen_pubkeys.add(pubkey)
+                self.outbox_pubkeys.append(pubkey)
+                added += 1
+        return added
+
+    def collect_pubkeys(self, events: List[Dict]) -> int:
+        """Queue followed pubkeys from kind 3 events for outbox lookups, once each"""
+        return sum(self.collect_pubkeys_from_event(event) for event in events)
+
+    async def collect_outbox_events(self, websocket, relay_url: str, on_event: Callable[[Dict], None]):
+        """Look up kind 10002 relay lists for queued pubkeys on an open connection
+
+        Pubkeys are sent in ``authors`` filters of ``outbox_chunk_size``, with
+        at most ``outbox_max_subscriptions`` open at once and at most
+        ``outbox_pubkeys_per_relay`` per connection. Chunks the relay refuses
+        with CLOSED go back to the queue for another relay. Relay lists are
+        handed to ``on_event`` as they arrive.
+        """
+        budget = self.outbox_pubkeys_per_relay
+        active: Dict[str, List[str]] = {}
+        refused: List[str] = []
+
+        async def open_subscription() -> bool:
+            nonlocal budget
+            size = min(self.outbox_chunk_size, budget, len(self.outbox_pubkeys))
+            if size <= 0:
+                return False
+            chunk = [self.outbox_pubkeys.popleft() for _ in range(size)]
+            budget -= size
+            subscription_id = self.generate_subscription_id()
+            active[subscription_id] = chunk
+            req_msg = ["REQ", subscription_id, {"kinds": [10002], "authors": chunk, "limit": size}]
+            await websocket.send(json.dumps(req_msg))
+            logger.debug(f"Requested relay lists for {size} pubkeys from {relay_url}")
+            return True
+
+        while not self.draining and len(active) < self.outbox_max_subscriptions and await open_subscription():
+            pass
+
+        start_time = time.time()
+        while active and not self.draining and time.time() - start_time < OUTBOX_TIMEOUT:
+            try:
+                data = await self.receive_with_auth(websocket, relay_url, self.bounded_timeout(5.0))
+            except asyncio.TimeoutError:
+                continue
+            except json.JSONDecodeError as e:
+                logger.warning(f"Failed to parse message from {relay_url}: {e}")
+                continue
+
+            if not isinstance(data, list) or len(data) < 2 or data[1] not in active:
+                continue
+
+            if data[0] == "EVENT" and len(data) > 2:
+                event = data[2]
+                if isinstance(event, dict) and event.get("kind") == 10002:
+                    if self.deduplicator.accept(event):
+                        on_event(event)
+                    else:
+                        self.stats.duplicate_events_dropped += 1
+            elif data[0] in ("EOSE", "CLOSED"):
+                chunk = active.pop(data[1])
+                if data[0] == "EOSE":
+                    await websocket.send(json.dumps(["CLOSE", data[1]]))
+                    self.stats.outbox_pubkeys_queried += len(chunk)
+                else:
+                    logger.debug(f"{relay_url} refused an outbox lookup: {data[2:]}")
+                    refused.extend(chunk)
+                while len(active) < self.outbox_max_subscriptions and await open_subscription():
+                    pass
+
+        self.outbox_pubkeys.extend(refused)
+        for subscription_id, chunk in active.items():
+            await websocket.send(json.dumps(["CLOSE", subscription_id]))
+            self.stats.outbox_pubkeys_queried += len(chunk)
+
+    async def prescreen_relay(self, relay_url: str) -> Optional[Tuple[str, str]]:
+        """Check that a relay's host resolves and accepts TCP (and TLS) connections
+
+        Each step gets ``prescreen_timeout``. Returns None for a reachable
+        relay, otherwise the stage that failed (``dns``, ``tcp`` or ``tls``)
+        and the failure class. A TLS session made here is kept, so the full
+        probe that follows can resume it.
+        """
+        parsed = urlparse(relay_url)
+        secure = parsed.scheme == "wss"
+        port = parsed.port or (443 if secure else 80)
+        timeout = self.bounded_timeout(self.prescreen_timeout)
+
+        try:
+            addresses = await self.resolver.resolve(parsed.hostname, timeout)
+        except Exception as e:
+            return "dns", classify_failure(e)
+        try:
+            sock = await asyncio.wait_for(self.open_socket(addresses, port), timeout)
+        except Exception as e:
+            return "tcp", classify_failure(e)
+
+        if not (secure and self.prescreen_tls):
+            sock.close()
+            return None
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(sock=sock, ssl=self.tls_context, server_hostname=parsed.hostname),
+                timeout,
+            )
+        except Exception as e:
+            sock.close()
+            return "tls", classify_failure(e)
+        ssl_object = writer.get_extra_info("ssl_object")
+        self.tls_context.count_handshake(ssl_object)
+        self.tls_context.remember(parsed.hostname, ssl_object)
+        writer.close()
+        return None
+
+    def count_elimination(self, stage: str):
+        self.stats.eliminated[stage] = self.stats.eliminated.get(stage, 0) + 1
+
+    async def test_relay_connection(self, relay_url: str) -> bool:
+        """Test if a relay is functioning by attempting to connect and validate Nostr protocol responses"""
+        result = await self.probe_relay(relay_url, harvest=False)
+        return result.functioning
+
+    async def probe_relay(self, relay_url: str, harvest: bool = True, liveness: bool = True) -> RelayProbeResult:
+        """Test a relay and harvest its follow lists over a single WebSocket session
+
+        The liveness check and the follow-list request run as two consecutive
+        subscriptions on one connection, so DNS, TCP, TLS, the WebSocket upgrade
+        and any NIP-42 AUTH are paid once per relay. Events are only collected
+        when ``harvest`` is set. Without ``liveness`` a completed WebSocket
+        upgrade is enough, which is the cheapest probe tier.
+        """
+        result = RelayProbeResult()
+        timings = result.timings
+
+        def on_event(event: Dict):
+            # Pull relays and pubkeys out of each event and let it go
+            result.events += 1
+            timings.events += 1
+            found = set()
+            self.extract_relays_from_event(event, found)
+            referrer = event.get("pubkey") or event.get("id")
+            for found_url in found:
+                if referrer and found_url not in self.visited_relays:
+                    self.to_visit.add_reference(found_url, referrer)
+            result.relays.update(found)
+            self.collect_pubkeys_from_event(event)
+
+        phase = "connect"
+        try:
+            logger.debug(f"Probing {relay_url}")
+            
+            phase_started = time.monotonic()
+            # Liveness-only probes can use the lightweight client
+            async with self.connect(relay_url, timings, raw=self.raw_probe and not harvest) as websocket:
+                self.record_latency(relay_url, "connect", time.monotonic() - phase_started)
+                result.address = peer_address(websocket.remote_address)
+                if not liveness:
+                    result.functioning = True
+                    result.latency = time.monotonic() - phase_started
+                    return result
+                phase = "first_frame"
+                result.functioning = await self.check_liveness(websocket, relay_url, timings)
+                result.latency = time.monotonic() - phase_started
+                if not harvest:
+                    return result
+
+                logger.info(f"Fetching follow lists from {relay_url}")
+                await self.collect_follow_events(websocket, relay_url, on_event, timings)
+
+                # Reuse the open connection for outbox relay-list lookups
+                await self.collect_outbox_events(websocket, relay_url, on_event)
+
         except Exception as e:
+            if not result.functioning:
+                logger.debug(f"Failed to probe {relay_url}: {e}")
+                result.error = classify_failure(e)
+                if result.error == "timeout" and not self.draining:
+                    self.record_timeout(relay_url, phase, self.relay_timeout(relay_url, phase))
+                return result
             logger.error(f"Error fetching follow lists from {relay_url}: {e}")
-        
-        logger.info(f"Collected {len(follow_events)} follow events from {relay_url}")
-        return follow_events
 
-    async def fetch_events_from_relays(self, relay_urls: List[str]) -> Dict[str, List[Dict]]:
-        """Fetch events from multiple relays concurrently and return a dict of relay_url -> events"""
-        if not relay_urls:
-            return {}
-        
-        logger.info(f"Fetching events from {len(relay_urls)} relays concurrently")
-        
-        # Create tasks for concurrent event fetching
-        tasks = []
-        for relay_url in relay_urls:
-            task = asyncio.create_task(self.fetch_events(relay_url))
-            tasks.append((relay_url, task))
-        
-        # Wait for all tasks to complete
-        results = {}
-        for relay_url, task in tasks:
+        logger.info(f"Collected {result.events} follow events from {relay_url}")
+        return result
+
+    async def fetch_relay_info(self, relay_url: str) -> RelayProbeResult:
+        """Fetch a relay's NIP-11 information document over HTTP(S)
+
+        The relay counts as functioning when it answers a GET with
+        ``Accept: application/nostr+json`` with a JSON object. Failures to
+        connect are classified as usual; a reachable host without a usable
+        document fails with the ``nip11`` class.
+        """
+        result = RelayProbeResult()
+        timings = result.timings
+        parsed = urlparse(relay_url)
+        secure = parsed.scheme == "wss"
+        port = parsed.port or (443 if secure else 80)
+        path = (parsed.path or "/") + (f"?{parsed.query}" if parsed.query else "")
+        started = time.monotonic()
+
+        async def request() -> bytes:
+            phase_started = time.monotonic()
+            addresses = await self.resolver.resolve(parsed.hostname)
+            timings.dns = time.monotonic() - phase_started
+
+            phase_started = time.monotonic()
+            sock = await self.open_socket(addresses, port)
+            timings.tcp = time.monotonic() - phase_started
+
+            phase_started = time.monotonic()
+            try:
+                reader, writer = await asyncio.open_connection(
+                    sock=sock,
+                    ssl=self.tls_context if secure else None,
+                    server_hostname=parsed.hostname if secure else None,
+                )
+            except BaseException:
+                sock.close()
+                raise
             try:
-                events = await task
-                results[relay_url] = events
-                logger.info(f"✓ Fetched {len(events)} events from {relay_url}")
-            except Exception as e:
-                logger.error(f"Error fetching events from relay {relay_url}: {e}")
-                results[relay_url] = []
+                if secure:
+                    timings.tls = time.monotonic() - phase_started
+                    timings.tls_resumed = self.tls_context.count_handshake(writer.get_extra_info("ssl_object"))
+                result.address = peer_address(writer.get_extra_info("peername"))
+
+                # HTTP/1.0 keeps the body unchunked and ends it at connection close
+                writer.write(
+                    (
+                        f"GET {path} HTTP/1.0\r\n"
+                        f"Host: {parsed.netloc}\r\n"
+                        "Accept: application/nostr+json\r\n"
+                        "\r\n"
+                    ).encode()
+                )
+                sent_at = time.monotonic()
+                response = await reader.read(NIP11_MAX_BYTES)
+                timings.first_frame = time.monotonic() - sent_at
+                while len(response) <= NIP11_MAX_BYTES:
+                    chunk = await reader.read(NIP11_MAX_BYTES)
+                    if not chunk:
+                        break
+                    response += chunk
+                timings.bytes_received = len(response)
+                return response
+            finally:
+                ssl_object = writer.get_extra_info("ssl_object")
+                if ssl_object is not None:
+                    self.tls_context.remember(parsed.hostname, ssl_object)
+                writer.close()
+
+        try:
+            logger.debug(f"Fetching NIP-11 document from {relay_url}")
+            response = await asyncio.wait_for(
+                request(), self.relay_timeout(relay_url, "connect") + self.relay_timeout(relay_url, "first_frame")
+            )
+            result.latency = time.monotonic() - started
+            if len(response) > NIP11_MAX_BYTES:
+                raise RelayProbeError("nip11", f"document larger than {NIP11_MAX_BYTES} bytes")
+            head, _, body = response.partition(b"\r\n\r\n")
+            status = head.split(b"\r\n", 1)[0].split(b" ", 2)
+            if len(status) < 2 or status[1] != b"200":
+                raise RelayProbeError("nip11", f"HTTP status {b' '.join(status[1:]).decode('latin-1')}")
+            try:
+                document = json.loads(body)
+            except ValueError:
+                raise RelayProbeError("nip11", "document is not JSON")
+            if not isinstance(document, dict):
+                raise RelayProbeError("nip11", "document is not a JSON object")
+            result.functioning = True
+        except Exception as e:
+            logger.debug(f"Failed to fetch NIP-11 document from {relay_url}: {e}")
+            result.error = classify_failure(e)
+        return result
+
+    
+    def extract_relays_from_event(self, event: Dict, relay_urls: Set[str]):
+        """Add relay URLs referenced by one follow list event to ``relay_urls``"""
+        self.stats.events_processed += 1
         
-        total_events = sum(len(events) for events in results.values())
-        logger.info(f"Batch fetch completed: {total_events} total events from {len(relay_urls)} relays")
+        # Process tags to find relay information
+        tags = event.get('tags', [])
         
-        return results
+        for tag in tags:
+            if not isinstance(tag, list) or len(tag) < 2:
+                continue
+            
+            # Look for 'r' tags (relay tags)
+            if tag[0] == 'r':
+                canonical_url = canonicalize_relay_url(tag[1])
+            
+            # Also check 'p' tags for potential relay info in some implementations
+            elif tag[0] == 'p' and len(tag) >= 3:
+                # Some implementations put relay info in the 3rd element of p tags
+                canonical_url = canonicalize_relay_url(tag[2])
+            else:
+                continue
+
+            if canonical_url:
+                relay_urls.add(canonical_url)
 
-    
     def extract_relays_from_events(self, events: List[Dict]) -> Set[str]:
         """Extract relay URLs from follow list events"""
         relay_urls = set()
-        
         for event in events:
-            self.stats.events_processed += 1
-            
-            # Process tags to find relay information
-            tags = event.get('tags', [])
-            
-            for tag in tags:
-                if not isinstance(tag, list) or len(tag) < 2:
-                    continue
-                
-                # Look for 'r' tags (relay tags)
-                if tag[0] == 'r' and len(tag) >= 2:
-                    potential_relay = tag[1]
-                    if self.is_valid_relay_url(potential_relay):
-                        normalized_url = self.normalize_relay_url(potential_relay)
-                        relay_urls.add(normalized_url)
-                
-                # Also check 'p' tags for potential relay info in some implementations
-                elif tag[0] == 'p' and len(tag) >= 3:
-                    # Some implementations put relay info in the 3rd element of p tags
-                    if len(tag) > 2 and self.is_valid_relay_url(tag[2]):
-                        normalized_url = self.normalize_relay_url(tag[2])
-                        relay_urls.add(normalized_url)
-        
+            self.extract_relays_from_event(event, relay_urls)
         return relay_urls
     
     async def load_existing_results(self) -> bool:
@@ -484,8 +1890,7 @@ class NostrRelayDiscovery:
         if not os.path.exists(self.output_file):
             logger.info(f"No existing results file found at {self.output_file}, starting fresh")
             # Initialize with just the initial relay
-            self.to_visit.append((self.initial_relay, 0))
-            self.to_visit_set.add(self.initial_relay)
+            self.to_visit.push(self.initial_relay, 0)
             return False
         
         try:
@@ -493,128 +1898,645 @@ class NostrRelayDiscovery:
             with open(self.output_file, 'r') as f:
                 data = json.load(f)
             
-            existing_relays = data.get('functioning_relays', [])
+            # Fold spellings that older versions stored separately
+            existing_relays = list(dict.fromkeys(
+                canonicalize_relay_url(relay_url) or relay_url
+                for relay_url in data.get('functioning_relays', [])
+            ))
             logger.info(f"Found {len(existing_relays)} existing functioning relays to verify")
             
             if not existing_relays:
                 logger.info("No existing relays found, starting fresh")
-                self.to_visit.append((self.initial_relay, 0))
-                self.to_visit_set.add(self.initial_relay)
+                self.to_visit.push(self.initial_relay, 0)
                 return False
             else:
                 logger.info("Existing relays found, building on the previous results")
-                self.to_visit.extend([(existing_relay, 0) for existing_relay in existing_relays])
-                self.to_visit_set.update(existing_relays)
+                # The most reliable relays are verified first
+                for existing_relay in existing_relays:
+                    health = self.relay_health(existing_relay)
+                    self.to_visit.push(existing_relay, 0, round(health["uptime"] * 1000) if health else 0)
                 
         except Exception as e:
             logger.error(f"Error loading existing results: {e}")
             logger.info("Starting fresh due to error")
-            self.to_visit.append((self.initial_relay, 0))
-            self.to_visit_set.add(self.initial_relay)
+            self.to_visit.push(self.initial_relay, 0)
             return False
     
+    def seed_known_relays(self):
+        """Queue every relay in the state file that is not queued yet
+
+        Failed relays drop out of the results, and old references to them are
+        not read again, so without this a relay that failed once would only
+        come back if a new event named it. Relays still backing off are
+        deferred as usual and come back through the recheck budget.
+        """
+        for relay_url in sorted(self.state.relays):
+            health = self.relay_health(relay_url)
+            self.to_visit.push(relay_url, 0, round(health["uptime"] * 1000) if health else 0)
+
+    def enqueue_relays(self, relay_urls, depth: int) -> List[str]:
+        """Add newly discovered relays to the visit queue at ``depth`` and return the ones added"""
+        added = []
+        for relay_url in relay_urls:
+            if relay_url in self.visited_relays or relay_url in self.deferred or relay_url in self.retrying:
+                self.to_visit.forget(relay_url)
+                continue
+            if self.to_visit.push(relay_url, depth):
+                self.stats.total_relays_found += 1
+                added.append(relay_url)
+                logger.debug(f"Added {relay_url} to visit queue at depth {depth}")
+        return added
+
+    def record_outcome(self, relay_url: str, depth: int, is_functioning: bool, discovered: List[str] = (), events: int = 0, timings: Optional[Dict] = None, address: Optional[Dict] = None, latency: Optional[float] = None):
+        """Settle a relay, add the probe to its history and append its outcome to the crawl journal"""
+        self.in_progress.pop(relay_url, None)
+        if self.attempts.pop(relay_url, 0) and is_functioning:
+            self.stats.retries_recovered += 1
+        record_history(self.state.section(relay_url, "history"), is_functioning, latency, time.time())
+        # A re-probed relay leaves the set its previous outcome put it in
+        (self.failed_relays if is_functioning else self.functioning_relays).discard(relay_url)
+        if self.monitoring:
+            self.schedule_check(relay_url, depth, is_functioning)
+        if timings:
+            self.relay_timings[relay_url] = timings
+        if address:
+            self.relay_addresses[relay_url] = address
+        self.journal.record({
+            "relay": relay_url,
+            "depth": depth,
+            "functioning": is_functioning,
+            "events": events,
+            "discovered": list(discovered),
+            "timings": timings or {},
+            "address": address,
+        })
+
+    def apply_journal_entry(self, entry: Dict):
+        """Replay one journal outcome on top of a loaded checkpoint"""
+        relay_url = entry["relay"]
+        if relay_url in self.visited_relays:
+            # Already covered by the checkpoint
+            return
+
+        self.visited_relays.add(relay_url)
+        if entry["functioning"]:
+            self.functioning_relays.add(relay_url)
+            self.stats.functioning_relays += 1
+        else:
+            self.failed_relays.add(relay_url)
+        self.stats.events_processed += entry.get("events", 0)
+        if entry.get("timings"):
+            self.relay_timings[relay_url] = entry["timings"]
+        if entry.get("address"):
+            self.relay_addresses[relay_url] = entry["address"]
+        self.enqueue_relays(entry["discovered"], entry["depth"] + 1)
+
+    def schedule_write(self, coroutine):
+        """Run a journal flush or compaction in the background of the crawl"""
+        task = asyncio.create_task(coroutine)
+        self.background_writes.add(task)
+        task.add_done_callback(self.background_writes.discard)
+
+    def record_failure(self, relay_url: str, error: Optional[str]):
+        """Count a failed probe and push the relay's next eligible time out exponentially"""
+        now = time.time()
+        failures = self.state.section(relay_url, "failures")
+        failures["count"] = failures.get("count", 0) + 1
+        failures["last_error"] = error or "error"
+        failures["last_failure"] = now
+        backoff = min(BACKOFF_BASE * 2 ** (failures["count"] - 1), BACKOFF_MAX)
+        failures["next_eligible"] = now + backoff
+
+    def record_success(self, relay_url: str):
+        """Forget a relay's failure history once it answers again"""
+        self.state.clear(relay_url, "failures")
+
+    def next_eligible(self, relay_url: str) -> float:
+        """Return the time from which a relay may be probed again (0 if it has no failures)"""
+        failures = self.state.get(relay_url, "failures")
+        return failures["next_eligible"] if failures else 0.0
+
+    def schedule_retry(self, relay_url: str, depth: int, error: Optional[str]) -> bool:
+        """Queue a relay for another attempt after a transient failure
+
+        Returns False, leaving the failure to be recorded, for permanent
+        failures, once ``retry_attempts`` retries were made, or when the
+        retry would fall past the point where the deadline stops new probes.
+        The delay doubles with each attempt, starts longer for rate limits
+        and is jittered. Waiting relays sit in a heap, not in a probe slot.
+        """
+        made = self.attempts.get(relay_url, 0)
+        if error not in TRANSIENT_FAILURES or made >= self.retry_attempts or self.draining:
+            return False
+        delay = self.retry_delay * 2 ** made * (RETRY_RATE_LIMIT_FACTOR if error == "rate_limited" else 1)
+        due = time.time() + delay * random.uniform(1 - RETRY_JITTER, 1 + RETRY_JITTER)
+        if self.deadline is not None and due >= self.deadline - self.drain_window:
+            return False
+
+        logger.debug(f"Retrying {relay_url} in {due - time.time():.1f}s after {error} (retry {made + 1})")
+        self.attempts[relay_url] = made + 1
+        self.in_progress.pop(relay_url, None)
+        # Not settled yet: a checkpoint must return it to the frontier, not mark it visited
+        self.visited_relays.discard(relay_url)
+        self.retrying[relay_url] = depth
+        heapq.heappush(self.retries, (due, relay_url, depth))
+        self.stats.retries_scheduled += 1
+        return True
+
+    def admit_due_retries(self) -> int:
+        """Move relays whose retry is due back into the frontier"""
+        now = time.time()
+        admitted = 0
+        while self.retries and self.retries[0][0] <= now:
+            _, relay_url, depth = heapq.heappop(self.retries)
+            if self.retrying.pop(relay_url, None) is None:
+                continue
+            self.visited_relays.discard(relay_url)
+            self.to_visit.push(relay_url, depth)
+            admitted += 1
+        return admitted
+
+    def time_to_next_retry(self) -> Optional[float]:
+        """Seconds until the earliest retry is due, or None with no retries waiting"""
+        if not self.retries:
+            return None
+        return max(0.0, self.retries[0][0] - time.time())
+
+    @staticmethod
+    def earliest(*timeouts: Optional[float]) -> Optional[float]:
+        """The shortest of several optional timeouts"""
+        timeouts = [timeout for timeout in timeouts if timeout is not None]
+        return min(timeouts) if timeouts else None
+
+    def release_rechecks(self) -> int:
+        """Move the deferred relays closest to eligibility back into the queue, within budget"""
+        budget = self.recheck_budget - len(self.rechecks)
+        if budget <= 0 or not self.deferred:
+            return 0
+
+        chosen = sorted(self.deferred, key=self.next_eligible)[:budget]
+        for relay_url in chosen:
+            self.to_visit.push(relay_url, self.deferred.pop(relay_url))
+            self.rechecks.add(relay_url)
+        logger.info(f"Re-checking {len(chosen)} relays still in failure backoff")
+        return len(chosen)
+
+    def choose_tier(self, relay_url: str, depth: int) -> str:
+        """Pick the probe tier for a relay
+
+        The top tier is a full harvest below max depth and a REQ otherwise,
+        capped at ``max_tier``. With ``scheduled_tiers`` a stable relay only
+        gets a costlier tier once it is due (see TIER_INTERVALS) and a bare
+        handshake in between; relays with a failure on record always get the
+        top tier.
+        """
+        top = min(PROBE_TIERS.index("harvest" if depth < self.max_depth else "req"), PROBE_TIERS.index(self.max_tier))
+        if not self.scheduled_tiers or self.state.get(relay_url, "failures"):
+            return PROBE_TIERS[top]
+
+        checked = self.state.get(relay_url, "tiers") or {}
+        now = time.time()
+        for tier in reversed(PROBE_TIERS[1:top + 1]):
+            if now - checked.get(tier, 0) >= TIER_INTERVALS[tier] - TIER_SLACK:
+                return tier
+        return "handshake"
+
+    def record_tier(self, relay_url: str, tier: str):
+        """Remember when a relay last passed a tier, and the cheaper WebSocket tiers it covers"""
+        checked = self.state.section(relay_url, "tiers")
+        now = round(time.time())
+        for covered in PROBE_TIERS[:PROBE_TIERS.index(tier) + 1]:
+            if covered != "nip11" or tier == "nip11":
+                checked[covered] = now
+
+    async def probe_tier(self, relay_url: str, tier: str) -> RelayProbeResult:
+        """Probe a relay at one tier"""
+        if tier == "nip11":
+            result = await self.fetch_relay_info(relay_url)
+            if result.error != "nip11":
+                return result
+            # Not every relay serves a document; a reachable one is checked over WebSocket instead
+            return await self.probe_relay(relay_url, harvest=False, liveness=False)
+        if tier == "handshake":
+            return await self.probe_relay(relay_url, harvest=False, liveness=False)
+        return await self.probe_relay(relay_url, harvest=tier == "harvest")
+
+    async def process_relay(self, relay_url: str, depth: int):
+        """Probe one relay at its tier and, for the harvest tier, fetch its follow lists in the same session"""
+        tier = self.choose_tier(relay_url, depth)
+        self.stats.probes_by_tier[tier] = self.stats.probes_by_tier.get(tier, 0) + 1
+        result = await self.probe_tier(relay_url, tier)
+        self.concurrency.record(result.latency, result.error in CONGESTION_ERRORS)
+        timings = result.timings.as_dict()
+        if not result.functioning:
+            if self.schedule_retry(relay_url, depth, result.error):
+                return
+            logger.warning(f"✗ Relay {relay_url} is not functioning")
+            self.count_elimination("probe")
+            self.failed_relays.add(relay_url)
+            self.record_failure(relay_url, result.error)
+            self.record_outcome(relay_url, depth, False, timings=timings, address=result.address, latency=result.latency)
+            return
+
+        logger.info(f"✓ Relay {relay_url} is functioning")
+        self.functioning_relays.add(relay_url)
+        self.stats.functioning_relays += 1
+        self.record_success(relay_url)
+        self.record_tier(relay_url, tier)
+
+        # Events are only fetched by the harvest tier
+        discovered = self.enqueue_relays(result.relays, depth + 1)
+        self.record_outcome(relay_url, depth, True, discovered, result.events, timings, result.address, result.latency)
+
+    def start_relays(self, in_flight: Set[asyncio.Task]):
+        """Fill free probe slots, and with the pre-screen on, free screening slots
+
+        Probes take pre-screened relays when the pre-screen is on, otherwise
+        relays straight from the frontier, up to the concurrency level. The
+        pre-screen runs up to ``prescreen_concurrency`` checks at once, and
+        stops admitting more while a probe window of screened relays is
+        already waiting, so frontier priorities still hold.
+        """
+        probing = sum(1 for task in in_flight if task.stage == "probe")
+        screening = len(in_flight) - probing
+
+        while probing < self.concurrency.level:
+            if self.prescreen:
+                if not self.screened:
+                    break
+                relay_url, depth = self.screened.popleft()
+            else:
+                entry = self.take_next_relay()
+                if entry is None:
+                    break
+                relay_url, depth = entry
+            self.start_task(in_flight, self.process_relay(relay_url, depth), relay_url, "probe")
+            probing += 1
+
+        while (
+            self.prescreen
+            and screening < self.prescreen_concurrency
+            and len(self.screened) < self.concurrency.level
+        ):
+            entry = self.take_next_relay()
+            if entry is None:
+                break
+            relay_url, depth = entry
+            self.start_task(in_flight, self.screen_relay(relay_url, depth), relay_url, "screen")
+            screening += 1
+
+    @staticmethod
+    def start_task(in_flight: Set[asyncio.Task], coroutine, relay_url: str, stage: str):
+        task = asyncio.create_task(coroutine)
+        task.relay_url = relay_url
+        task.stage = stage
+        in_flight.add(task)
+
+    def take_next_relay(self) -> Optional[Tuple[str, int]]:
+        """Pop the next relay worth probing from the frontier and mark it in progress"""
+        while self.to_visit:
+            current_relay, depth = self.to_visit.pop()
+
+            # Skip if already visited
+            if current_relay in self.visited_relays:
+                continue
+
+            # Skip if depth exceeds maximum
+            if depth > self.max_depth:
+                logger.debug(f"Skipping {current_relay}: depth {depth} exceeds maximum {self.max_depth}")
+                continue
+
+            # Defer relays that are still backing off from earlier failures; the
+            # daemon schedules its re-probes itself
+            if (
+                not self.monitoring
+                and current_relay not in self.rechecks
+                and self.next_eligible(current_relay) > time.time()
+            ):
+                logger.debug(f"Deferring {current_relay}: in failure backoff")
+                self.deferred[current_relay] = depth
+                continue
+
+            self.visited_relays.add(current_relay)
+            self.in_progress[current_relay] = depth
+            return current_relay, depth
+        return None
+
+    async def screen_relay(self, relay_url: str, depth: int):
+        """Pre-screen one relay; queue it for a probe or settle it as unreachable"""
+        outcome = await self.prescreen_relay(relay_url)
+        if outcome is None:
+            self.screened.append((relay_url, depth))
+            return
+
+        stage, error = outcome
+        if self.schedule_retry(relay_url, depth, error):
+            return
+        logger.debug(f"✗ Relay {relay_url} failed the pre-screen at {stage}: {error}")
+        self.count_elimination(stage)
+        self.failed_relays.add(relay_url)
+        self.record_failure(relay_url, error)
+        self.record_outcome(relay_url, depth, False)
+
+    def settle_task(self, task: asyncio.Task):
+        """Record a finished relay task that failed before recording its own outcome"""
+        if task.stage == "screen" and task.exception() is None:
+            # Reachable relays stay in progress while they wait for a probe slot
+            return
+        depth = self.in_progress.pop(task.relay_url, None)
+        if task.exception() is not None:
+            logger.error(f"Error processing relay {task.relay_url}: {task.exception()}")
+            self.failed_relays.add(task.relay_url)
+            if depth is not None:
+                self.record_failure(task.relay_url, classify_failure(task.exception()))
+                self.record_outcome(task.relay_url, depth, False)
+
+    def check_deadline(self):
+        """Stop admitting new relays once only the drain window is left before the deadline"""
+        if self.draining or self.deadline is None:
+            return
+        if time.time() >= self.deadline - self.drain_window:
+            self.draining = True
+            logger.info(
+                f"Deadline approaching: no new relays will be started, "
+                f"draining {len(self.in_progress)} in flight"
+            )
+
+    def time_to_next_phase(self) -> Optional[float]:
+        """Seconds until the scheduler must start draining or give up on in-flight relays"""
+        if self.deadline is None:
+            return None
+        phase_end = self.deadline if self.draining else self.deadline - self.drain_window
+        return max(0.0, phase_end - time.time())
+
+    def bounded_timeout(self, timeout: float) -> float:
+        """Shorten a network timeout so it does not run past the deadline"""
+        if self.deadline is None:
+            return timeout
+        return max(0.1, min(timeout, self.deadline - time.time()))
+
     async def discover_relays(self) -> Set[str]:
-        """Main discovery method using breadth-first search with concurrent processing"""
-        # First, try to load existing results and verify them
-        logger.info("Checking for existing results to build upon...")
-        await self.load_existing_results()
+        """Main discovery method using breadth-first search with concurrent processing
+
+        Up to ``concurrency.level`` relays are kept in flight at all times. As
+        soon as one finishes, the next relay is taken from the queue, so a
+        single slow relay never holds up the others. The level starts at
+        ``batch_size`` and is tuned by the ConcurrencyController.
+
+        With a deadline, no new relays are started once ``drain_window``
+        seconds remain; relays in flight stop harvesting early, and any still
+        running at the deadline are cancelled and returned to the frontier.
+        """
+        self.state.load()
+
+        if self.resume and self.load_checkpoint():
+            logger.info(f"Resuming crawl with {len(self.to_visit)} relays left in the frontier")
+        else:
+            # First, try to load existing results and verify them
+            logger.info("Checking for existing results to build upon...")
+            await self.load_existing_results()
+            self.seed_known_relays()
+            # Start the journal from a checkpoint of the freshly seeded frontier
+            self.save_checkpoint()
         
-        logger.info(f"Starting relay discovery with batch size {self.batch_size}")
+        if self.concurrency.fixed:
+            logger.info(f"Starting relay discovery with {self.concurrency.level} concurrent relays")
+        else:
+            logger.info(
+                f"Starting relay discovery with {self.concurrency.level} concurrent relays, "
+                f"tuned automatically up to {self.concurrency.maximum}"
+            )
         logger.info(f"Maximum depth: {self.max_depth}")
         
-        while self.to_visit:
-            # Collect a batch of relays to process
-            current_batch = []
-            batch_depth_map = {}
-            
-            # Get up to batch_size relays from the queue
-            for _ in range(min(self.batch_size, len(self.to_visit))):
-                if not self.to_visit:
-                    break
-                    
-                current_relay, depth = self.to_visit.popleft()
-                self.to_visit_set.remove(current_relay)
-                
-                # Skip if already visited
-                if current_relay in self.visited_relays:
-                    continue
-                    
-                # Skip if depth exceeds maximum
-                if depth > self.max_depth:
-                    logger.info(f"Reached maximum depth {self.max_depth}, stopping exploration")
+        if self.deadline is not None:
+            logger.info(f"Deadline: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.deadline))}")
+        
+        in_flight: Set[asyncio.Task] = set()
+        relays_completed = 0
+        last_compaction = time.monotonic()
+        try:
+            while True:
+                self.check_deadline()
+                if not self.draining:
+                    self.admit_due_retries()
+                    self.start_relays(in_flight)
+
+                timeout = self.earliest(self.time_to_next_phase(), None if self.draining else self.time_to_next_retry())
+                if not in_flight:
+                    if self.draining or not (self.to_visit or self.screened or self.release_rechecks()):
+                        if self.draining or not self.retrying:
+                            break
+                        # Only retries are left; wait for the first to come due
+                        await asyncio.sleep(timeout)
                     continue
-                
-                current_batch.append(current_relay)
-                batch_depth_map[current_relay] = depth
-                self.visited_relays.add(current_relay)
-            
-            if not current_batch:
-                break
-            
-            logger.info(f"Processing batch of {len(current_batch)} relays")
-            
-            # Test all relays in the batch concurrently
-            test_results = await self.test_relays_connections(current_batch)
-            
-            # Collect functioning relays for event fetching
-            functioning_relays_batch = []
-            for relay_url, is_functioning in test_results.items():
-                if is_functioning:
-                    self.functioning_relays.add(relay_url)
-                    self.stats.functioning_relays += 1
-                    
-                    # Only add to event fetching if we haven't reached max depth
-                    depth = batch_depth_map[relay_url]
-                    if depth < self.max_depth:
-                        functioning_relays_batch.append(relay_url)
-            
-            # Fetch events from all functioning relays concurrently
-            if functioning_relays_batch:
-                events_results = await self.fetch_events_from_relays(functioning_relays_batch)
-                
-                # Process events and extract new relays
-                for relay_url, events in events_results.items():
-                    if events:
-                        depth = batch_depth_map[relay_url]
-                        new_relays = self.extract_relays_from_events(events)
-                        
-                        # Add new relays to visit queue for next depth level
-                        for new_relay_url in new_relays:
-                            if new_relay_url not in self.visited_relays and new_relay_url not in self.to_visit_set:
-                                self.to_visit.append((new_relay_url, depth + 1))
-                                self.to_visit_set.add(new_relay_url)
-                                self.stats.total_relays_found += 1
-                                logger.debug(f"Added {new_relay_url} to visit queue at depth {depth + 1}")
-            
-            # Save progress periodically
-            if len(self.visited_relays) % self.save_point == 0:
-                logger.info(f"Progress checkpoint: Saving results after processing {len(self.visited_relays)} relays")
-                self.save_results()
-            
-            # Print periodic statistics
-            if len(self.visited_relays) % 10 == 0:
-                self.stats.print_stats()
+
+                done, in_flight = await asyncio.wait(
+                    in_flight, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    self.settle_task(task)
+                    relays_completed += 1
+
+                    # Append new outcomes to the journal periodically
+                    if relays_completed % self.save_point == 0:
+                        self.schedule_write(self.journal.flush())
+
+                    # Fold the journal into the results file less often
+                    if time.monotonic() - last_compaction >= self.compact_interval:
+                        last_compaction = time.monotonic()
+                        logger.info(f"Progress checkpoint: Saving results after processing {relays_completed} relays")
+                        self.schedule_write(self.compact())
+
+                    # Print periodic statistics
+                    if relays_completed % 10 == 0:
+                        self.stats.print_stats()
+
+                if self.deadline is not None and time.time() >= self.deadline:
+                    # Relays still in flight return to the frontier via in_progress
+                    self.stopped_at_deadline = True
+                    break
+        finally:
+            for task in in_flight:
+                task.cancel()
+            if in_flight:
+                await asyncio.gather(*in_flight, return_exceptions=True)
+            if self.background_writes:
+                await asyncio.gather(*self.background_writes, return_exceptions=True)
         
+        if self.draining:
+            remaining = len(self.to_visit) + len(self.in_progress)
+            logger.info(
+                f"Stopped at deadline with {remaining} relays left in the frontier "
+                f"({len(self.in_progress)} were still in flight)"
+            )
+        self.stats.relays_deferred = len(self.deferred)
+        if self.deferred:
+            logger.info(f"Skipped {len(self.deferred)} relays still in failure backoff")
+        logger.info(
+            f"DNS: {self.resolver.hits} resolutions answered from cache, "
+            f"{self.resolver.misses} looked up ({self.resolver.hit_rate():.0%} hit rate)"
+        )
+        if self.tls_context.handshakes:
+            logger.info(
+                f"TLS: {self.tls_context.resumed} of {self.tls_context.handshakes} handshakes "
+                f"resumed a session ({self.tls_context.hit_rate():.0%})"
+            )
+        if not self.concurrency.fixed:
+            logger.info(
+                f"Concurrency settled at {self.concurrency.level} "
+                f"(peak {self.concurrency.peak}, {self.concurrency.adjustments} adjustments)"
+            )
         logger.info("Discovery completed!")
         return self.functioning_relays
-    
-    def save_results(self, output_file: str = None):
-        """Save discovery results to a JSON file"""
-        if output_file is None:
-            output_file = self.output_file
-            
-        results = {
+
+    async def run_daemon(self):
+        """Crawl once, then keep re-probing every known relay on its own schedule
+
+        Each relay's next check sits in a heap. Due relays go back into the
+        frontier and are probed by the usual scheduler, alongside relays newly
+        discovered by harvests, so load stays smooth instead of coming in one
+        daily burst. Probes use the scheduled tiers, and the results file is
+        rewritten every ``compact_interval`` seconds. Runs until the deadline,
+        if there is one, or until cancelled.
+        """
+        await self.discover_relays()
+        if self.stopped_at_deadline:
+            return
+        self.save_results()
+
+        self.monitoring = True
+        self.scheduled_tiers = True
+        for relay_url in self.visited_relays:
+            self.schedule_check(relay_url, 0, relay_url in self.functioning_relays, spread=True)
+        for relay_url, depth in self.deferred.items():
+            self.schedule_check(relay_url, depth, False, spread=True)
+        self.deferred.clear()
+        logger.info(f"Monitoring {len(self.next_check)} relays")
+
+        in_flight: Set[asyncio.Task] = set()
+        last_compaction = time.monotonic()
+        try:
+            while not self.draining:
+                self.check_deadline()
+                self.admit_due_checks()
+                if not self.draining:
+                    self.admit_due_retries()
+                    self.start_relays(in_flight)
+
+                timeout = self.earliest(self.time_to_next_check(), self.time_to_next_retry(), self.time_to_next_phase())
+                if not in_flight:
+                    if timeout is None:
+                        logger.warning("No relays left to monitor")
+                        break
+                    await asyncio.sleep(timeout)
+                    continue
+
+                done, in_flight = await asyncio.wait(in_flight, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    self.settle_task(task)
+                self.stats.functioning_relays = len(self.functioning_relays)
+
+                if time.monotonic() - last_compaction >= self.compact_interval:
+                    last_compaction = time.monotonic()
+                    logger.info(
+                        f"Monitoring {len(self.next_check)} relays, "
+                        f"{len(self.functioning_relays)} functioning"
+                    )
+                    self.schedule_write(self.compact())
+
+            if in_flight:
+                # Let relays already started finish until the deadline
+                done, in_flight = await asyncio.wait(in_flight, timeout=self.time_to_next_phase())
+                for task in done:
+                    self.settle_task(task)
+        finally:
+            for task in in_flight:
+                task.cancel()
+            if in_flight:
+                await asyncio.gather(*in_flight, return_exceptions=True)
+            if self.background_writes:
+                await asyncio.gather(*self.background_writes, return_exceptions=True)
+            self.monitoring = False
+
+    def check_interval(self, relay_url: str, is_functioning: bool) -> float:
+        """Seconds until a relay's next daemon check, before jitter
+
+        A relay that keeps answering is checked less often, doubling from
+        ``daemon_min_interval`` to ``daemon_max_interval``. A failing relay
+        backs off the same way up to BACKOFF_BASE, so one that comes back is
+        noticed soon while a dead one costs little.
+        """
+        if is_functioning:
+            doublings = self.check_streaks.get(relay_url, 0)
+            ceiling = self.daemon_max_interval
+        else:
+            failures = self.state.get(relay_url, "failures") or {}
+            doublings = failures.get("count", 1) - 1
+            ceiling = max(BACKOFF_BASE, self.daemon_max_interval)
+        return min(self.daemon_min_interval * 2 ** min(max(doublings, 0), 16), ceiling)
+
+    def schedule_check(self, relay_url: str, depth: int, is_functioning: bool, spread: bool = False):
+        """Push a relay's next daemon check onto the heap
+
+        The interval is jittered so relays probed together drift apart; with
+        ``spread`` the check lands anywhere within the interval, which evens
+        out the relays all probed by the initial crawl.
+        """
+        interval = self.check_interval(relay_url, is_functioning)
+        if is_functioning:
+            self.check_streaks[relay_url] = self.check_streaks.get(relay_url, 0) + 1
+        else:
+            self.check_streaks.pop(relay_url, None)
+        if spread:
+            delay = random.uniform(0, interval)
+        else:
+            delay = interval * random.uniform(1 - DAEMON_JITTER, 1 + DAEMON_JITTER)
+        due = time.time() + delay
+        self.next_check[relay_url] = due
+        heapq.heappush(self.checks, (due, relay_url, depth))
+
+    def admit_due_checks(self) -> int:
+        """Move relays whose check is due from the daemon heap back into the frontier"""
+        now = time.time()
+        admitted = 0
+        while self.checks and self.checks[0][0] <= now:
+            due, relay_url, depth = heapq.heappop(self.checks)
+            if self.next_check.get(relay_url) != due:
+                continue  # superseded by a later outcome
+            del self.next_check[relay_url]
+            if relay_url in self.in_progress:
+                continue  # its outcome schedules the next check
+            self.visited_relays.discard(relay_url)
+            self.to_visit.push(relay_url, depth)
+            admitted += 1
+        return admitted
+
+    def time_to_next_check(self) -> Optional[float]:
+        """Seconds until the earliest daemon check is due, or None with nothing scheduled"""
+        while self.checks and self.next_check.get(self.checks[0][1]) != self.checks[0][0]:
+            heapq.heappop(self.checks)
+        if not self.checks:
+            return None
+        return max(0.0, self.checks[0][0] - time.time())
+
+    def build_results(self) -> Dict:
+        """Build the results document written to the output file"""
+        return {
             "discovery_settings": {
                 "initial_relay": self.initial_relay,
                 "max_depth": self.max_depth,
                 "connection_timeout": self.connection_timeout,
                 "save_point": self.save_point,
-                "batch_size": self.batch_size
+                "batch_size": self.batch_size,
+                "max_concurrency": self.concurrency.maximum,
+                "max_tier": self.max_tier,
+                "scheduled_tiers": self.scheduled_tiers
             },
             "progress_info": {
                 "relays_processed": len(self.visited_relays),
-                "relays_remaining": len(self.to_visit),
-                "discovery_complete": len(self.to_visit) == 0,
+                "relays_remaining": len(self.to_visit) + len(self.in_progress) + len(self.retrying),
+                "discovery_complete": not self.to_visit and not self.in_progress and not self.retrying,
+                "stopped_at_deadline": self.stopped_at_deadline,
                 "last_saved": time.time()
             },
             "statistics": {
@@ -623,16 +2545,192 @@ class NostrRelayDiscovery:
                 "events_processed": self.stats.events_processed,
                 "existing_relays_verified": self.stats.existing_relays_verified,
                 "existing_relays_failed": self.stats.existing_relays_failed,
+                "relays_deferred": len(self.deferred),
+                "outbox_pubkeys_queried": self.stats.outbox_pubkeys_queried,
+                "duplicate_events_dropped": self.stats.duplicate_events_dropped,
+                "eliminated_by_stage": dict(self.stats.eliminated),
+                "probes_by_tier": dict(self.stats.probes_by_tier),
+                "retries": {"scheduled": self.stats.retries_scheduled, "recovered": self.stats.retries_recovered},
+                "concurrency": self.concurrency.summary(),
+                "tls_sessions": self.tls_context.summary(),
                 "discovery_duration": time.time() - self.stats.start_time
             },
-            "functioning_relays": list(self.functioning_relays)
+            "functioning_relays": list(self.functioning_relays),
+            "relay_timings": {relay_url: self.relay_timings[relay_url] for relay_url in sorted(self.relay_timings)},
+            "relay_addresses": {relay_url: self.relay_addresses[relay_url] for relay_url in sorted(self.relay_addresses)},
+            "relay_health": {
+                relay_url: self.relay_health(relay_url)
+                for relay_url in sorted(self.visited_relays)
+                if self.state.get(relay_url, "history")
+            }
         }
-        
-        with open(output_file, 'w') as f:
-            json.dump(results, f, indent=2)
-        
+
+    def build_checkpoint(self) -> Dict:
+        """Build a snapshot of the full crawl state so an interrupted run can be resumed
+
+        Relays that were in flight are written back into the frontier at their
+        original depth, since their outcome was never recorded.
+        """
+        frontier = [[relay_url, depth, 0] for relay_url, depth in self.in_progress.items()]
+        frontier.extend([relay_url, depth, score] for relay_url, depth, score in self.to_visit.items())
+        frontier.extend([relay_url, depth, 0] for relay_url, depth in self.deferred.items())
+        frontier.extend([relay_url, depth, 0] for relay_url, depth in self.retrying.items())
+        unsettled_functioning = self.functioning_relays & self.in_progress.keys()
+
+        return {
+            "version": CHECKPOINT_VERSION,
+            "initial_relay": self.initial_relay,
+            "max_depth": self.max_depth,
+            "frontier": frontier,
+            "visited_relays": sorted(self.visited_relays - self.in_progress.keys()),
+            "functioning_relays": sorted(self.functioning_relays - unsettled_functioning),
+            "failed_relays": sorted(self.failed_relays),
+            "relay_timings": dict(self.relay_timings),
+            "relay_addresses": dict(self.relay_addresses),
+            "statistics": {
+                "total_relays_found": self.stats.total_relays_found,
+                "functioning_relays": self.stats.functioning_relays - len(unsettled_functioning),
+                "events_processed": self.stats.events_processed,
+                "existing_relays_verified": self.stats.existing_relays_verified,
+                "existing_relays_failed": self.stats.existing_relays_failed,
+                "eliminated_by_stage": dict(self.stats.eliminated),
+                "probes_by_tier": dict(self.stats.probes_by_tier),
+                "discovery_duration": time.time() - self.stats.start_time
+            },
+            "last_saved": time.time()
+        }
+
+    def save_results(self, output_file: str = None):
+        """Save discovery results to a JSON file"""
+        if output_file is None:
+            output_file = self.output_file
+
+        write_json_atomic(output_file, self.build_results(), indent=2)
         logger.info(f"Results saved to {output_file}")
 
+        self.save_checkpoint()
+        self.prune_state()
+        self.state.save()
+        self.resolver.save()
+
+    def prune_state(self):
+        """Drop long-dead relays from the state file so it does not grow without bound"""
+        pruned = self.state.prune(time.time())
+        if pruned:
+            logger.info(f"Pruned {pruned} relays not probed for {HISTORY_DAYS} days from the relay state")
+
+    def save_checkpoint(self):
+        """Write the checkpoint and truncate the journal it now covers"""
+        checkpoint = self.build_checkpoint()
+        self.journal.discard_pending()
+        write_json_atomic(self.checkpoint_file, checkpoint)
+        self.journal.truncate()
+        logger.debug(f"Checkpoint saved to {self.checkpoint_file}")
+
+    def _write_compacted(self, results: Dict, checkpoint: Dict, state: Dict):
+        write_json_atomic(self.output_file, results, indent=2)
+        write_json_atomic(self.checkpoint_file, checkpoint)
+        self.journal.truncate()
+        self.state.save(state)
+
+    async def compact(self):
+        """Fold the journal into the results file and checkpoint in a worker thread
+
+        The snapshot is taken under the journal lock, so outcomes recorded while
+        the files are being written stay buffered for the next flush.
+        """
+        async with self.journal.lock:
+            results = self.build_results()
+            checkpoint = self.build_checkpoint()
+            self.prune_state()
+            state = self.state.snapshot()
+            self.journal.discard_pending()
+            await asyncio.to_thread(self._write_compacted, results, checkpoint, state)
+        logger.info(f"Results saved to {self.output_file}")
+
+    def load_checkpoint(self) -> bool:
+        """Restore crawl state from the checkpoint file
+
+        Returns False when there is nothing to resume: no checkpoint, an
+        unreadable one, or one whose frontier was already exhausted.
+        """
+        if not os.path.exists(self.checkpoint_file):
+            logger.info(f"No checkpoint found at {self.checkpoint_file}, nothing to resume")
+            return False
+
+        try:
+            with open(self.checkpoint_file, 'r') as f:
+                checkpoint = json.load(f)
+
+            if checkpoint.get("version") != CHECKPOINT_VERSION:
+                logger.warning(f"Ignoring checkpoint with unsupported version {checkpoint.get('version')}")
+                return False
+
+            for relay_url, depth, *score in checkpoint["frontier"]:
+                self.to_visit.push(relay_url, depth, *score)
+            self.visited_relays.update(checkpoint["visited_relays"])
+            self.functioning_relays.update(checkpoint["functioning_relays"])
+            self.failed_relays.update(checkpoint["failed_relays"])
+            self.relay_timings.update(checkpoint.get("relay_timings", {}))
+            self.relay_addresses.update(checkpoint.get("relay_addresses", {}))
+
+            statistics = checkpoint.get("statistics", {})
+            self.stats.total_relays_found = statistics.get("total_relays_found", 0)
+            self.stats.functioning_relays = statistics.get("functioning_relays", 0)
+            self.stats.events_processed = statistics.get("events_processed", 0)
+            self.stats.existing_relays_verified = statistics.get("existing_relays_verified", 0)
+            self.stats.existing_relays_failed = statistics.get("existing_relays_failed", 0)
+            self.stats.eliminated = dict(statistics.get("eliminated_by_stage", {}))
+            self.stats.probes_by_tier = dict(statistics.get("probes_by_tier", {}))
+            self.stats.start_time = time.time() - statistics.get("discovery_duration", 0)
+
+            # Replay outcomes recorded since the checkpoint was written
+            entries = self.journal.read()
+            for entry in entries:
+                self.apply_journal_entry(entry)
+            if entries:
+                logger.info(f"Replayed {len(entries)} journal entries from {self.journal.path}")
+                for relay_url in self.visited_relays:
+                    self.to_visit.discard(relay_url)
+        except Exception as e:
+            logger.error(f"Error loading checkpoint: {e}")
+            self.reset_crawl_state()
+            return False
+
+        if not self.to_visit:
+            logger.info("Checkpoint describes a completed crawl, starting a new one")
+            self.reset_crawl_state()
+            return False
+
+        logger.info(f"Loaded checkpoint from {self.checkpoint_file}")
+        return True
+
+    def reset_crawl_state(self):
+        """Forget any partially loaded crawl state"""
+        self.to_visit.clear()
+        self.visited_relays.clear()
+        self.functioning_relays.clear()
+        self.failed_relays.clear()
+        self.relay_timings.clear()
+        self.relay_addresses.clear()
+        self.screened.clear()
+        self.stats = RelayDiscoveryStats()
+
+
+def parse_deadline(value: str) -> float:
+    """Parse a --deadline given as a Unix timestamp or an ISO 8601 time (UTC if no offset)"""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid deadline: {value}")
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
 
 async def main():
     """Main function"""
@@ -662,13 +2760,28 @@ async def main():
         "--save-point",
         type=int,
         default=SAVE_POINT,
-        help=f"Save progress every N relays processed (default: {SAVE_POINT})"
+        help=f"Append crawl outcomes to the journal every N relays processed (default: {SAVE_POINT})"
+    )
+    parser.add_argument(
+        "--compact-interval",
+        type=float,
+        default=COMPACT_INTERVAL,
+        help=f"Fold the journal into the results file every N seconds (default: {COMPACT_INTERVAL})"
     )
     parser.add_argument(
         "--batch-size",
         type=int,
         default=10,
-        help="Number of relays to process concurrently (default: 10)"
+        help="Number of relays kept in flight at first; tuned automatically afterwards (default: 10)"
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=MAX_CONCURRENCY,
+        help=(
+            "Upper bound for the automatically tuned number of relays in flight; "
+            f"set it to --batch-size to keep concurrency fixed (default: {MAX_CONCURRENCY})"
+        )
     )
     parser.add_argument(
         "--private-key",
@@ -678,6 +2791,154 @@ async def main():
             "(default: NOSTR_PRIVATE_KEY or an ephemeral key)"
         ),
     )
+    parser.add_argument(
+        "--checkpoint",
+        help="Crawl checkpoint file (default: <output>.checkpoint.json next to --output)"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted crawl from its checkpoint instead of starting over"
+    )
+    parser.add_argument(
+        "--state-file",
+        default="relay_state.json",
+        help="Per-relay state kept across runs, such as failure backoff (default: relay_state.json)"
+    )
+    parser.add_argument(
+        "--recheck-budget",
+        type=int,
+        default=RECHECK_BUDGET,
+        help=f"Relays still in failure backoff to re-check anyway each run (default: {RECHECK_BUDGET})"
+    )
+    parser.add_argument(
+        "--harvest-page-size",
+        type=int,
+        default=HARVEST_PAGE_SIZE,
+        help=f"Follow-list events requested per page (default: {HARVEST_PAGE_SIZE})"
+    )
+    parser.add_argument(
+        "--harvest-max-events",
+        type=int,
+        default=HARVEST_MAX_EVENTS,
+        help=f"Maximum follow-list events harvested per relay (default: {HARVEST_MAX_EVENTS})"
+    )
+    parser.add_argument(
+        "--harvest-max-bytes",
+        type=int,
+        default=HARVEST_MAX_BYTES,
+        help=f"Maximum bytes received while harvesting one relay (default: {HARVEST_MAX_BYTES})"
+    )
+    parser.add_argument(
+        "--full-harvest",
+        action="store_true",
+        help="Ignore stored per-relay cursors and harvest from the newest events back"
+    )
+    parser.add_argument(
+        "--deadline",
+        type=parse_deadline,
+        help="Stop the crawl by this time (Unix timestamp or ISO 8601, UTC unless an offset is given)"
+    )
+    parser.add_argument(
+        "--budget-seconds",
+        type=float,
+        help="Stop the crawl after this many seconds"
+    )
+    parser.add_argument(
+        "--outbox-chunk-size",
+        type=int,
+        default=OUTBOX_CHUNK_SIZE,
+        help=f"Pubkeys per kind 10002 authors filter (default: {OUTBOX_CHUNK_SIZE})"
+    )
+    parser.add_argument(
+        "--outbox-max-subscriptions",
+        type=int,
+        default=OUTBOX_MAX_SUBSCRIPTIONS,
+        help=f"Outbox lookups in flight per connection (default: {OUTBOX_MAX_SUBSCRIPTIONS})"
+    )
+    parser.add_argument(
+        "--outbox-pubkeys-per-relay",
+        type=int,
+        default=OUTBOX_PUBKEYS_PER_RELAY,
+        help=f"Pubkeys looked up per connected relay, 0 to disable (default: {OUTBOX_PUBKEYS_PER_RELAY})"
+    )
+    parser.add_argument(
+        "--dns-cache",
+        help="JSON file to keep resolved relay hostnames in between runs; shared with relays_geo_lookup.py"
+    )
+    parser.add_argument(
+        "--dns-server",
+        help="Query this nameserver (host or host:port) directly instead of the system resolver"
+    )
+    parser.add_argument(
+        "--raw-probe",
+        action="store_true",
+        help="Use the minimal built-in WebSocket client for liveness-only probes"
+    )
+    parser.add_argument(
+        "--prescreen",
+        action="store_true",
+        help="Check that relay hosts resolve and accept TCP connections before the full probe"
+    )
+    parser.add_argument(
+        "--prescreen-concurrency",
+        type=int,
+        default=PRESCREEN_CONCURRENCY,
+        help=f"Pre-screen checks kept in flight at once (default: {PRESCREEN_CONCURRENCY})"
+    )
+    parser.add_argument(
+        "--prescreen-timeout",
+        type=float,
+        default=PRESCREEN_TIMEOUT,
+        help=f"Seconds allowed for each pre-screen step (default: {PRESCREEN_TIMEOUT})"
+    )
+    parser.add_argument(
+        "--prescreen-tls",
+        action="store_true",
+        help="Also complete a TLS handshake in the pre-screen for wss:// relays"
+    )
+    parser.add_argument(
+        "--max-tier",
+        choices=PROBE_TIERS,
+        default="harvest",
+        help="Most expensive probe tier to use: handshake, nip11 (HTTP information document), "
+             "req (REQ and first frame) or harvest (default: harvest)"
+    )
+    parser.add_argument(
+        "--scheduled-tiers",
+        action="store_true",
+        help="Give stable relays the costlier probe tiers only when they are due, and a handshake otherwise"
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="After the crawl, keep re-probing known relays on jittered per-relay schedules "
+             "and keep the results file fresh (runs until --deadline or interrupted)"
+    )
+    parser.add_argument(
+        "--daemon-min-interval",
+        type=float,
+        default=DAEMON_MIN_INTERVAL,
+        help=f"Seconds between checks of a relay that just changed state (default: {DAEMON_MIN_INTERVAL:.0f})"
+    )
+    parser.add_argument(
+        "--daemon-max-interval",
+        type=float,
+        default=DAEMON_MAX_INTERVAL,
+        help=f"Seconds between checks of a relay that stays up (default: {DAEMON_MAX_INTERVAL:.0f})"
+    )
+    parser.add_argument(
+        "--retry-attempts",
+        type=int,
+        default=RETRY_ATTEMPTS,
+        help=f"Retries within the run after a transient failure such as a timeout, 0 to disable (default: {RETRY_ATTEMPTS})"
+    )
+    parser.add_argument(
+        "--retry-delay",
+        type=float,
+        default=RETRY_DELAY,
+        help=f"Seconds before the first retry, doubling for each further one (default: {RETRY_DELAY})"
+    )
     parser.add_argument(
         "--verbose",
         action="store_true",
@@ -685,19 +2946,52 @@ async def main():
     )
     
     args = parser.parse_args()
+
+    deadline = args.deadline
+    if args.budget_seconds is not None:
+        budget_deadline = time.time() + args.budget_seconds
+        deadline = budget_deadline if deadline is None else min(deadline, budget_deadline)
     
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
     
+    resolver = configure_default_resolver(args.dns_cache, args.dns_server)
+    
     # Validate initial relay URL
     discovery = NostrRelayDiscovery(
-        args.initial_relay, 
-        args.max_depth, 
-        args.timeout, 
-        args.output,
-        args.save_point,
-        args.batch_size,
-        args.private_key,
+        args.initial_relay,
+        max_depth=args.max_depth,
+        connection_timeout=args.timeout,
+        output_file=args.output,
+        save_point=args.save_point,
+        batch_size=args.batch_size,
+        private_key=args.private_key,
+        checkpoint_file=args.checkpoint,
+        resume=args.resume,
+        compact_interval=args.compact_interval,
+        state_file=args.state_file,
+        recheck_budget=args.recheck_budget,
+        harvest_page_size=args.harvest_page_size,
+        harvest_max_events=args.harvest_max_events,
+        harvest_max_bytes=args.harvest_max_bytes,
+        incremental_harvest=not args.full_harvest,
+        deadline=deadline,
+        outbox_chunk_size=args.outbox_chunk_size,
+        outbox_max_subscriptions=args.outbox_max_subscriptions,
+        outbox_pubkeys_per_relay=args.outbox_pubkeys_per_relay,
+        max_concurrency=args.max_concurrency,
+        resolver=resolver,
+        raw_probe=args.raw_probe,
+        prescreen=args.prescreen,
+        prescreen_concurrency=args.prescreen_concurrency,
+        prescreen_timeout=args.prescreen_timeout,
+        prescreen_tls=args.prescreen_tls,
+        max_tier=args.max_tier,
+        scheduled_tiers=args.scheduled_tiers,
+        daemon_min_interval=args.daemon_min_interval,
+        daemon_max_interval=args.daemon_max_interval,
+        retry_attempts=args.retry_attempts,
+        retry_delay=args.retry_delay,
     )
     if not discovery.is_valid_relay_url(args.initial_relay):
         print(f"Error: Invalid relay URL: {args.initial_relay}")
@@ -706,7 +3000,11 @@ async def main():
     
     try:
         # Run discovery
-        functioning_relays = await discovery.discover_relays()
+        if args.daemon:
+            await discovery.run_daemon()
+            functioning_relays = discovery.functioning_relays
+        else:
+            functioning_relays = await discovery.discover_relays()
         
         # Print final results
         print("\n=== DISCOVERY COMPLETED ===")
@@ -721,7 +3019,7 @@ async def main():
         
         return 0
         
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, asyncio.CancelledError):
         print("\nDiscovery interrupted by user")
         discovery.save_results()
         return 1
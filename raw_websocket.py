@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Raw WebSocket Probe Client
+
+A minimal WebSocket client on plain asyncio streams, for liveness probes that
+only upgrade, send a REQ and read a frame or two. It skips the extension
+negotiation, keepalive tasks and message queues of the websockets library:
+no compression is offered, pings are answered inline while reading, and
+outgoing frames are masked in a single pass over the payload.
+"""
+
+import asyncio
+import base64
+import hashlib
+import os
+import struct
+from typing import Optional
+
+WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+# Largest message accepted
+MAX_MESSAGE_SIZE = 2**20
+
+# Upper bound on the response headers of the upgrade
+MAX_HEADER_LINES = 100
+
+
+class RawWebSocketError(Exception):
+    """The server refused the upgrade or broke the WebSocket protocol"""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status  # HTTP status of a refused upgrade
+
+
+class RawWebSocketClosed(Exception):
+    """The server closed the connection"""
+
+    def __init__(self, code: Optional[int] = None, reason: str = ""):
+        super().__init__(f"connection closed (code {code}): {reason}" if code else "connection closed")
+        self.code = code
+        self.reason = reason
+
+
+def accept_key(key: str) -> str:
+    """The Sec-WebSocket-Accept value a server must answer ``key`` with"""
+    return base64.b64encode(hashlib.sha1(key.encode() + WEBSOCKET_GUID).digest()).decode()
+
+
+class RawWebSocket:
+    """Client side of one WebSocket connection over an asyncio stream pair
+
+    Offers the ``send``/``recv`` text interface the crawler's protocol code
+    uses. Create it with ``open``, which performs the HTTP upgrade.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, max_size: int = MAX_MESSAGE_SIZE):
+        self.reader = reader
+        self.writer = writer
+        self.max_size = max_size
+        self.bytes_received = 0
+        self.closed = False
+
+    @classmethod
+    async def open(
+        cls, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: str, path: str = "/",
+        max_size: int = MAX_MESSAGE_SIZE,
+    ) -> "RawWebSocket":
+        """Upgrade an open stream to a WebSocket connection"""
+        websocket = cls(reader, writer, max_size)
+        await websocket.handshake(host, path)
+        return websocket
+
+    @property
+    def transport(self) -> asyncio.BaseTransport:
+        return self.writer.transport
+
+    @property
+    def remote_address(self):
+        return self.writer.get_extra_info("peername")
+
+    async def handshake(self, host: str, path: str):
+        key = base64.b64encode(os.urandom(16)).decode()
+        self.writer.write(
+            (
+                f"GET {path or '/'} HTTP/1.1\r\n"
+                f"Host: {host}\r\n"
+                "Upgrade: websocket\r\n"
+                "Connection: Upgrade\r\n"
+                f"Sec-WebSocket-Key: {key}\r\n"
+                "Sec-WebSocket-Version: 13\r\n"
+                "\r\n"
+            ).encode()
+        )
+
+        status_line = await self.reader.readline()
+        self.bytes_received += len(status_line)
+        parts = status_line.decode("latin-1").split(" ", 2)
+        if len(parts) < 2 or parts[1] != "101":
+            raise RawWebSocketError(
+                f"upgrade refused: {status_line.decode('latin-1').strip()}",
+                int(parts[1]) if len(parts) >= 2 and parts[1].isdigit() else None,
+            )
+
+        headers = {}
+        for _ in range(MAX_HEADER_LINES):
+            line = await self.reader.readline()
+            self.bytes_received += len(line)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise RawWebSocketError("too many response headers")
+
+        if headers.get("sec-websocket-accept") != accept_key(key):
+            raise RawWebSocketError("invalid Sec-WebSocket-Accept")
+        if headers.get("sec-websocket-extensions"):
+            raise RawWebSocketError("server enabled an extension that was not offered")
+
+    async def send(self, message: str):
+        """Send one text message"""
+        await self.send_frame(OPCODE_TEXT, message.encode())
+
+    async def send_frame(self, opcode: int, payload: bytes):
+        length = len(payload)
+        if length < 126:
+            header = struct.pack("!BB", 0x80 | opcode, 0x80 | length)
+        elif length < 2**16:
+            header = struct.pack("!BBH", 0x80 | opcode, 0x80 | 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 0x80 | 127, length)
+
+        mask = os.urandom(4)
+        masked = b""
+        if length:
+            # XOR the payload with the repeated key as one big integer
+            repeated = (mask * (length // 4 + 1))[:length]
+            masked = (int.from_bytes(payload, "big") ^ int.from_bytes(repeated, "big")).to_bytes(length, "big")
+        # The transport may keep a reference to what it is given, so hand it an owned bytes object
+        self.writer.write(header + mask + masked)
+        await self.writer.drain()
+
+    async def read_frame(self):
+        header = await self.reader.readexactly(2)
+        first, second = header
+        length = second & 0x7F
+        extra = b""
+        if length == 126:
+            extra = await self.reader.readexactly(2)
+            length = struct.unpack("!H", extra)[0]
+        elif length == 127:
+            extra = await self.reader.readexactly(8)
+            length = struct.unpack("!Q", extra)[0]
+        if length > self.max_size:
+            raise RawWebSocketError(f"frame of {length} bytes exceeds limit")
+        mask = await self.reader.readexactly(4) if second & 0x80 else None
+        payload = await self.reader.readexactly(length)
+        self.bytes_received += 2 + len(extra) + (4 if mask else 0) + length
+        if mask:
+            repeated = (mask * (length // 4 + 1))[:length]
+            payload = (int.from_bytes(payload, "big") ^ int.from_bytes(repeated, "big")).to_bytes(length, "big")
+        return bool(first & 0x80), first & 0x0F, payload
+
+    async def recv(self) -> str:
+        """Receive one text message, answering pings and reassembling fragments"""
+        if self.closed:
+            raise RawWebSocketClosed()
+        fragments = []
+        size = 0
+        while True:
+            try:
+                final, opcode, payload = await self.read_frame()
+            except asyncio.IncompleteReadError as e:
+                self.closed = True
+                raise RawWebSocketClosed() from e
+
+            if opcode == OPCODE_PING:
+                await self.send_frame(OPCODE_PONG, payload)
+                continue
+            if opcode == OPCODE_PONG:
+                continue
+            if opcode == OPCODE_CLOSE:
+                self.closed = True
+                code = struct.unpack("!H", payload[:2])[0] if len(payload) >= 2 else None
+                raise RawWebSocketClosed(code, payload[2:].decode("utf-8", "replace"))
+            if opcode not in (OPCODE_TEXT, OPCODE_BINARY, OPCODE_CONTINUATION):
+                raise RawWebSocketError(f"unexpected opcode {opcode}")
+            if (opcode == OPCODE_CONTINUATION) != bool(fragments):
+                raise RawWebSocketError("unexpected continuation frame")
+
+            fragments.append(payload)
+            size += len(payload)
+            if size > self.max_size:
+                raise RawWebSocketError(f"message of more than {self.max_size} bytes")
+            if final:
+                return b"".join(fragments).decode()
+
+    async def close(self, code: int = 1000):
+        """Send a close frame, if still possible, and close the stream"""
+        if not self.closed:
+            self.closed = True
+            try:
+                await self.send_frame(OPCODE_CLOSE, struct.pack("!H", code))
+            except (ConnectionError, RuntimeError):
+                pass
+        self.writer.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+        return False
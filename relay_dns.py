@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""
+Relay DNS Resolution
+
+Shared hostname resolution for the relay crawler and the geolocation stage.
+Lookups are cached per process with positive and negative TTLs, concurrent
+lookups of one host are coalesced, the number of lookups in flight is bounded,
+and the cache can be persisted to a JSON file so both tools share it.
+
+Lookups go through the system resolver by default, or through DNSClient, a
+small asyncio DNS client that talks to a nameserver directly and so does not
+queue behind the getaddrinfo thread pool.
+"""
+
+import asyncio
+import ipaddress
+import json
+import logging
+import os
+import secrets
+import socket
+import struct
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Version of the on-disk cache format written by CachingResolver.save
+DNS_CACHE_VERSION = 1
+
+# Seconds a successful or failed lookup is reused for
+POSITIVE_TTL = 3600
+NEGATIVE_TTL = 300
+
+# Lookups running at once; getaddrinfo occupies one executor thread each,
+# while DNSClient only holds a query id on its shared socket
+MAX_IN_FLIGHT = 16
+DNS_CLIENT_MAX_IN_FLIGHT = 256
+
+# (family, ip) pairs, IPv6 and IPv4 alike
+Addresses = List[Tuple[int, str]]
+
+# getaddrinfo errors meaning the name has no addresses, as opposed to a
+# resolver that failed to answer
+NXDOMAIN_ERRORS = frozenset(
+    code for code in (socket.EAI_NONAME, getattr(socket, "EAI_NODATA", None)) if code is not None
+)
+
+
+async def system_lookup(hostname: str) -> Addresses:
+    """Resolve a hostname with the system resolver through ``loop.getaddrinfo``"""
+    loop = asyncio.get_running_loop()
+    infos = await loop.getaddrinfo(hostname, None, type=socket.SOCK_STREAM)
+    return list(dict.fromkeys((family, sockaddr[0]) for family, _, _, _, sockaddr in infos))
+
+
+def is_nxdomain(error: BaseException) -> bool:
+    """True for a lookup error that says the name does not exist, rather than a failed lookup"""
+    return isinstance(error, socket.gaierror) and error.errno in NXDOMAIN_ERRORS
+
+
+def literal_address(hostname: str) -> Optional[Addresses]:
+    """Return the address of an IP literal hostname, or None for a name"""
+    try:
+        ip = ipaddress.ip_address(hostname.strip("[]"))
+    except ValueError:
+        return None
+    family = socket.AF_INET6 if ip.version == 6 else socket.AF_INET
+    return [(family, str(ip))]
+
+
+def socket_address(family: int, ip: str, port: int) -> Tuple:
+    """Build the sockaddr tuple ``sock_connect`` expects for an address family"""
+    if family == socket.AF_INET6:
+        return (ip, port, 0, 0)
+    return (ip, port)
+
+
+class CachingResolver:
+    """Async hostname resolver with a TTL cache shared by everything in the process
+
+    ``lookup`` does the actual resolution and defaults to the system resolver;
+    tests pass a stub. Failed lookups raise ``socket.gaierror``; names that do
+    not exist are cached for ``negative_ttl`` so dead hostnames are not asked
+    about again and again, while resolver failures are not cached at all.
+    """
+
+    def __init__(
+        self,
+        lookup: Callable[[str], Awaitable[Addresses]] = system_lookup,
+        positive_ttl: float = POSITIVE_TTL,
+        negative_ttl: float = NEGATIVE_TTL,
+        max_in_flight: int = MAX_IN_FLIGHT,
+        cache_file: Optional[str] = None,
+    ):
+        self.lookup = lookup
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_in_flight = max_in_flight
+        self.cache_file = cache_file
+        # hostname -> {"expires": unix time, "addresses": [[family, ip], ...]} or {"expires", "error"}
+        self.entries: Dict[str, Dict] = {}
+        self.pending: Dict[str, asyncio.Future] = {}
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.hits = 0
+        self.misses = 0
+
+    async def resolve(self, hostname: str, timeout: Optional[float] = None) -> Addresses:
+        """Return the (family, ip) addresses of a hostname, from cache when fresh
+
+        ``timeout`` bounds the lookup itself, not the wait for a free slot,
+        so a queue of unanswered lookups does not time out the ones behind it.
+        """
+        hostname = hostname.lower().rstrip(".")
+        literal = literal_address(hostname)
+        if literal is not None:
+            return literal
+
+        entry = self.entries.get(hostname)
+        if entry is not None and entry["expires"] > time.time():
+            self.hits += 1
+            return self._unpack(hostname, entry)
+
+        # Coalesce concurrent lookups of the same host into one
+        pending = self.pending.get(hostname)
+        if pending is not None:
+            self.hits += 1
+            try:
+                entry = await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The lookup we joined was cancelled with its caller; start our own
+                return await self.resolve(hostname, timeout)
+            return self._unpack(hostname, entry)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self.pending[hostname] = future
+        try:
+            entry = await self._lookup(hostname, timeout)
+            self.entries[hostname] = entry
+            future.set_result(entry)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Nobody else may be waiting; mark the exception as retrieved
+            future.exception()
+            raise
+        finally:
+            del self.pending[hostname]
+        return self._unpack(hostname, entry)
+
+    async def _lookup(self, hostname: str, timeout: Optional[float] = None) -> Dict:
+        loop = asyncio.get_running_loop()
+        if self.semaphore is None or self.semaphore_loop is not loop:
+            # A semaphore belongs to one event loop; the resolver may outlive it
+            self.semaphore = asyncio.Semaphore(self.max_in_flight)
+            self.semaphore_loop = loop
+        async with self.semaphore:
+            try:
+                addresses = await asyncio.wait_for(self.lookup(hostname), timeout)
+            except socket.gaierror as e:
+                if not is_nxdomain(e):
+                    raise
+                return {"expires": time.time() + self.negative_ttl, "error": str(e)}
+        if not addresses:
+            return {"expires": time.time() + self.negative_ttl, "error": "no addresses"}
+        return {
+            "expires": time.time() + self.positive_ttl,
+            "addresses": [[family, ip] for family, ip in addresses],
+        }
+
+    @staticmethod
+    def _unpack(hostname: str, entry: Dict) -> Addresses:
+        if "error" in entry:
+            raise socket.gaierror(socket.EAI_NONAME, f"{hostname}: {entry['error']} (cached)")
+        return [(family, ip) for family, ip in entry["addresses"]]
+
+    def load(self):
+        """Load unexpired entries from ``cache_file``, if there is one"""
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, 'r') as f:
+                data = json.load(f)
+            if data.get("version") != DNS_CACHE_VERSION:
+                logger.warning(f"Ignoring DNS cache with unsupported version {data.get('version')}")
+                return
+            now = time.time()
+            for hostname, entry in data.get("hosts", {}).items():
+                if entry["expires"] > now and hostname not in self.entries:
+                    self.entries[hostname] = entry
+            logger.info(f"Loaded {len(self.entries)} cached DNS entries from {self.cache_file}")
+        except Exception as e:
+            logger.error(f"Error loading DNS cache: {e}")
+
+    def save(self):
+        """Write unexpired entries to ``cache_file`` atomically, if there is one"""
+        if not self.cache_file:
+            return
+        now = time.time()
+        hosts = {hostname: entry for hostname, entry in self.entries.items() if entry["expires"] > now}
+        tmp_path = f"{self.cache_file}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"version": DNS_CACHE_VERSION, "hosts": hosts}, f)
+        os.replace(tmp_path, self.cache_file)
+
+    def hit_rate(self) -> float:
+        """Share of resolutions answered without a new lookup"""
+        return self.hits / max(1, self.hits + self.misses)
+
+
+_default_resolver: Optional[CachingResolver] = None
+
+
+def default_resolver() -> CachingResolver:
+    """Return the process-wide resolver, creating it on first use"""
+    global _default_resolver
+    if _default_resolver is None:
+        _default_resolver = CachingResolver()
+    return _default_resolver
+
+
+# Record types the DNS client asks for
+QTYPE_A = 1
+QTYPE_AAAA = 28
+QTYPE_FAMILIES = {QTYPE_A: socket.AF_INET, QTYPE_AAAA: socket.AF_INET6}
+
+# Per-attempt wait for an answer, and attempts after the first
+DNS_TIMEOUT = 2.0
+DNS_RETRIES = 2
+
+RCODE_NXDOMAIN = 3
+FLAG_TRUNCATED = 0x0200
+
+
+def parse_server(server: str) -> Tuple[str, int]:
+    """Split ``host``, ``host:port`` or ``[v6]:port`` into host and port (53 by default)"""
+    if server.startswith("["):
+        host, _, port = server[1:].partition("]")
+        return host, int(port.lstrip(":") or 53)
+    if server.count(":") == 1:
+        host, port = server.split(":")
+        return host, int(port)
+    return server, 53
+
+
+def encode_query(query_id: int, hostname: str, qtype: int) -> bytes:
+    """Build a recursive DNS query for one name and record type"""
+    header = struct.pack("!HHHHHH", query_id, 0x0100, 1, 0, 0, 0)
+    labels = b"".join(
+        bytes([len(label)]) + label for label in hostname.encode("idna").split(b".") if label
+    )
+    return header + labels + b"\x00" + struct.pack("!HH", qtype, 1)
+
+
+def _skip_name(message: bytes, offset: int) -> int:
+    """Return the offset just past a possibly compressed name"""
+    while True:
+        length = message[offset]
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        offset += 1
+        if length == 0:
+            return offset
+        offset += length
+
+
+def decode_answer(message: bytes, qtype: int) -> Tuple[int, int, List[str]]:
+    """Parse a DNS response into (flags, rcode, addresses of ``qtype``)"""
+    _, flags, qdcount, ancount, _, _ = struct.unpack_from("!HHHHHH", message)
+    offset = 12
+    for _ in range(qdcount):
+        offset = _skip_name(message, offset) + 4
+    addresses = []
+    for _ in range(ancount):
+        offset = _skip_name(message, offset)
+        rtype, _, _, rdlength = struct.unpack_from("!HHIH", message, offset)
+        offset += 10
+        if rtype == qtype:
+            addresses.append(socket.inet_ntop(QTYPE_FAMILIES[qtype], message[offset:offset + rdlength]))
+        offset += rdlength
+    return flags, flags & 0x000F, addresses
+
+
+class _DNSDatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, client: "DNSClient"):
+        self.client = client
+
+    def datagram_received(self, data: bytes, addr):
+        if len(data) < 12:
+            return
+        query_id = struct.unpack_from("!H", data)[0]
+        future = self.client.pending.get(query_id)
+        if future is not None and not future.done():
+            future.set_result(data)
+
+    def error_received(self, exc: Exception):
+        logger.debug(f"DNS socket error: {exc}")
+
+
+class DNSClient:
+    """Minimal asyncio DNS client for A and AAAA records
+
+    Queries share one UDP socket and are matched to answers by id, so many
+    lookups are in flight on it at once without any executor threads. An
+    unanswered query is resent up to ``retries`` times, and a truncated
+    answer is fetched again over TCP. ``lookup`` fits CachingResolver.
+    """
+
+    def __init__(self, server: str, timeout: float = DNS_TIMEOUT, retries: int = DNS_RETRIES):
+        self.host, self.port = parse_server(server)
+        self.timeout = timeout
+        self.retries = retries
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.transport_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.opening: Optional[asyncio.Task] = None
+
+    async def lookup(self, hostname: str) -> Addresses:
+        """Query A and AAAA together and return both, IPv6 first like getaddrinfo"""
+        results = await asyncio.gather(
+            self.query(hostname, QTYPE_AAAA), self.query(hostname, QTYPE_A), return_exceptions=True
+        )
+        addresses = [
+            (QTYPE_FAMILIES[qtype], ip)
+            for qtype, result in zip((QTYPE_AAAA, QTYPE_A), results)
+            if not isinstance(result, BaseException)
+            for ip in result
+        ]
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if addresses or not errors:
+            return addresses
+        # Prefer a definite NXDOMAIN over a timeout on the other record type
+        for error in errors:
+            if isinstance(error, socket.gaierror):
+                raise error
+        raise errors[0]
+
+    async def query(self, hostname: str, qtype: int) -> List[str]:
+        """Ask for one record type, retrying over UDP and falling back to TCP"""
+        await self._ensure_transport()
+        query_id = self._new_id()
+        message = encode_query(query_id, hostname, qtype)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[query_id] = future
+        try:
+            for attempt in range(self.retries + 1):
+                self.transport.sendto(message)
+                try:
+                    answer = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+                    break
+                except asyncio.TimeoutError:
+                    logger.debug(f"DNS query for {hostname} timed out (attempt {attempt + 1})")
+            else:
+                raise asyncio.TimeoutError(f"no DNS answer for {hostname} from {self.host}")
+        finally:
+            del self.pending[query_id]
+            future.cancel()
+
+        try:
+            flags, rcode, addresses = decode_answer(answer, qtype)
+            if flags & FLAG_TRUNCATED:
+                flags, rcode, addresses = decode_answer(await self._query_tcp(message), qtype)
+        except (struct.error, IndexError, ValueError) as e:
+            raise socket.gaierror(socket.EAI_AGAIN, f"{hostname}: malformed DNS answer: {e}") from e
+        if rcode == RCODE_NXDOMAIN:
+            raise socket.gaierror(socket.EAI_NONAME, f"{hostname}: no such domain")
+        if rcode != 0:
+            raise socket.gaierror(socket.EAI_AGAIN, f"{hostname}: DNS error code {rcode}")
+        return addresses
+
+    async def _query_tcp(self, message: bytes) -> bytes:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        try:
+            writer.write(struct.pack("!H", len(message)) + message)
+            length = struct.unpack("!H", await asyncio.wait_for(reader.readexactly(2), self.timeout))[0]
+            return await asyncio.wait_for(reader.readexactly(length), self.timeout)
+        finally:
+            writer.close()
+
+    async def _ensure_transport(self):
+        loop = asyncio.get_running_loop()
+        if self.transport is not None and self.transport_loop is loop and not self.transport.is_closing():
+            return
+        if self.opening is None or self.transport_loop is not loop or self.opening.done():
+            # Queries that arrive while the socket is opening wait for the same one
+            self.transport_loop = loop
+            self.opening = loop.create_task(loop.create_datagram_endpoint(
+                lambda: _DNSDatagramProtocol(self), remote_addr=(self.host, self.port)
+            ))
+        self.transport, _ = await asyncio.shield(self.opening)
+
+    def _new_id(self) -> int:
+        while True:
+            query_id = secrets.randbelow(0x10000)
+            if query_id not in self.pending:
+                return query_id
+
+    def close(self):
+        """Close the UDP socket; it is reopened on the next query"""
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+        self.opening = None
+
+
+def configure_default_resolver(cache_file: Optional[str] = None, dns_server: Optional[str] = None) -> CachingResolver:
+    """Apply the --dns-cache and --dns-server options to the process-wide resolver"""
+    resolver = default_resolver()
+    if dns_server:
+        resolver.lookup = DNSClient(dns_server).lookup
+        resolver.max_in_flight = DNS_CLIENT_MAX_IN_FLIGHT
+        logger.info(f"Resolving hostnames with nameserver {dns_server}")
+    resolver.cache_file = cache_file
+    resolver.load()
+    return resolver
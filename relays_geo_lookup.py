@@ -10,9 +10,12 @@ import struct
 import bisect
 import asyncio
 import re
+import json
 import argparse
 from typing import List, Tuple, Optional, Dict
 
+from relay_dns import CachingResolver, configure_default_resolver, default_resolver
+
 # Configuration
 DB_URL = "https://github.com/sapics/ip-location-db/releases/download/latest/dbip-city-ipv4-num.csv.gz"
 DB_FILENAME_GZ = "dbip-city-ipv4-num.csv.gz"
@@ -128,24 +131,47 @@ def clean_url(url: str) -> str:
     url = url.split(':')[0]
     return url
 
-async def resolve_and_locate(url: str, raw_url: str, geo_db: GeoIPDatabase) -> Optional[Tuple[str, str, str]]:
-    """Resolves URL and looks up Geo location."""
+def load_known_addresses(results_path: str) -> Dict[str, str]:
+    """Maps relay hostnames to the IPv4 address the crawler connected to.
+
+    Reads the ``relay_addresses`` section of a relay_discovery_results.json.
+    IPv6 peers are left out since the location database is IPv4-only.
+    """
+    try:
+        with open(results_path, 'r') as f:
+            addresses = json.load(f).get("relay_addresses", {})
+    except (OSError, ValueError) as e:
+        print(f"Could not read relay addresses from {results_path}: {e}")
+        return {}
+
+    known = {}
+    for relay_url, address in addresses.items():
+        if address.get("family") == "ipv4":
+            known[clean_url(relay_url)] = address["ip"]
+    return known
+
+async def resolve_and_locate(url: str, raw_url: str, geo_db: GeoIPDatabase, known_addresses: Optional[Dict[str, str]] = None, resolver: Optional[CachingResolver] = None) -> Optional[Tuple[str, str, str]]:
+    """Resolves URL and looks up Geo location.
+
+    Hosts found in ``known_addresses`` use the recorded IP and skip DNS; the
+    rest go through the shared, cached resolver.
+    """
     hostname = clean_url(url)
     if not hostname:
         return None
         
     try:
-        # Async DNS resolution
-        loop = asyncio.get_running_loop()
-        # getaddrinfo returns list of (family, type, proto, canonname, sockaddr)
-        # sockaddr is (address, port) for IPv4
-        infos = await loop.getaddrinfo(hostname, None, family=socket.AF_INET)
-        
-        if not infos:
-            return None
+        ip = (known_addresses or {}).get(hostname)
+        if ip is None:
+            # Async DNS resolution, IPv4 only since the database is
+            addresses = await (resolver or default_resolver()).resolve(hostname)
+            ipv4 = [address for family, address in addresses if family == socket.AF_INET]
             
-        # Take the first IP
-        ip = infos[0][4][0]
+            if not ipv4:
+                return None
+                
+            # Take the first IP
+            ip = ipv4[0]
         
         # Geo Lookup
         loc = geo_db.lookup(ip)
@@ -165,6 +191,9 @@ async def main():
     parser.add_argument("output_file", help="Path to output CSV file")
     parser.add_argument("--db", default=DB_FILENAME, help=f"Path to DB-IP CSV (default: {DB_FILENAME})")
     parser.add_argument("--input", help="Input file with relay URLs (one per line). Defaults to stdin if not provided.")
+    parser.add_argument("--results", help="relay_discovery_results.json whose recorded relay addresses are used instead of DNS")
+    parser.add_argument("--dns-cache", help="JSON file of cached DNS answers, shared with nostr_relay_discovery.py")
+    parser.add_argument("--dns-server", help="Query this nameserver (host or host:port) directly instead of the system resolver")
     
     # We parse args manually if we want to support the simple "$0 output.csv" usage 
     # while also supporting flags, but argparse handles it well.
@@ -192,11 +221,17 @@ async def main():
         print("No URLs provided via input file or stdin.")
         return
 
+    known_addresses = load_known_addresses(args.results) if args.results else {}
+    if known_addresses:
+        print(f"Using {len(known_addresses)} addresses recorded during discovery")
+
     print(f"Processing {len(urls)} relays...")
     
     # Process concurrently
-    tasks = [resolve_and_locate(url, url, db) for url in urls]
+    resolver = configure_default_resolver(args.dns_cache, args.dns_server)
+    tasks = [resolve_and_locate(url, url, db, known_addresses, resolver) for url in urls]
     results = await asyncio.gather(*tasks)
+    resolver.save()
     
     # Write Output
     success_count = 0
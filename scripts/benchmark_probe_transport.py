@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark Probe Transports
+
+Runs liveness probes against a local stand-in relay with the websockets client
+and with the minimal RawWebSocket client (--raw-probe), and reports probes per
+second and CPU time per probe for each. Both paths share DNS, TCP and TLS
+handling, so the difference is the WebSocket client itself. The relay runs in
+the same process, so CPU figures include its share, which is equal for both.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import secrets
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from websockets.asyncio.server import serve
+
+from nostr_relay_discovery import NostrRelayDiscovery
+
+
+async def relay(websocket):
+    """Answer every liveness REQ with one event and EOSE"""
+    async for message in websocket:
+        request = json.loads(message)
+        if request[0] == "REQ":
+            await websocket.send(json.dumps(["EVENT", request[1], {"kind": 1, "content": "hi"}]))
+            await websocket.send(json.dumps(["EOSE", request[1]]))
+
+
+async def run_probes(discovery: NostrRelayDiscovery, relay_url: str, probes: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def probe():
+        async with semaphore:
+            return await discovery.test_relay_connection(relay_url)
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    results = await asyncio.gather(*(probe() for _ in range(probes)))
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    return sum(results), wall, cpu
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Compare the websockets and raw probe transports.")
+    parser.add_argument("--probes", type=int, default=2000, help="Probes per transport (default: 2000)")
+    parser.add_argument("--concurrency", type=int, default=50, help="Probes in flight (default: 50)")
+    parser.add_argument("--rounds", type=int, default=3, help="Alternating rounds per transport (default: 3)")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    async with serve(relay, "127.0.0.1", 0, compression=None) as server:
+        port = server.sockets[0].getsockname()[1]
+        relay_url = f"ws://127.0.0.1:{port}"
+        print(f"Local relay on {relay_url}, {args.probes} probes x {args.rounds} rounds, {args.concurrency} in flight")
+
+        totals = {False: [0, 0.0, 0.0], True: [0, 0.0, 0.0]}
+        for _ in range(args.rounds):
+            for raw in (False, True):
+                discovery = NostrRelayDiscovery(relay_url, private_key=secrets.token_hex(32), raw_probe=raw)
+                ok, wall, cpu = await run_probes(discovery, relay_url, args.probes, args.concurrency)
+                totals[raw][0] += ok
+                totals[raw][1] += wall
+                totals[raw][2] += cpu
+
+    total_probes = args.probes * args.rounds
+    print(f"{'transport':<12}{'ok':>8}{'probes/s':>12}{'CPU ms/probe':>15}")
+    for raw, label in ((False, "websockets"), (True, "raw")):
+        ok, wall, cpu = totals[raw]
+        print(f"{label:<12}{ok:>8}{total_probes / wall:>12.0f}{cpu / total_probes * 1000:>15.3f}")
+
+    speedup = totals[False][2] / max(totals[True][2], 1e-9)
+    print(f"Raw transport uses {speedup:.2f}x less CPU per probe")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Relay Health Report
+
+Prints the decayed uptime and latency scores of every relay with probe
+history in the relay state file written by nostr_relay_discovery.py, most
+reliable first. The scores come from the daily outcome counts kept in the
+state file, so no git history has to be replayed.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nostr_relay_discovery import health_scores
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report relay uptime and latency scores from the relay state file.")
+    parser.add_argument("--state-file", default="relay_state.json", help="Relay state file (default: relay_state.json)")
+    parser.add_argument("--min-uptime", type=float, default=0.0, help="Only list relays with at least this uptime (0-1)")
+    parser.add_argument("--json", action="store_true", help="Print the scores as JSON")
+    args = parser.parse_args()
+
+    with open(args.state_file) as f:
+        relays = json.load(f).get("relays", {})
+
+    now = time.time()
+    scores = {
+        relay_url: health_scores(sections["history"], now)
+        for relay_url, sections in relays.items()
+        if "history" in sections
+    }
+    ranked = sorted(
+        (item for item in scores.items() if item[1]["uptime"] >= args.min_uptime),
+        key=lambda item: (-item[1]["uptime"], item[1]["latency_ms"] or float("inf"), item[0]),
+    )
+
+    if args.json:
+        print(json.dumps(dict(ranked), indent=2))
+        return
+
+    print(f"{'relay':<50}{'uptime':>8}{'latency ms':>12}{'probes':>8}")
+    for relay_url, score in ranked:
+        latency = score["latency_ms"] if score["latency_ms"] is not None else "-"
+        print(f"{relay_url:<50}{score['uptime']:>8.1%}{latency:>12}{score['probes']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,37 @@
 import asyncio
 import hashlib
 import json
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import tempfile
+import time
 import unittest
 from unittest.mock import patch
 
 from embit import ec
+from websockets.asyncio.server import serve
 
-from nostr_relay_discovery import NostrRelayDiscovery
+from nostr_relay_discovery import (
+    ConcurrencyController,
+    EventDeduplicator,
+    NostrRelayDiscovery,
+    RelayFrontier,
+    RelayProbeResult,
+    canonicalize_relay_url,
+    classify_failure,
+    health_scores,
+    record_history,
+)
+from raw_websocket import RawWebSocketError
+from relay_dns import CachingResolver
 
 
 class FakeWebSocket:
+    remote_address = None
+
     def __init__(self, messages):
         self.messages = iter(messages)
         self.sent = []
@@ -20,6 +42,28 @@ class FakeWebSocket:
     async def send(self, message):
         self.sent.append(json.loads(message))
 
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class DiscoveryTestCase(unittest.TestCase):
+    """Base for tests that need a crawler writing its files to a temporary directory"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.output_file = os.path.join(self.tmpdir.name, "results.json")
+        self.state_file = os.path.join(self.tmpdir.name, "state.json")
+
+    def make_discovery(self, initial_relay="wss://seed.example.com", **kwargs):
+        kwargs.setdefault("output_file", self.output_file)
+        kwargs.setdefault("state_file", self.state_file)
+        kwargs.setdefault("private_key", "01".zfill(64))
+        return NostrRelayDiscovery(initial_relay, **kwargs)
+
 
 class Nip42Tests(unittest.TestCase):
     def setUp(self):
@@ -117,5 +161,1388 @@ class Nip42Tests(unittest.TestCase):
         asyncio.run(run_test())
 
 
+class SchedulerTests(DiscoveryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.discovery = self.make_discovery(max_depth=1, batch_size=2)
+
+    def test_slow_relay_does_not_block_free_slots(self):
+        delays = {
+            "wss://slow.example.com": 0.3,
+            "wss://a.example.com": 0.01,
+            "wss://b.example.com": 0.01,
+            "wss://c.example.com": 0.01,
+        }
+        finished = []
+        in_flight = 0
+        peak = 0
+
+        async def fake_process(relay_url, depth):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(delays[relay_url])
+            in_flight -= 1
+            finished.append(relay_url)
+
+        async def fake_load():
+            for relay_url in delays:
+                self.discovery.to_visit.push(relay_url, 0)
+
+        with patch.object(self.discovery, "load_existing_results", fake_load), \
+                patch.object(self.discovery, "process_relay", fake_process):
+            asyncio.run(self.discovery.discover_relays())
+
+        self.assertEqual(peak, 2)
+        self.assertEqual(finished[-1], "wss://slow.example.com")
+        self.assertEqual(self.discovery.visited_relays, set(delays))
+
+    def test_discovered_relays_are_enqueued_one_level_deeper(self):
+        async def fake_probe(relay_url, harvest=True):
+            if not harvest:
+                return RelayProbeResult(True)
+            return RelayProbeResult(True, {"wss://next.example.com"}, 1)
+
+        with patch.object(self.discovery, "probe_relay", fake_probe):
+            asyncio.run(self.discovery.discover_relays())
+
+        self.assertEqual(
+            self.discovery.functioning_relays,
+            {"wss://seed.example.com", "wss://next.example.com"},
+        )
+        self.assertEqual(self.discovery.stats.total_relays_found, 1)
+
+
+    def test_deadline_stops_admission_and_returns_in_flight_relays(self):
+        self.discovery.deadline = time.time() + 0.3
+        self.discovery.drain_window = 0.2
+        started = []
+
+        async def fake_process(relay_url, depth):
+            started.append(relay_url)
+            await asyncio.sleep(0.15 if relay_url == "wss://fast.example.com" else 10)
+
+        async def fake_load():
+            for relay_url in [
+                "wss://fast.example.com",
+                "wss://stuck.example.com",
+                "wss://late.example.com",
+            ]:
+                self.discovery.to_visit.push(relay_url, 0)
+
+        begin = time.monotonic()
+        with patch.object(self.discovery, "load_existing_results", fake_load), \
+                patch.object(self.discovery, "process_relay", fake_process):
+            asyncio.run(self.discovery.discover_relays())
+
+        self.assertLess(time.monotonic() - begin, 2)
+        self.assertTrue(self.discovery.stopped_at_deadline)
+        self.assertEqual(started, ["wss://fast.example.com", "wss://stuck.example.com"])
+        checkpoint = self.discovery.build_checkpoint()
+        self.assertEqual(
+            sorted(relay_url for relay_url, *_ in checkpoint["frontier"]),
+            ["wss://late.example.com", "wss://stuck.example.com"],
+        )
+
+
+class CheckpointTests(DiscoveryTestCase):
+    def test_checkpoint_round_trip_requeues_in_flight_relays(self):
+        discovery = self.make_discovery()
+        discovery.visited_relays.update(
+            {"wss://up.example.com", "wss://down.example.com", "wss://busy.example.com"}
+        )
+        discovery.functioning_relays.update({"wss://up.example.com", "wss://busy.example.com"})
+        discovery.stats.functioning_relays = 2
+        discovery.failed_relays.add("wss://down.example.com")
+        discovery.in_progress["wss://busy.example.com"] = 1
+        discovery.to_visit.push("wss://next.example.com", 2, 7)
+        discovery.save_results()
+
+        resumed = self.make_discovery(resume=True)
+        self.assertTrue(resumed.load_checkpoint())
+
+        self.assertEqual(
+            resumed.to_visit.items(),
+            [("wss://busy.example.com", 1, 0), ("wss://next.example.com", 2, 7)],
+        )
+        self.assertEqual(
+            resumed.visited_relays, {"wss://up.example.com", "wss://down.example.com"}
+        )
+        self.assertEqual(resumed.functioning_relays, {"wss://up.example.com"})
+        self.assertEqual(resumed.stats.functioning_relays, 1)
+        self.assertEqual(resumed.failed_relays, {"wss://down.example.com"})
+
+    def test_resume_does_not_reprobe_settled_relays(self):
+        discovery = self.make_discovery()
+        discovery.visited_relays.add("wss://seed.example.com")
+        discovery.functioning_relays.add("wss://seed.example.com")
+        discovery.to_visit.push("wss://next.example.com", 1)
+        discovery.save_checkpoint()
+
+        probed = []
+
+        async def fake_probe(relay_url, harvest=True):
+            probed.append(relay_url)
+            return RelayProbeResult(error="timeout")
+
+        resumed = self.make_discovery(resume=True, retry_attempts=0)
+        with patch.object(resumed, "probe_relay", fake_probe):
+            asyncio.run(resumed.discover_relays())
+
+        self.assertEqual(probed, ["wss://next.example.com"])
+        self.assertEqual(resumed.failed_relays, {"wss://next.example.com"})
+
+    def test_resume_replays_journal_written_after_checkpoint(self):
+        discovery = self.make_discovery()
+        discovery.to_visit.push("wss://seed.example.com", 0)
+        discovery.to_visit.push("wss://other.example.com", 0)
+        discovery.save_checkpoint()
+
+        async def fake_probe(relay_url, harvest=True):
+            return RelayProbeResult(True, {"wss://next.example.com"}, 1)
+
+        async def crawl_one():
+            discovery.to_visit.pop()
+            discovery.visited_relays.add("wss://seed.example.com")
+            discovery.in_progress["wss://seed.example.com"] = 0
+            with patch.object(discovery, "probe_relay", fake_probe):
+                await discovery.process_relay("wss://seed.example.com", 0)
+            await discovery.journal.flush()
+
+        asyncio.run(crawl_one())
+        with open(discovery.journal.path, 'a') as f:
+            f.write('{"relay": "wss://trunc')
+
+        resumed = self.make_discovery(resume=True)
+        self.assertTrue(resumed.load_checkpoint())
+
+        self.assertEqual(
+            resumed.to_visit.items(),
+            [("wss://other.example.com", 0, 0), ("wss://next.example.com", 1, 0)],
+        )
+        self.assertEqual(resumed.functioning_relays, {"wss://seed.example.com"})
+        self.assertEqual(resumed.stats.total_relays_found, 1)
+        self.assertEqual(resumed.stats.events_processed, 1)
+
+    def test_compaction_writes_results_and_truncates_journal(self):
+        discovery = self.make_discovery()
+        discovery.functioning_relays.add("wss://seed.example.com")
+        discovery.record_outcome("wss://seed.example.com", 0, True)
+
+        async def flush_and_compact():
+            await discovery.journal.flush()
+            discovery.record_outcome("wss://late.example.com", 0, False)
+            await discovery.compact()
+
+        asyncio.run(flush_and_compact())
+
+        with open(self.output_file) as f:
+            self.assertEqual(json.load(f)["functioning_relays"], ["wss://seed.example.com"])
+        self.assertEqual(discovery.journal.read(), [])
+        self.assertEqual(discovery.journal.pending, [])
+
+    def test_completed_checkpoint_starts_a_new_crawl(self):
+        discovery = self.make_discovery()
+        discovery.save_checkpoint()
+
+        resumed = self.make_discovery(resume=True)
+        self.assertFalse(resumed.load_checkpoint())
+
+
+class ProbeSessionTests(unittest.TestCase):
+    def setUp(self):
+        self.discovery = NostrRelayDiscovery(
+            "wss://relay.example.com",
+            private_key="01".zfill(64),
+        )
+
+    def test_probe_and_harvest_share_one_connection(self):
+        websocket = FakeWebSocket(
+            [
+                json.dumps(["EVENT", "probe", {"kind": 1}]),
+                json.dumps(["EOSE", "probe"]),
+                json.dumps(
+                    ["EVENT", "harvest", {"kind": 3, "tags": [["r", "wss://next.example.com"]]}]
+                ),
+                json.dumps(["EOSE", "harvest"]),
+            ]
+        )
+
+        with patch.object(
+            self.discovery, "connect", return_value=websocket
+        ) as connect, patch.object(
+            self.discovery,
+            "generate_subscription_id",
+            side_effect=["probe", "harvest"],
+        ):
+            result = asyncio.run(
+                self.discovery.probe_relay("wss://relay.example.com")
+            )
+
+        self.assertTrue(result.functioning)
+        self.assertEqual(result.relays, {"wss://next.example.com"})
+        self.assertEqual(result.events, 1)
+        connect.assert_called_once()
+        self.assertEqual(
+            [message[:2] for message in websocket.sent],
+            [
+                ["REQ", "probe"],
+                ["CLOSE", "probe"],
+                ["REQ", "harvest"],
+                ["CLOSE", "harvest"],
+            ],
+        )
+
+    def test_harvest_streams_pubkeys_into_outbox_lookup_on_same_connection(self):
+        pubkey = "ab" * 32
+        follow_list = {"kind": 3, "tags": [["p", pubkey], ["r", "wss://next.example.com"]]}
+        websocket = FakeWebSocket(
+            [
+                json.dumps(["EOSE", "probe"]),
+                json.dumps(["EVENT", "harvest", follow_list]),
+                json.dumps(["EOSE", "harvest"]),
+                json.dumps(["EOSE", "outbox"]),
+            ]
+        )
+
+        with patch.object(
+            self.discovery, "connect", return_value=websocket
+        ), patch.object(
+            self.discovery,
+            "generate_subscription_id",
+            side_effect=["probe", "harvest", "outbox"],
+        ):
+            result = asyncio.run(
+                self.discovery.probe_relay("wss://relay.example.com")
+            )
+
+        self.assertEqual(result.relays, {"wss://next.example.com"})
+        outbox_request = websocket.sent[-2]
+        self.assertEqual(outbox_request[:2], ["REQ", "outbox"])
+        self.assertEqual(outbox_request[2]["authors"], [pubkey])
+
+    def test_probe_without_harvest_skips_follow_list_request(self):
+        websocket = FakeWebSocket([json.dumps(["EOSE", "probe"])])
+
+        with patch.object(
+            self.discovery, "connect", return_value=websocket
+        ), patch.object(
+            self.discovery, "generate_subscription_id", return_value="probe"
+        ):
+            result = asyncio.run(
+                self.discovery.probe_relay("wss://relay.example.com", harvest=False)
+            )
+
+        self.assertTrue(result.functioning)
+        self.assertEqual(result.events, 0)
+        self.assertEqual(
+            [message[0] for message in websocket.sent], ["REQ", "CLOSE"]
+        )
+
+
+    def test_probe_reports_notice_as_error_class(self):
+        for notice, error in [("rate-limited: slow down", "rate_limited"), ("restricted: paid relay", "notice")]:
+            websocket = FakeWebSocket([json.dumps(["NOTICE", notice])])
+
+            with patch.object(self.discovery, "connect", return_value=websocket):
+                result = asyncio.run(
+                    self.discovery.probe_relay("wss://relay.example.com")
+                )
+
+            self.assertFalse(result.functioning)
+            self.assertEqual(result.error, error)
+
+
+class HarvestPaginationTests(DiscoveryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.discovery = self.make_discovery("wss://relay.example.com", harvest_page_size=2)
+
+    @staticmethod
+    def follow_list(event_id, created_at):
+        return {"id": event_id, "kind": 3, "created_at": created_at, "tags": []}
+
+    def harvest(self, messages, subscription_ids):
+        websocket = FakeWebSocket([json.dumps(message) for message in messages])
+        events = []
+        with patch.object(
+            self.discovery, "generate_subscription_id", side_effect=subscription_ids
+        ):
+            asyncio.run(
+                self.discovery.collect_follow_events(
+                    websocket, "wss://relay.example.com", events.append
+                )
+            )
+        return websocket, events
+
+    def test_full_pages_continue_with_until(self):
+        websocket, events = self.harvest(
+            [
+                ["EVENT", "p1", self.follow_list("a", 300)],
+                ["EVENT", "p1", self.follow_list("b", 200)],
+                ["EOSE", "p1"],
+                ["EVENT", "p2", self.follow_list("b", 200)],
+                ["EVENT", "p2", self.follow_list("c", 100)],
+                ["EOSE", "p2"],
+                ["EVENT", "p3", self.follow_list("c", 100)],
+                ["EOSE", "p3"],
+            ],
+            ["p1", "p2", "p3"],
+        )
+
+        self.assertEqual([event["id"] for event in events], ["a", "b", "c"])
+        requests = [message[2] for message in websocket.sent if message[0] == "REQ"]
+        self.assertNotIn("until", requests[0])
+        self.assertEqual(requests[1]["until"], 200)
+        self.assertEqual(requests[2]["until"], 100)
+        self.assertEqual(
+            self.discovery.harvest_cursor("wss://relay.example.com"), 300
+        )
+
+    def test_event_budget_stops_pagination(self):
+        self.discovery.harvest_max_events = 2
+        websocket, events = self.harvest(
+            [
+                ["EVENT", "p1", self.follow_list("a", 300)],
+                ["EVENT", "p1", self.follow_list("b", 200)],
+                ["EOSE", "p1"],
+            ],
+            ["p1"],
+        )
+
+        self.assertEqual(len(events), 2)
+        self.assertEqual(
+            [message[0] for message in websocket.sent], ["REQ", "CLOSE"]
+        )
+
+    def test_budget_cut_harvest_leaves_a_gap_that_is_backfilled(self):
+        relay_url = "wss://relay.example.com"
+        self.discovery.state.section(relay_url, "harvest")["newest_created_at"] = 50
+        self.discovery.harvest_max_events = 2
+        self.harvest(
+            [
+                ["EVENT", "p1", self.follow_list("a", 300)],
+                ["EVENT", "p1", self.follow_list("b", 200)],
+                ["EOSE", "p1"],
+            ],
+            ["p1"],
+        )
+
+        # Events between 50 and 200 are still missing, so the cursor stays put
+        self.assertEqual(self.discovery.harvest_cursor(relay_url), 50)
+        self.assertEqual(self.discovery.harvest_backfill(relay_url), 200)
+
+        self.discovery.harvest_max_events = 1500
+        self.discovery.deduplicator = EventDeduplicator()
+        websocket, events = self.harvest(
+            [
+                ["EVENT", "p2", self.follow_list("d", 400)],
+                ["EOSE", "p2"],
+                ["EVENT", "p3", self.follow_list("b", 200)],
+                ["EVENT", "p3", self.follow_list("c", 100)],
+                ["EOSE", "p3"],
+                ["EVENT", "p4", self.follow_list("c", 100)],
+                ["EOSE", "p4"],
+            ],
+            ["p2", "p3", "p4"],
+        )
+
+        # New events come first, then the rest of the budget goes to the gap
+        requests = [message[2] for message in websocket.sent if message[0] == "REQ"]
+        self.assertEqual(requests[0]["since"], 300)
+        self.assertNotIn("until", requests[0])
+        self.assertEqual((requests[1]["since"], requests[1]["until"]), (50, 200))
+        self.assertEqual([event["id"] for event in events], ["d", "b", "c"])
+        self.assertEqual(self.discovery.harvest_cursor(relay_url), 400)
+        self.assertIsNone(self.discovery.harvest_backfill(relay_url))
+
+    def test_new_events_are_fetched_while_a_gap_remains(self):
+        relay_url = "wss://relay.example.com"
+        self.discovery.state.section(relay_url, "harvest").update(
+            newest_created_at=50, backfill_until=200, backfill_newest=300
+        )
+        self.discovery.harvest_max_events = 2
+        websocket, events = self.harvest(
+            [
+                ["EVENT", "p1", self.follow_list("e", 500)],
+                ["EOSE", "p1"],
+                ["EVENT", "p2", self.follow_list("f", 150)],
+                ["EOSE", "p2"],
+            ],
+            ["p1", "p2"],
+        )
+
+        self.assertEqual([event["id"] for event in events], ["e", "f"])
+        # The budget ran out inside the gap: the top moved up, the gap shrank
+        self.assertEqual(self.discovery.harvest_cursor(relay_url), 50)
+        self.assertEqual(self.discovery.harvest_backfill(relay_url), 150)
+        self.assertEqual(self.discovery.harvest_top(relay_url), 500)
+
+    def test_stored_cursor_requests_only_newer_events(self):
+        self.discovery.state.section("wss://relay.example.com", "harvest")[
+            "newest_created_at"
+        ] = 250
+        websocket, events = self.harvest(
+            [["EVENT", "p1", self.follow_list("a", 300)], ["EOSE", "p1"]],
+            ["p1"],
+        )
+
+        self.assertEqual(websocket.sent[0][2]["since"], 250)
+        self.assertEqual(
+            self.discovery.harvest_cursor("wss://relay.example.com"), 300
+        )
+
+        self.discovery.incremental_harvest = False
+        self.assertIsNone(self.discovery.harvest_cursor("wss://relay.example.com"))
+
+
+class CanonicalizeRelayUrlTests(unittest.TestCase):
+    def test_spellings_fold_to_one_interned_url(self):
+        spellings = [
+            "wss://relay.example.com",
+            " WSS://Relay.Example.COM/ ",
+            "wss://relay.example.com:443",
+            "wss://relay.example.com.",
+        ]
+        canonical = [canonicalize_relay_url(url) for url in spellings]
+
+        self.assertEqual(set(canonical), {"wss://relay.example.com"})
+        self.assertTrue(all(url is canonical[0] for url in canonical))
+
+    def test_idna_and_explicit_ports(self):
+        self.assertEqual(
+            canonicalize_relay_url("wss://bücher.example"),
+            "wss://xn--bcher-kva.example",
+        )
+        self.assertEqual(
+            canonicalize_relay_url("wss://relay.example.com:7447/"),
+            "wss://relay.example.com:7447",
+        )
+
+    def test_unusable_urls_are_rejected(self):
+        for url in [
+            None,
+            "",
+            "ws://relay.example.com",
+            "wss://relay.example.com/path",
+            "wss://user@relay.example.com",
+            "wss://relay.example.com:99999",
+            "wss://relay..example.com",
+            "wss://[::1]",
+        ]:
+            self.assertIsNone(canonicalize_relay_url(url), url)
+
+    def test_extraction_dedupes_spellings(self):
+        discovery = NostrRelayDiscovery(
+            "wss://relay.example.com", private_key="01".zfill(64)
+        )
+        relays = discovery.extract_relays_from_events(
+            [
+                {
+                    "kind": 3,
+                    "tags": [
+                        ["r", "wss://Relay.Example.com/"],
+                        ["p", "ab" * 32, "wss://relay.example.com:443"],
+                        ["r", "https://not-a-relay.example.com"],
+                    ],
+                }
+            ]
+        )
+
+        self.assertEqual(relays, {"wss://relay.example.com"})
+
+
+class RelayFrontierTests(unittest.TestCase):
+    def test_most_referenced_relay_is_popped_first_within_a_depth(self):
+        frontier = RelayFrontier()
+        frontier.push("wss://spam.example.com", 1)
+        frontier.push("wss://popular.example.com", 1)
+        frontier.push("wss://seed.example.com", 0)
+        frontier.add_reference("wss://spam.example.com", "alice")
+        frontier.add_reference("wss://spam.example.com", "alice")
+        for pubkey in ["alice", "bob", "carol"]:
+            frontier.add_reference("wss://popular.example.com", pubkey)
+
+        self.assertEqual(
+            [frontier.pop() for _ in range(len(frontier))],
+            [
+                ("wss://seed.example.com", 0),
+                ("wss://popular.example.com", 1),
+                ("wss://spam.example.com", 1),
+            ],
+        )
+        with self.assertRaises(IndexError):
+            frontier.pop()
+
+    def test_references_before_push_count_and_depth_only_decreases(self):
+        frontier = RelayFrontier()
+        frontier.add_reference("wss://early.example.com", "alice")
+        frontier.add_reference("wss://early.example.com", "bob")
+
+        self.assertTrue(frontier.push("wss://early.example.com", 3))
+        self.assertFalse(frontier.push("wss://early.example.com", 2))
+        self.assertFalse(frontier.push("wss://early.example.com", 4))
+        self.assertEqual(frontier.items(), [("wss://early.example.com", 2, 2)])
+
+    def test_raising_a_queued_relays_score_keeps_it_poppable(self):
+        frontier = RelayFrontier()
+        frontier.push("wss://other.example.com", 0, 7)
+        frontier.push("wss://relay.example.com", 0, 5)
+        self.assertFalse(frontier.push("wss://relay.example.com", 0, 10))
+        self.assertFalse(frontier.push("wss://relay.example.com", 1, 3))
+
+        self.assertEqual(
+            frontier.items(),
+            [("wss://relay.example.com", 0, 10), ("wss://other.example.com", 0, 7)],
+        )
+        self.assertEqual(frontier.pop(), ("wss://relay.example.com", 0))
+        self.assertEqual(frontier.pop(), ("wss://other.example.com", 0))
+
+    def test_stale_entries_are_compacted(self):
+        frontier = RelayFrontier()
+        frontier.push("wss://relay.example.com", 1)
+        for n in range(1000):
+            frontier.add_reference("wss://relay.example.com", f"pubkey-{n}")
+
+        self.assertLess(len(frontier.heap), 100)
+        self.assertEqual(frontier.pop(), ("wss://relay.example.com", 1))
+
+
+class EventDeduplicatorTests(unittest.TestCase):
+    def test_repeated_ids_are_dropped(self):
+        deduplicator = EventDeduplicator()
+        event = {"id": "a", "kind": 1, "pubkey": "p", "created_at": 1}
+
+        self.assertTrue(deduplicator.accept(event))
+        self.assertFalse(deduplicator.accept(dict(event)))
+
+    def test_only_newer_replaceable_versions_pass(self):
+        deduplicator = EventDeduplicator()
+
+        self.assertTrue(deduplicator.accept({"id": "b", "kind": 3, "pubkey": "p", "created_at": 200}))
+        self.assertFalse(deduplicator.accept({"id": "a", "kind": 3, "pubkey": "p", "created_at": 100}))
+        self.assertTrue(deduplicator.accept({"id": "c", "kind": 3, "pubkey": "p", "created_at": 300}))
+        self.assertTrue(deduplicator.accept({"id": "d", "kind": 10002, "pubkey": "p", "created_at": 100}))
+
+    def test_cache_is_bounded(self):
+        deduplicator = EventDeduplicator(max_size=2)
+        for event_id in ["a", "b", "c"]:
+            deduplicator.accept({"id": event_id, "kind": 1})
+
+        self.assertEqual(list(deduplicator.ids), ["b", "c"])
+        self.assertTrue(deduplicator.accept({"id": "a", "kind": 1}))
+
+    def test_harvest_drops_copies_seen_on_another_relay(self):
+        discovery = NostrRelayDiscovery(
+            "wss://relay.example.com", private_key="01".zfill(64)
+        )
+        follow_list = {"id": "a", "kind": 3, "pubkey": "p", "created_at": 1, "tags": []}
+
+        async def harvest(subscription_id):
+            websocket = FakeWebSocket(
+                [
+                    json.dumps(["EVENT", subscription_id, follow_list]),
+                    json.dumps(["EOSE", subscription_id]),
+                ]
+            )
+            events = []
+            with patch.object(
+                discovery, "generate_subscription_id", return_value=subscription_id
+            ):
+                await discovery.collect_follow_events(websocket, "wss://r.example.com", events.append)
+            return events
+
+        self.assertEqual(len(asyncio.run(harvest("one"))), 1)
+        self.assertEqual(asyncio.run(harvest("two")), [])
+        self.assertEqual(discovery.stats.duplicate_events_dropped, 1)
+
+
+class OutboxTests(unittest.TestCase):
+    def setUp(self):
+        self.discovery = NostrRelayDiscovery(
+            "wss://relay.example.com",
+            private_key="01".zfill(64),
+            outbox_chunk_size=2,
+            outbox_max_subscriptions=1,
+        )
+        self.pubkeys = [f"{n:064x}" for n in range(1, 4)]
+
+    def test_collect_pubkeys_dedupes_and_validates(self):
+        events = [
+            {"kind": 3, "tags": [["p", self.pubkeys[0]], ["p", "not-a-key"]]},
+            {"kind": 3, "tags": [["p", self.pubkeys[0]], ["p", self.pubkeys[1]]]},
+            {"kind": 10002, "tags": [["p", self.pubkeys[2]]]},
+        ]
+
+        self.assertEqual(self.discovery.collect_pubkeys(events), 2)
+        self.assertEqual(list(self.discovery.outbox_pubkeys), self.pubkeys[:2])
+
+    def test_outbox_lookups_are_chunked_and_refills_after_eose(self):
+        self.discovery.outbox_pubkeys.extend(self.pubkeys)
+        relay_list = {"kind": 10002, "tags": [["r", "wss://outbox.example.com"]]}
+        websocket = FakeWebSocket(
+            [
+                json.dumps(["EVENT", "o1", relay_list]),
+                json.dumps(["EOSE", "o1"]),
+                json.dumps(["CLOSED", "o2", "error: too many authors"]),
+            ]
+        )
+        events = []
+
+        with patch.object(
+            self.discovery, "generate_subscription_id", side_effect=["o1", "o2"]
+        ):
+            asyncio.run(
+                self.discovery.collect_outbox_events(
+                    websocket, "wss://relay.example.com", events.append
+                )
+            )
+
+        self.assertEqual(events, [relay_list])
+        requests = [message for message in websocket.sent if message[0] == "REQ"]
+        self.assertEqual(
+            [request[2]["authors"] for request in requests],
+            [self.pubkeys[:2], self.pubkeys[2:]],
+        )
+        self.assertEqual(self.discovery.stats.outbox_pubkeys_queried, 2)
+        # The refused chunk is left for another relay
+        self.assertEqual(list(self.discovery.outbox_pubkeys), self.pubkeys[2:])
+
+
+class FailureBackoffTests(DiscoveryTestCase):
+    def make_discovery(self, **kwargs):
+        return super().make_discovery(max_depth=0, **kwargs)
+
+    def test_backoff_doubles_with_each_failure(self):
+        discovery = self.make_discovery()
+        with patch("nostr_relay_discovery.time.time", return_value=1000):
+            discovery.record_failure("wss://dead.example.com", "dns")
+            first = discovery.next_eligible("wss://dead.example.com")
+            discovery.record_failure("wss://dead.example.com", "timeout")
+            second = discovery.next_eligible("wss://dead.example.com")
+
+        self.assertEqual(second - 1000, 2 * (first - 1000))
+        failures = discovery.state.get("wss://dead.example.com", "failures")
+        self.assertEqual(failures["count"], 2)
+        self.assertEqual(failures["last_error"], "timeout")
+
+        discovery.record_success("wss://dead.example.com")
+        self.assertEqual(discovery.next_eligible("wss://dead.example.com"), 0.0)
+
+    def test_relays_in_backoff_are_skipped_beyond_recheck_budget(self):
+        previous = self.make_discovery()
+        for relay_url in ["wss://dead1.example.com", "wss://dead2.example.com"]:
+            previous.record_failure(relay_url, "dns")
+        previous.state.save()
+
+        discovery = self.make_discovery(recheck_budget=1)
+        probed = []
+
+        async def fake_load():
+            for relay_url in [
+                "wss://alive.example.com",
+                "wss://dead1.example.com",
+                "wss://dead2.example.com",
+            ]:
+                discovery.to_visit.push(relay_url, 0)
+
+        async def fake_probe(relay_url, harvest=True):
+            probed.append(relay_url)
+            return RelayProbeResult(functioning=relay_url == "wss://alive.example.com")
+
+        with patch.object(discovery, "load_existing_results", fake_load), \
+                patch.object(discovery, "probe_relay", fake_probe):
+            asyncio.run(discovery.discover_relays())
+
+        self.assertEqual(probed, ["wss://alive.example.com", "wss://dead1.example.com"])
+        self.assertEqual(set(discovery.deferred), {"wss://dead2.example.com"})
+        self.assertEqual(discovery.stats.relays_deferred, 1)
+        failures = discovery.state.get("wss://dead1.example.com", "failures")
+        self.assertEqual(failures["count"], 2)
+
+    def test_known_failed_relays_are_requeued_from_the_state_file(self):
+        previous = self.make_discovery()
+        for relay_url in ["wss://revived.example.com", "wss://dead.example.com"]:
+            previous.record_failure(relay_url, "timeout")
+        previous.state.get("wss://revived.example.com", "failures")["next_eligible"] = time.time() - 1
+        previous.state.save()
+        with open(self.output_file, "w") as f:
+            json.dump({"functioning_relays": ["wss://alive.example.com"]}, f)
+
+        discovery = self.make_discovery(recheck_budget=0)
+        probed = []
+
+        async def fake_probe(relay_url, harvest=True):
+            probed.append(relay_url)
+            return RelayProbeResult(functioning=True)
+
+        # No event names the failed relays again; only the state file knows them
+        with patch.object(discovery, "probe_relay", fake_probe):
+            asyncio.run(discovery.discover_relays())
+
+        self.assertEqual(probed, ["wss://alive.example.com", "wss://revived.example.com"])
+        self.assertEqual(set(discovery.deferred), {"wss://dead.example.com"})
+        self.assertIsNone(discovery.state.get("wss://revived.example.com", "failures"))
+
+    def test_long_dead_relays_are_pruned_on_save(self):
+        day = 86400
+        now = 100 * day
+        discovery = self.make_discovery()
+        with patch("nostr_relay_discovery.time.time", return_value=now - 40 * day):
+            discovery.record_failure("wss://gone.example.com", "nxdomain")
+            discovery.record_failure("wss://revived.example.com", "timeout")
+        discovery.record_success("wss://revived.example.com")
+        discovery.state.section("wss://revived.example.com", "tiers")["tier"] = "req"
+        with patch("nostr_relay_discovery.time.time", return_value=now - 2 * day):
+            discovery.record_failure("wss://flaky.example.com", "timeout")
+        # The failure is old, but the history shows a probe last week
+        discovery.record_failure("wss://recent.example.com", "timeout")
+        discovery.state.get("wss://recent.example.com", "failures").update(last_failure=now - 40 * day, next_eligible=now - 10 * day)
+        # Not probed for 29 days, but its 30-day backoff has not run out yet
+        with patch("nostr_relay_discovery.time.time", return_value=now - 29 * day):
+            for _ in range(9):
+                discovery.record_failure("wss://backing-off.example.com", "timeout")
+        record_history(discovery.state.section("wss://recent.example.com", "history"), False, None, now - 7 * day)
+
+        with patch("nostr_relay_discovery.time.time", return_value=now):
+            discovery.save_results()
+
+        with open(self.state_file) as f:
+            relays = json.load(f)["relays"]
+        self.assertEqual(
+            set(relays),
+            {"wss://revived.example.com", "wss://flaky.example.com", "wss://recent.example.com", "wss://backing-off.example.com"},
+        )
+        self.assertEqual(relays["wss://backing-off.example.com"]["failures"]["count"], 9)
+
+
+class AdaptiveTimeoutTests(DiscoveryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.discovery = self.make_discovery(connection_timeout=10.0)
+
+    def test_timeouts_follow_percentile_within_bounds(self):
+        relay_url = "wss://relay.example.com"
+        self.assertEqual(self.discovery.relay_timeout(relay_url, "connect"), 10.0)
+
+        for seconds in [0.1, 0.2, 0.3]:
+            self.discovery.record_latency(relay_url, "connect", seconds)
+            self.discovery.record_latency(relay_url, "eose", seconds * 10)
+        self.assertEqual(self.discovery.relay_timeout(relay_url, "connect"), 1.0)
+        self.assertEqual(self.discovery.relay_timeout(relay_url, "eose"), 6.0)
+
+        for _ in range(3):
+            self.discovery.record_latency(relay_url, "first_frame", 40.0)
+        self.assertEqual(self.discovery.relay_timeout(relay_url, "first_frame"), 15.0)
+
+    def test_samples_are_bounded_and_survive_restart(self):
+        relay_url = "wss://relay.example.com"
+        for index in range(25):
+            self.discovery.record_latency(relay_url, "connect", index)
+        self.discovery.state.save()
+
+        restarted = self.make_discovery()
+        restarted.state.load()
+        samples = restarted.state.get(relay_url, "latency")["connect"]
+        self.assertEqual(samples, list(range(15, 25)))
+
+    def test_timeouts_grow_the_window_only_after_answers(self):
+        def timing_out(url, timings=None, raw=False):
+            raise asyncio.TimeoutError()
+
+        dead_url = "wss://dead.example.com"
+        with patch.object(self.discovery, "connect", side_effect=timing_out):
+            for _ in range(5):
+                result = asyncio.run(self.discovery.probe_relay(dead_url))
+        self.assertEqual(result.error, "timeout")
+        self.assertIsNone(self.discovery.state.get(dead_url, "latency"))
+        self.assertEqual(self.discovery.relay_timeout(dead_url, "connect"), 10.0)
+
+        slow_url = "wss://slow.example.com"
+        for seconds in [4.0, 4.5, 5.0]:
+            self.discovery.record_latency(slow_url, "connect", seconds)
+        with patch.object(self.discovery, "connect", side_effect=timing_out):
+            asyncio.run(self.discovery.probe_relay(slow_url))
+        self.assertEqual(self.discovery.state.get(slow_url, "latency")["connect"], [4.0, 4.5, 5.0, -10.0])
+        self.assertEqual(self.discovery.relay_timeout(slow_url, "connect"), 15.0)
+
+        # Once timeouts crowd out the answers the window falls back to the default
+        with patch.object(self.discovery, "connect", side_effect=timing_out):
+            for _ in range(10):
+                asyncio.run(self.discovery.probe_relay(slow_url))
+        self.assertEqual(self.discovery.relay_timeout(slow_url, "connect"), 10.0)
+
+
+class ConcurrencyControllerTests(unittest.TestCase):
+    def feed(self, controller, outcomes, latency=0.2, failed=False):
+        for _ in range(outcomes):
+            controller.record(latency, failed)
+
+    def test_stable_windows_raise_level_additively(self):
+        controller = ConcurrencyController(10, maximum=12)
+        self.feed(controller, 10)
+        self.assertEqual(controller.level, 11)
+        self.feed(controller, 11)
+        self.feed(controller, 12)
+        self.assertEqual(controller.level, 12)
+        self.assertEqual(controller.summary(), {"final": 12, "peak": 12, "adjustments": 2})
+
+    def test_error_spike_halves_level(self):
+        controller = ConcurrencyController(20)
+        self.feed(controller, 20)
+        self.feed(controller, 21, latency=None, failed=True)
+        self.assertEqual(controller.level, 10)
+
+    def test_latency_spike_halves_level(self):
+        controller = ConcurrencyController(20)
+        self.feed(controller, 20, latency=0.2)
+        self.feed(controller, 21, latency=1.0)
+        self.assertEqual(controller.level, 10)
+
+    def test_steady_share_of_dead_relays_is_not_congestion(self):
+        controller = ConcurrencyController(10)
+        for _ in range(5):
+            for index in range(controller.level):
+                controller.record(0.2, index % 3 == 0)
+        self.assertEqual(controller.level, 15)
+
+    def test_equal_bounds_keep_level_fixed(self):
+        discovery = NostrRelayDiscovery(
+            "wss://seed.example.com", batch_size=4, max_concurrency=4, private_key="01".zfill(64)
+        )
+        controller = discovery.concurrency
+        self.feed(controller, 50, failed=True)
+        self.assertTrue(controller.fixed)
+        self.assertEqual(controller.level, 4)
+
+
+class ProbeTimingTests(DiscoveryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.discovery = self.make_discovery()
+
+    async def probe_local_relay(self, hostname="127.0.0.1", probes=1, server_ssl=None, harvest=True):
+        async def relay(websocket):
+            async for message in websocket:
+                request = json.loads(message)
+                if request[0] != "REQ":
+                    continue
+                if request[2]["kinds"] == [1]:
+                    await websocket.send(json.dumps(["EOSE", request[1]]))
+                elif 3 in request[2]["kinds"]:
+                    follow_list = {"id": "f1", "pubkey": "ab" * 32, "kind": 3, "created_at": 1, "tags": []}
+                    await websocket.send(json.dumps(["EVENT", request[1], follow_list]))
+                    await websocket.send(json.dumps(["EOSE", request[1]]))
+                else:
+                    await websocket.send(json.dumps(["EOSE", request[1]]))
+
+        scheme = "wss" if server_ssl else "ws"
+        async with serve(relay, "127.0.0.1", 0, ssl=server_ssl) as server:
+            port = server.sockets[0].getsockname()[1]
+            results = [
+                await self.discovery.probe_relay(f"{scheme}://{hostname}:{port}", harvest)
+                for _ in range(probes)
+            ]
+        return results[0] if probes == 1 else results
+
+    def test_probe_records_each_phase_against_a_local_relay(self):
+        result = asyncio.run(self.probe_local_relay())
+
+        self.assertTrue(result.functioning)
+        timings = result.timings.as_dict()
+        for phase in ["dns", "tcp", "ws_upgrade", "first_frame", "eose"]:
+            self.assertGreaterEqual(timings[phase], 0.0)
+        self.assertNotIn("tls", timings)  # plain ws://
+        self.assertNotIn("auth", timings)
+        self.assertEqual(timings["events"], 1)
+        self.assertGreater(timings["bytes_received"], 100)
+        self.assertEqual(result.address, {"ip": "127.0.0.1", "family": "ipv4"})
+
+    def test_raw_probe_checks_liveness_without_websockets_client(self):
+        self.discovery.raw_probe = True
+
+        with patch("nostr_relay_discovery.websockets.connect", side_effect=AssertionError("websockets used")):
+            result = asyncio.run(self.probe_local_relay(harvest=False))
+
+        self.assertTrue(result.functioning)
+        timings = result.timings.as_dict()
+        self.assertIn("ws_upgrade", timings)
+        self.assertGreater(timings["bytes_received"], 0)
+        self.assertEqual(result.address, {"ip": "127.0.0.1", "family": "ipv4"})
+
+    def test_handshake_tier_sends_no_request(self):
+        async def probe():
+            received = []
+
+            async def relay(websocket):
+                async for message in websocket:
+                    received.append(message)
+
+            async with serve(relay, "127.0.0.1", 0) as server:
+                port = server.sockets[0].getsockname()[1]
+                result = await self.discovery.probe_tier(f"ws://127.0.0.1:{port}", "handshake")
+            return result, received
+
+        result, received = asyncio.run(probe())
+
+        self.assertTrue(result.functioning)
+        self.assertEqual(received, [])
+        self.assertNotIn("first_frame", result.timings.as_dict())
+
+    def test_connections_resolve_through_the_shared_resolver(self):
+        queries = []
+
+        async def stub_lookup(hostname):
+            queries.append(hostname)
+            return [(socket.AF_INET, "127.0.0.1")]
+
+        self.discovery.resolver = CachingResolver(stub_lookup)
+        result = asyncio.run(self.probe_local_relay("relay.test"))
+
+        self.assertTrue(result.functioning)
+        self.assertEqual(queries, ["relay.test"])
+
+    @unittest.skipUnless(shutil.which("openssl"), "needs openssl to make a test certificate")
+    def test_repeat_tls_connections_resume_the_session(self):
+        cert = os.path.join(self.tmpdir.name, "cert.pem")
+        key = os.path.join(self.tmpdir.name, "key.pem")
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+             "-keyout", key, "-out", cert, "-subj", "/CN=localhost",
+             "-addext", "subjectAltName=DNS:localhost"],
+            check=True, capture_output=True,
+        )
+        server_ssl = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_ssl.load_cert_chain(cert, key)
+        self.discovery.tls_context.load_verify_locations(cert)
+
+        async def stub_lookup(hostname):
+            return [(socket.AF_INET, "127.0.0.1")]
+
+        self.discovery.resolver = CachingResolver(stub_lookup)
+        first, second = asyncio.run(self.probe_local_relay("localhost", probes=2, server_ssl=server_ssl))
+
+        self.assertTrue(first.functioning and second.functioning)
+        self.assertIs(first.timings.tls_resumed, False)
+        self.assertIs(second.timings.tls_resumed, True)
+        self.assertGreaterEqual(first.timings.tls, 0.0)
+        self.assertEqual(self.discovery.tls_context.summary(), {"handshakes": 2, "resumed": 1})
+
+    def test_timings_are_written_to_results(self):
+        self.discovery.record_outcome("wss://relay.example.com", 0, True, timings={"dns": 0.01, "events": 2})
+        self.discovery.save_results()
+
+        with open(self.output_file) as f:
+            results = json.load(f)
+        self.assertEqual(results["relay_timings"], {"wss://relay.example.com": {"dns": 0.01, "events": 2}})
+
+
+class PrescreenTests(DiscoveryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.discovery = self.make_discovery(max_depth=0, prescreen=True)
+
+    def test_each_stage_reports_its_failure(self):
+        async def stub_lookup(hostname):
+            if hostname == "gone.example.com":
+                raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+            return [(socket.AF_INET, "127.0.0.1")]
+
+        self.discovery.resolver = CachingResolver(stub_lookup)
+
+        async def screen():
+            server = await asyncio.start_server(lambda reader, writer: writer.close(), "127.0.0.1", 0)
+            open_port = server.sockets[0].getsockname()[1]
+            closed = socket.socket()
+            closed.bind(("127.0.0.1", 0))
+            closed_port = closed.getsockname()[1]
+            closed.close()
+            async with server:
+                return [
+                    await self.discovery.prescreen_relay(f"ws://listening.example.com:{open_port}"),
+                    await self.discovery.prescreen_relay(f"ws://closed.example.com:{closed_port}"),
+                    await self.discovery.prescreen_relay("ws://gone.example.com"),
+                ]
+
+        self.assertEqual(asyncio.run(screen()), [None, ("tcp", "refused"), ("dns", "nxdomain")])
+
+    def test_dns_timeout_does_not_count_the_wait_for_a_lookup_slot(self):
+        async def stub_lookup(hostname):
+            if hostname.startswith("silent"):
+                await asyncio.sleep(0.2)
+                raise socket.gaierror(socket.EAI_AGAIN, "Temporary failure in name resolution")
+            await asyncio.sleep(0.05)
+            return [(socket.AF_INET, "127.0.0.1")]
+
+        # Two slots, both taken by lookups that never answer in time
+        self.discovery.resolver = CachingResolver(stub_lookup, max_in_flight=2)
+        self.discovery.prescreen_timeout = 0.1
+
+        async def screen():
+            server = await asyncio.start_server(lambda reader, writer: writer.close(), "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                return await asyncio.gather(
+                    self.discovery.prescreen_relay("ws://silent1.example.com"),
+                    self.discovery.prescreen_relay("ws://silent2.example.com"),
+                    self.discovery.prescreen_relay(f"ws://listening.example.com:{port}"),
+                )
+
+        self.assertEqual(asyncio.run(screen()), [("dns", "timeout"), ("dns", "timeout"), None])
+
+    def test_only_reachable_relays_are_probed(self):
+        outcomes = {
+            "wss://alive.example.com": None,
+            "wss://broken.example.com": None,
+            "wss://nxdomain.example.com": ("dns", "nxdomain"),
+            "wss://closed.example.com": ("tcp", "refused"),
+        }
+        probed = []
+
+        async def fake_load():
+            for relay_url in outcomes:
+                self.discovery.to_visit.push(relay_url, 0)
+
+        async def fake_prescreen(relay_url):
+            return outcomes[relay_url]
+
+        async def fake_probe(relay_url, harvest=True):
+            probed.append(relay_url)
+            return RelayProbeResult(functioning=relay_url == "wss://alive.example.com")
+
+        with patch.object(self.discovery, "load_existing_results", fake_load), \
+                patch.object(self.discovery, "prescreen_relay", fake_prescreen), \
+                patch.object(self.discovery, "probe_relay", fake_probe):
+            asyncio.run(self.discovery.discover_relays())
+
+        self.assertEqual(sorted(probed), ["wss://alive.example.com", "wss://broken.example.com"])
+        self.assertEqual(self.discovery.functioning_relays, {"wss://alive.example.com"})
+        self.assertEqual(self.discovery.stats.eliminated, {"dns": 1, "tcp": 1, "probe": 1})
+        failures = self.discovery.state.get("wss://closed.example.com", "failures")
+        self.assertEqual(failures["last_error"], "refused")
+        self.assertFalse(self.discovery.in_progress)
+
+    def test_prescreen_runs_at_its_own_concurrency(self):
+        self.discovery = self.make_discovery(
+            max_depth=0,
+            batch_size=5,
+            max_concurrency=5,
+            prescreen=True,
+            prescreen_concurrency=50,
+        )
+        relay_urls = [f"wss://r{index}.example.com" for index in range(100)]
+        screening = {"now": 0, "peak": 0}
+        probed = []
+
+        async def fake_load():
+            for relay_url in relay_urls:
+                self.discovery.to_visit.push(relay_url, 0)
+
+        async def fake_prescreen(relay_url):
+            screening["now"] += 1
+            screening["peak"] = max(screening["peak"], screening["now"])
+            await asyncio.sleep(0.01)
+            screening["now"] -= 1
+            # Most hosts are gone, as in a real crawl
+            return None if relay_url.endswith(("0.example.com", "5.example.com")) else ("dns", "nxdomain")
+
+        async def fake_probe(relay_url, harvest=True):
+            probed.append(relay_url)
+            await asyncio.sleep(0.01)
+            return RelayProbeResult(functioning=True)
+
+        with patch.object(self.discovery, "load_existing_results", fake_load), \
+                patch.object(self.discovery, "prescreen_relay", fake_prescreen), \
+                patch.object(self.discovery, "probe_relay", fake_probe):
+            asyncio.run(self.discovery.discover_relays())
+
+        self.assertEqual(screening["peak"], 50)
+        self.assertEqual(len(probed), 20)
+        self.assertEqual(self.discovery.stats.eliminated, {"dns": 80})
+
+
+class ProbeTierTests(DiscoveryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.discovery = self.make_discovery(max_depth=1, scheduled_tiers=True)
+        self.relay_url = "wss://relay.example.com"
+
+    def test_stable_relays_get_costly_tiers_only_when_due(self):
+        self.assertEqual(self.discovery.choose_tier(self.relay_url, 0), "harvest")
+
+        self.discovery.record_tier(self.relay_url, "harvest")
+        checked = self.discovery.state.get(self.relay_url, "tiers")
+        self.assertNotIn("nip11", checked)
+        self.assertEqual(self.discovery.choose_tier(self.relay_url, 0), "nip11")
+
+        self.discovery.record_tier(self.relay_url, "nip11")
+        self.assertEqual(self.discovery.choose_tier(self.relay_url, 0), "handshake")
+
+        checked["req"] -= 2 * 86400
+        self.assertEqual(self.discovery.choose_tier(self.relay_url, 0), "req")
+        checked["harvest"] -= 4 * 86400
+        self.assertEqual(self.discovery.choose_tier(self.relay_url, 0), "harvest")
+        self.assertEqual(self.discovery.choose_tier(self.relay_url, 1), "req")
+
+    def test_failing_relays_and_unscheduled_runs_get_the_top_tier(self):
+        self.discovery.record_tier(self.relay_url, "harvest")
+        self.discovery.record_tier(self.relay_url, "nip11")
+        self.discovery.record_failure(self.relay_url, "timeout")
+        self.assertEqual(self.discovery.choose_tier(self.relay_url, 0), "harvest")
+
+        self.discovery.record_success(self.relay_url)
+        self.discovery.scheduled_tiers = False
+        self.assertEqual(self.discovery.choose_tier(self.relay_url, 0), "harvest")
+        self.discovery.max_tier = "req"
+        self.assertEqual(self.discovery.choose_tier(self.relay_url, 0), "req")
+
+    def fetch_from_local_server(self, response: bytes):
+        async def fetch():
+            requests = []
+
+            async def handle(reader, writer):
+                requests.append(await reader.readuntil(b"\r\n\r\n"))
+                writer.write(response)
+                await writer.drain()
+                writer.close()
+
+            server = await asyncio.start_server(handle, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                result = await self.discovery.fetch_relay_info(f"ws://127.0.0.1:{port}")
+            return result, requests
+
+        return asyncio.run(fetch())
+
+    def test_nip11_document_marks_relay_functioning(self):
+        result, requests = self.fetch_from_local_server(
+            b'HTTP/1.1 200 OK\r\nContent-Type: application/nostr+json\r\n\r\n{"name": "test", "supported_nips": [1, 11]}'
+        )
+
+        self.assertTrue(result.functioning)
+        self.assertIn(b"Accept: application/nostr+json", requests[0])
+        self.assertEqual(result.address, {"ip": "127.0.0.1", "family": "ipv4"})
+
+    def test_missing_nip11_document_is_its_own_failure_class(self):
+        result, _ = self.fetch_from_local_server(b"HTTP/1.1 404 Not Found\r\n\r\nnot found")
+
+        self.assertFalse(result.functioning)
+        self.assertEqual(result.error, "nip11")
+
+    def test_process_relay_counts_and_records_tiers(self):
+        self.discovery.record_tier(self.relay_url, "harvest")
+        self.discovery.record_tier(self.relay_url, "nip11")
+        calls = []
+
+        async def fake_probe(relay_url, harvest=True, liveness=True):
+            calls.append((harvest, liveness))
+            return RelayProbeResult(functioning=True)
+
+        with patch.object(self.discovery, "probe_relay", fake_probe):
+            asyncio.run(self.discovery.process_relay(self.relay_url, 0))
+
+        self.assertEqual(calls, [(False, False)])
+        self.assertEqual(self.discovery.stats.probes_by_tier, {"handshake": 1})
+        self.assertEqual(self.discovery.build_results()["statistics"]["probes_by_tier"], {"handshake": 1})
+
+
+class DaemonTests(DiscoveryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.discovery = self.make_discovery(
+            max_depth=0,
+            compact_interval=0.05,
+            daemon_min_interval=0.05,
+            daemon_max_interval=0.2,
+        )
+
+    def test_intervals_grow_while_stable_and_back_off_while_failing(self):
+        relay_url = "wss://relay.example.com"
+        intervals = []
+        for _ in range(4):
+            intervals.append(self.discovery.check_interval(relay_url, True))
+            self.discovery.schedule_check(relay_url, 0, True)
+        self.assertEqual(intervals, [0.05, 0.1, 0.2, 0.2])
+
+        self.discovery.record_failure(relay_url, "timeout")
+        self.discovery.schedule_check(relay_url, 0, False)
+        self.discovery.record_failure(relay_url, "timeout")
+        self.assertEqual(self.discovery.check_interval(relay_url, False), 0.1)
+        self.assertNotIn(relay_url, self.discovery.check_streaks)
+
+        # Only the latest check counts, within the jitter of its interval
+        due = self.discovery.next_check[relay_url]
+        self.assertLessEqual(due - time.time(), 0.05 * 1.2)
+        self.assertEqual(len(self.discovery.checks), 5)
+        self.assertAlmostEqual(self.discovery.time_to_next_check(), max(0.0, due - time.time()), delta=0.01)
+
+    def test_daemon_keeps_reprobing_and_results_fresh(self):
+        probes = {"wss://steady.example.com": 0, "wss://flaky.example.com": 0}
+
+        async def fake_load():
+            for relay_url in probes:
+                self.discovery.to_visit.push(relay_url, 0)
+
+        async def fake_probe_tier(relay_url, tier):
+            probes[relay_url] += 1
+            alive = relay_url == "wss://steady.example.com" or probes[relay_url] == 1
+            return RelayProbeResult(functioning=alive)
+
+        self.discovery.deadline = time.time() + 1.0
+        self.discovery.drain_window = 0.1
+        with patch.object(self.discovery, "load_existing_results", fake_load), \
+                patch.object(self.discovery, "probe_tier", fake_probe_tier):
+            asyncio.run(self.discovery.run_daemon())
+
+        self.assertGreaterEqual(probes["wss://steady.example.com"], 4)
+        self.assertGreaterEqual(probes["wss://flaky.example.com"], 2)
+        self.assertEqual(self.discovery.functioning_relays, {"wss://steady.example.com"})
+        self.assertIn("wss://flaky.example.com", self.discovery.failed_relays)
+        self.assertFalse(self.discovery.monitoring)
+        with open(self.output_file) as f:
+            self.assertEqual(json.load(f)["functioning_relays"], ["wss://steady.example.com"])
+
+
+class HealthHistoryTests(DiscoveryTestCase):
+    DAY = 86400
+
+    def test_days_roll_over_and_old_days_drop_off(self):
+        history = {}
+        record_history(history, True, 0.2, 10 * self.DAY)
+        record_history(history, False, None, 10 * self.DAY + 60)
+        record_history(history, True, 0.4, 12 * self.DAY)
+        self.assertEqual(history, {"day": 12, "probes": [2, 0, 1], "ok": [1, 0, 1], "latency_ms": [200, 0, 400]})
+
+        record_history(history, True, 0.1, 100 * self.DAY)
+        self.assertEqual(len(history["probes"]), 28)
+        self.assertEqual(sum(history["probes"]), 1)
+
+    def test_scores_decay_old_outcomes(self):
+        recent_failures, old_failures = {}, {}
+        for day in range(14):
+            record_history(recent_failures, day < 7, 0.1, day * self.DAY)
+            record_history(old_failures, day >= 7, 0.3, day * self.DAY)
+
+        recent = health_scores(recent_failures, 13 * self.DAY)
+        old = health_scores(old_failures, 13 * self.DAY)
+        self.assertLess(recent["uptime"], 0.5)
+        self.assertGreater(old["uptime"], 0.5)
+        self.assertEqual(old["latency_ms"], 300)
+        self.assertEqual(old["probes"], 14)
+        self.assertIsNone(health_scores({"day": 1, "probes": [3], "ok": [0], "latency_ms": [0]}, self.DAY)["latency_ms"])
+
+    def test_outcomes_build_history_and_order_the_next_run(self):
+        discovery = self.make_discovery()
+
+        async def fake_probe(relay_url, harvest=True):
+            return RelayProbeResult(functioning=relay_url != "wss://flaky.example.com", latency=0.25)
+
+        for relay_url in ["wss://flaky.example.com", "wss://steady.example.com"]:
+            discovery.visited_relays.add(relay_url)
+            with patch.object(discovery, "probe_relay", fake_probe):
+                asyncio.run(discovery.process_relay(relay_url, 1))
+        discovery.save_results()
+
+        with open(self.output_file) as f:
+            health = json.load(f)["relay_health"]
+        self.assertEqual(health["wss://steady.example.com"], {"uptime": 1.0, "latency_ms": 250, "probes": 1})
+        self.assertEqual(health["wss://flaky.example.com"]["uptime"], 0.0)
+
+        restarted = self.make_discovery()
+        with open(self.output_file, "w") as f:
+            json.dump({"functioning_relays": ["wss://flaky.example.com", "wss://steady.example.com"]}, f)
+        restarted.state.load()
+        asyncio.run(restarted.load_existing_results())
+        self.assertEqual(restarted.to_visit.pop()[0], "wss://steady.example.com")
+
+
+class RetryTests(DiscoveryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.discovery = self.make_discovery(max_depth=0, batch_size=1, retry_delay=0.01)
+
+    def crawl(self, errors):
+        """Run a crawl where each relay fails with the next error in its list, then answers"""
+        probed = []
+
+        async def fake_load():
+            for relay_url in errors:
+                self.discovery.to_visit.push(relay_url, 0)
+
+        async def fake_probe(relay_url, harvest=True):
+            attempt = sum(1 for probed_url in probed if probed_url == relay_url)
+            probed.append(relay_url)
+            if attempt < len(errors[relay_url]):
+                return RelayProbeResult(error=errors[relay_url][attempt])
+            return RelayProbeResult(functioning=True)
+
+        with patch.object(self.discovery, "load_existing_results", fake_load), \
+                patch.object(self.discovery, "probe_relay", fake_probe):
+            asyncio.run(self.discovery.discover_relays())
+        return probed
+
+    def test_transient_failure_is_retried_without_holding_up_others(self):
+        probed = self.crawl({"wss://blip.example.com": ["timeout"], "wss://other.example.com": []})
+
+        self.assertEqual(probed, ["wss://blip.example.com", "wss://other.example.com", "wss://blip.example.com"])
+        self.assertEqual(self.discovery.functioning_relays, {"wss://blip.example.com", "wss://other.example.com"})
+        self.assertIsNone(self.discovery.state.get("wss://blip.example.com", "failures"))
+        self.assertEqual((self.discovery.stats.retries_scheduled, self.discovery.stats.retries_recovered), (1, 1))
+        self.assertEqual(self.discovery.state.get("wss://blip.example.com", "history")["probes"], [1])
+
+    def test_permanent_failures_and_exhausted_retries_are_recorded(self):
+        probed = self.crawl({
+            "wss://refused.example.com": ["refused"],
+            "wss://down.example.com": ["timeout", "rate_limited", "timeout"],
+        })
+
+        self.assertEqual(probed.count("wss://refused.example.com"), 1)
+        self.assertEqual(probed.count("wss://down.example.com"), 3)
+        self.assertEqual(self.discovery.failed_relays, {"wss://refused.example.com", "wss://down.example.com"})
+        self.assertEqual(self.discovery.state.get("wss://down.example.com", "failures")["last_error"], "timeout")
+        self.assertFalse(self.discovery.retrying)
+
+    def test_retries_stop_short_of_the_deadline(self):
+        self.discovery.deadline = time.time() + self.discovery.drain_window + 0.03
+        self.assertFalse(self.discovery.schedule_retry("wss://late.example.com", 0, "rate_limited"))
+
+    def test_pending_retries_are_probed_after_resume(self):
+        relay_url = "wss://late.example.com"
+        self.discovery.visited_relays.add(relay_url)
+        self.discovery.in_progress[relay_url] = 0
+        self.assertTrue(self.discovery.schedule_retry(relay_url, 0, "timeout"))
+        self.discovery.save_checkpoint()
+
+        checkpoint = self.discovery.build_checkpoint()
+        self.assertEqual([url for url, *_ in checkpoint["frontier"]], [relay_url])
+        self.assertNotIn(relay_url, checkpoint["visited_relays"])
+
+        resumed = self.make_discovery(max_depth=0, resume=True)
+        probed = []
+
+        async def fake_probe(url, harvest=True):
+            probed.append(url)
+            return RelayProbeResult(functioning=True)
+
+        with patch.object(resumed, "probe_relay", fake_probe):
+            asyncio.run(resumed.discover_relays())
+
+        self.assertEqual(probed, [relay_url])
+        self.assertEqual(resumed.functioning_relays, {relay_url})
+
+    def test_rediscovered_relay_waits_for_its_retry(self):
+        relay_url = "wss://late.example.com"
+        self.assertTrue(self.discovery.schedule_retry(relay_url, 0, "timeout"))
+        self.assertEqual(self.discovery.enqueue_relays([relay_url], 1), [])
+        self.assertNotIn(relay_url, self.discovery.to_visit)
+
+    def test_failures_are_classified_as_transient_or_permanent(self):
+        self.assertEqual(classify_failure(socket.gaierror(socket.EAI_NONAME, "no such name")), "nxdomain")
+        self.assertEqual(classify_failure(socket.gaierror(socket.EAI_AGAIN, "try again")), "dns")
+        self.assertEqual(classify_failure(RawWebSocketError("upgrade refused", 429)), "rate_limited")
+        self.assertEqual(classify_failure(RawWebSocketError("upgrade refused", 404)), "handshake")
+        self.assertEqual(classify_failure(ConnectionResetError()), "network")
+
+
 if __name__ == "__main__":
     unittest.main()
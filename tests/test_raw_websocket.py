@@ -0,0 +1,78 @@
+import asyncio
+import http
+import unittest
+
+from websockets.asyncio.server import serve
+
+from raw_websocket import RawWebSocket, RawWebSocketClosed, RawWebSocketError
+
+
+class RawWebSocketTests(unittest.TestCase):
+    def run_against(self, handler, client, **server_options):
+        async def run():
+            async with serve(handler, "127.0.0.1", 0, **server_options) as server:
+                port = server.sockets[0].getsockname()[1]
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                try:
+                    websocket = await RawWebSocket.open(reader, writer, f"127.0.0.1:{port}", "/")
+                except BaseException:
+                    writer.close()
+                    raise
+                async with websocket:
+                    return await client(websocket)
+
+        return asyncio.run(run())
+
+    def test_masked_messages_of_every_length_encoding_round_trip(self):
+        async def echo(websocket):
+            async for message in websocket:
+                await websocket.send(message)
+
+        async def client(websocket):
+            replies = []
+            for size in [0, 5, 125, 126, 70_000]:
+                message = "x" * size
+                await websocket.send(message)
+                replies.append(await websocket.recv())
+            return replies, websocket.bytes_received
+
+        replies, bytes_received = self.run_against(echo, client)
+        self.assertEqual([len(reply) for reply in replies], [0, 5, 125, 126, 70_000])
+        self.assertGreater(bytes_received, 70_000)
+
+    def test_pings_are_answered_and_fragments_joined(self):
+        async def handler(websocket):
+            pong = await websocket.ping()
+            await websocket.send(["frag", "mented"])
+            await asyncio.wait_for(pong, 1)
+            await websocket.send("pong seen")
+
+        async def client(websocket):
+            return [await websocket.recv(), await websocket.recv()]
+
+        self.assertEqual(self.run_against(handler, client), ["fragmented", "pong seen"])
+
+    def test_close_from_server_raises_closed(self):
+        async def handler(websocket):
+            await websocket.close(4000, "bye")
+
+        async def client(websocket):
+            with self.assertRaises(RawWebSocketClosed) as caught:
+                await websocket.recv()
+            return caught.exception.code
+
+        self.assertEqual(self.run_against(handler, client), 4000)
+
+    def test_refused_upgrade_raises(self):
+        def refuse(connection, request):
+            return connection.respond(http.HTTPStatus.NOT_FOUND, "no relay here\n")
+
+        async def client(websocket):
+            return None
+
+        with self.assertRaises(RawWebSocketError):
+            self.run_against(lambda websocket: None, client, process_request=refuse)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,258 @@
+import asyncio
+import os
+import socket
+import struct
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from relay_dns import QTYPE_A, QTYPE_AAAA, CachingResolver, DNSClient
+
+
+class StubLookup:
+    """Local stand-in for the system resolver that counts its queries"""
+
+    def __init__(self, answers, delay=0.0):
+        self.answers = answers
+        self.delay = delay
+        self.queries = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, hostname):
+        self.queries.append(hostname)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        if hostname not in self.answers:
+            raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+        return self.answers[hostname]
+
+
+class CachingResolverTests(unittest.TestCase):
+    def setUp(self):
+        self.lookup = StubLookup({
+            "relay.example.com": [(socket.AF_INET, "203.0.113.7"), (socket.AF_INET6, "2001:db8::7")],
+        })
+
+    def test_answers_are_reused_until_they_expire(self):
+        resolver = CachingResolver(self.lookup, positive_ttl=60)
+
+        async def resolve_twice():
+            first = await resolver.resolve("Relay.Example.com")
+            second = await resolver.resolve("relay.example.com")
+            return first, second
+
+        with patch("relay_dns.time.time", return_value=1000):
+            first, second = asyncio.run(resolve_twice())
+        self.assertEqual(first, second)
+        self.assertEqual(self.lookup.queries, ["relay.example.com"])
+
+        with patch("relay_dns.time.time", return_value=1061):
+            asyncio.run(resolver.resolve("relay.example.com"))
+        self.assertEqual(len(self.lookup.queries), 2)
+        self.assertEqual((resolver.hits, resolver.misses), (1, 2))
+
+    def test_failures_are_cached_for_the_negative_ttl(self):
+        resolver = CachingResolver(self.lookup, negative_ttl=30)
+
+        for _ in range(2):
+            with self.assertRaises(socket.gaierror):
+                asyncio.run(resolver.resolve("dead.example.com"))
+        self.assertEqual(self.lookup.queries, ["dead.example.com"])
+
+    def test_resolver_failures_are_not_cached(self):
+        resolver = CachingResolver(self.lookup)
+
+        async def failing_lookup(hostname):
+            self.lookup.queries.append(hostname)
+            raise socket.gaierror(socket.EAI_AGAIN, "Temporary failure in name resolution")
+
+        resolver.lookup = failing_lookup
+        for _ in range(2):
+            with self.assertRaises(socket.gaierror):
+                asyncio.run(resolver.resolve("flaky.example.com"))
+        self.assertEqual(self.lookup.queries, ["flaky.example.com"] * 2)
+
+    def test_concurrent_lookups_are_coalesced_and_bounded(self):
+        self.lookup.answers.update({f"r{index}.example.com": [(socket.AF_INET, "203.0.113.1")] for index in range(10)})
+        self.lookup.delay = 0.01
+        resolver = CachingResolver(self.lookup, max_in_flight=3)
+        hostnames = [f"r{index}.example.com" for index in range(10)] * 2
+
+        async def resolve_all():
+            return await asyncio.gather(*(resolver.resolve(hostname) for hostname in hostnames))
+
+        asyncio.run(resolve_all())
+        self.assertEqual(len(self.lookup.queries), 10)
+        self.assertLessEqual(self.lookup.max_in_flight, 3)
+
+    def test_ip_literals_skip_the_lookup(self):
+        resolver = CachingResolver(self.lookup)
+        self.assertEqual(asyncio.run(resolver.resolve("127.0.0.1")), [(socket.AF_INET, "127.0.0.1")])
+        self.assertEqual(asyncio.run(resolver.resolve("[::1]")), [(socket.AF_INET6, "::1")])
+        self.assertEqual(self.lookup.queries, [])
+
+    def test_cache_file_is_shared_between_resolvers(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache_file = os.path.join(tmpdir, "dns_cache.json")
+            writer = CachingResolver(self.lookup, cache_file=cache_file)
+            asyncio.run(writer.resolve("relay.example.com"))
+            with self.assertRaises(socket.gaierror):
+                asyncio.run(writer.resolve("dead.example.com"))
+            writer.save()
+
+            reader = CachingResolver(StubLookup({}), cache_file=cache_file)
+            reader.load()
+            addresses = asyncio.run(reader.resolve("relay.example.com"))
+            with self.assertRaises(socket.gaierror):
+                asyncio.run(reader.resolve("dead.example.com"))
+
+        self.assertEqual(addresses, [(socket.AF_INET, "203.0.113.7"), (socket.AF_INET6, "2001:db8::7")])
+        self.assertEqual(reader.lookup.queries, [])
+
+
+class StandInDNSServer:
+    """Local UDP and TCP nameserver answering from a fixed zone"""
+
+    def __init__(self, zone, drop_first=0, truncate_udp=False):
+        self.zone = zone  # hostname -> {qtype: [ip, ...]}
+        self.drop_first = drop_first
+        self.truncate_udp = truncate_udp
+        self.udp_queries = []  # (client address, query id)
+        self.tcp_queries = 0
+
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        self.tcp_server = await asyncio.start_server(self.handle_tcp, "127.0.0.1", 0)
+        self.port = self.tcp_server.sockets[0].getsockname()[1]
+        server = self
+
+        class Protocol(asyncio.DatagramProtocol):
+            def connection_made(self, transport):
+                self.transport = transport
+
+            def datagram_received(self, data, addr):
+                server.udp_queries.append((addr, struct.unpack_from("!H", data)[0]))
+                if len(server.udp_queries) <= server.drop_first:
+                    return
+                self.transport.sendto(server.answer(data, truncated=server.truncate_udp), addr)
+
+        self.udp_transport, _ = await loop.create_datagram_endpoint(
+            Protocol, local_addr=("127.0.0.1", self.port)
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.udp_transport.close()
+        self.tcp_server.close()
+        await self.tcp_server.wait_closed()
+
+    async def handle_tcp(self, reader, writer):
+        self.tcp_queries += 1
+        length = struct.unpack("!H", await reader.readexactly(2))[0]
+        answer = self.answer(await reader.readexactly(length))
+        writer.write(struct.pack("!H", len(answer)) + answer)
+        await writer.drain()
+        writer.close()
+
+    def answer(self, query, truncated=False):
+        query_id = struct.unpack_from("!H", query)[0]
+        offset, labels = 12, []
+        while query[offset]:
+            labels.append(query[offset + 1:offset + 1 + query[offset]].decode())
+            offset += 1 + query[offset]
+        question_end = offset + 5
+        qtype = struct.unpack_from("!H", query, offset + 1)[0]
+        records = self.zone.get(".".join(labels))
+
+        flags = 0x8180 | (0x0200 if truncated else 0)
+        if records is None:
+            flags |= 3  # NXDOMAIN
+        answers = [] if truncated else (records or {}).get(qtype, [])
+        family = socket.AF_INET if qtype == QTYPE_A else socket.AF_INET6
+        message = struct.pack("!HHHHHH", query_id, flags, 1, len(answers), 0, 0) + query[12:question_end]
+        for ip in answers:
+            rdata = socket.inet_pton(family, ip)
+            message += struct.pack("!HHHIH", 0xC00C, qtype, 1, 300, len(rdata)) + rdata
+        return message
+
+
+class DNSClientTests(unittest.TestCase):
+    zone = {
+        "relay.example.com": {QTYPE_A: ["203.0.113.7"], QTYPE_AAAA: ["2001:db8::7"]},
+        "v4only.example.com": {QTYPE_A: ["203.0.113.8", "203.0.113.9"]},
+    }
+
+    def run_with_server(self, scenario, **server_options):
+        async def run():
+            async with StandInDNSServer(self.zone, **server_options) as server:
+                client = DNSClient(f"127.0.0.1:{server.port}", timeout=0.2)
+                try:
+                    return server, await scenario(client)
+                finally:
+                    client.close()
+
+        return asyncio.run(run())
+
+    def test_a_and_aaaa_answers(self):
+        _, addresses = self.run_with_server(lambda client: client.lookup("relay.example.com"))
+        self.assertEqual(
+            addresses, [(socket.AF_INET6, "2001:db8::7"), (socket.AF_INET, "203.0.113.7")]
+        )
+
+    def test_nxdomain_raises_gaierror(self):
+        async def scenario(client):
+            with self.assertRaises(socket.gaierror):
+                await client.lookup("missing.example.com")
+
+        self.run_with_server(scenario)
+
+    def test_queries_are_pipelined_on_one_socket(self):
+        async def scenario(client):
+            return await asyncio.gather(*(client.lookup("v4only.example.com") for _ in range(20)))
+
+        server, answers = self.run_with_server(scenario)
+        self.assertTrue(all(answer == answers[0] for answer in answers))
+        self.assertEqual(len(server.udp_queries), 40)
+        self.assertEqual(len({address for address, _ in server.udp_queries}), 1)
+        self.assertEqual(len({query_id for _, query_id in server.udp_queries}), 40)
+
+    def test_lost_queries_are_retried(self):
+        server, addresses = self.run_with_server(
+            lambda client: client.query("v4only.example.com", QTYPE_A), drop_first=1
+        )
+        self.assertEqual(addresses, ["203.0.113.8", "203.0.113.9"])
+        self.assertEqual(len(server.udp_queries), 2)
+
+    def test_unanswered_query_times_out(self):
+        async def scenario(client):
+            with self.assertRaises(asyncio.TimeoutError):
+                await client.query("relay.example.com", QTYPE_A)
+
+        server, _ = self.run_with_server(scenario, drop_first=10)
+        self.assertEqual(len(server.udp_queries), 3)
+
+    def test_truncated_answer_falls_back_to_tcp(self):
+        server, addresses = self.run_with_server(
+            lambda client: client.query("relay.example.com", QTYPE_AAAA), truncate_udp=True
+        )
+        self.assertEqual(addresses, ["2001:db8::7"])
+        self.assertEqual(server.tcp_queries, 1)
+
+    def test_client_plugs_into_caching_resolver(self):
+        async def scenario(client):
+            resolver = CachingResolver(client.lookup)
+            await resolver.resolve("relay.example.com")
+            return await resolver.resolve("relay.example.com")
+
+        server, addresses = self.run_with_server(scenario)
+        self.assertEqual(len(addresses), 2)
+        self.assertEqual(len(server.udp_queries), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
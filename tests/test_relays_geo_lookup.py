@@ -0,0 +1,58 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from relays_geo_lookup import GeoIPDatabase, load_known_addresses, resolve_and_locate
+
+
+def make_database():
+    db = GeoIPDatabase("unused.csv")
+    # 203.0.113.0/24
+    db.starts = [3405803776]
+    db.ends = [3405804031]
+    db.locations = [("52.52", "13.40")]
+    db.loaded = True
+    return db
+
+
+class KnownAddressTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.results_file = os.path.join(self.tmpdir.name, "results.json")
+        with open(self.results_file, "w") as f:
+            json.dump(
+                {
+                    "relay_addresses": {
+                        "wss://relay.example.com": {"ip": "203.0.113.7", "family": "ipv4"},
+                        "wss://v6.example.com/nostr": {"ip": "2001:db8::1", "family": "ipv6"},
+                    }
+                },
+                f,
+            )
+
+    def test_only_ipv4_addresses_are_loaded_by_hostname(self):
+        self.assertEqual(
+            load_known_addresses(self.results_file), {"relay.example.com": "203.0.113.7"}
+        )
+
+    def test_recorded_address_skips_dns(self):
+        known = load_known_addresses(self.results_file)
+
+        async def locate():
+            loop = asyncio.get_running_loop()
+            with patch.object(loop, "getaddrinfo", side_effect=AssertionError("DNS used")):
+                return await resolve_and_locate(
+                    "relay.example.com", "relay.example.com", make_database(), known
+                )
+
+        self.assertEqual(
+            asyncio.run(locate()), ("relay.example.com", "52.52", "13.40")
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()